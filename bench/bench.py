@@ -0,0 +1,693 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import subprocess
+import contextlib
+
+
+# Benchmark harness for the interpereters in src/
+#
+# Every benchmark is a program from example/ or a scaled up version of one,
+# generated into a scratch directory. Each one is run against src/risc.py,
+# src/risc.py --jit and, when the program only uses what the trimmed
+# interpereter understands, against src/risc.py --dialect trimmed as well.
+# For each run we report:
+#   instructions        - Instructions executed (counted in a separate run)
+#   ips                 - Instructions per second of the interpereter loop
+#   run                 - Seconds spent in run(), in process
+#   wall                - Seconds for the whole `python interpereter file` process,
+#                         parsing the program every time
+#   startup             - Seconds for the same process running a single HLT
+#   memory              - Peak resident memory of the process in KiB
+#
+# Results can be saved as a baseline and later runs compared against it.
+#
+# With --conformance nothing is timed. Every program with a trimmed version
+# is run on trimmed_reference.py, the trimmed interpereter as it was before
+# it became a dialect, and has to print exactly the same bytes in both
+# dialects of src/risc.py, in process and as its own process. So do a few
+# hundred random trimmed programs, in process only. Every
+# benchmark, and a few hundred random programs which jump and return all
+# over the place, also has to print the same and stop on the same error as a
+# module written by --emit-python as it does on the interpereter. Every
+# benchmark is also recorded with jit() on, and has to replay to the same
+# state a plain run is in.
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+EXAMPLES = os.path.join(ROOT, 'example')
+# Processes never use the program cache, so every run parses its program the
+# same way and nothing is left behind in the user's cache
+INTERPERETERS = {
+    'risc':[os.path.join(SRC, 'risc.py'), '--no-cache'],
+    'jit':[os.path.join(SRC, 'risc.py'), '--no-cache', '--jit'],
+    'trimmed':[os.path.join(SRC, 'risc.py'), '--no-cache', '--dialect', 'trimmed']
+}
+
+sys.path.insert(0, SRC)
+import risc
+import trimmed_reference
+
+
+# Print the integer value of every argument, one per line. The atoi example
+# stops on an error before it gets anywhere, so the benchmark uses its own.
+ATOI = """\
+'void main(int argc, char **argv)
+        MOV 1 BAK           'BAK is the argument index
+MAIN:   MOV BAK ACC
+        SUB [0]
+        JGZ EXIT            'Stop after the last argument
+        PSH BAK             'Save the index
+        PSH [BAK]           'Pass argv[i]
+        CLL ATOI
+        INP ACC
+        CHP 10
+        POP
+        MOV [STP] BAK       'Restore the index
+        POP
+        MOV BAK ACC
+        ADD 1
+        MOV ACC BAK
+        JMP MAIN
+EXIT:   HLT
+
+'int atoi(char *string)
+ATOI:   PSH 0               'Result, SFP + 1
+        MOV BSP ACC
+        SUB 1
+        MOV [ACC] ACC
+        PSH ACC             'String pointer, SFP + 2
+ALOP:   MOV [STP] ACC
+        MOV [ACC] ACC       'Current character
+        JEZ AEND
+        SUB 48
+        PSH ACC             'Digit, top of the stack
+        MOV SFP ACC
+        ADD 1
+        MOV ACC BAK         'BAK points at the result
+        MOV [BAK] ACC
+        ADD ACC             'result * 2
+        PSH ACC
+        ADD ACC             'result * 4
+        ADD ACC             'result * 8
+        ADD [STP]           'result * 10
+        POP
+        ADD [STP]           'result * 10 + digit
+        MOV ACC [BAK]
+        POP
+        MOV [STP] ACC       'Next character
+        ADD 1
+        MOV ACC [STP]
+        JMP ALOP
+AEND:   MOV SFP ACC
+        ADD 1
+        MOV [ACC] ACC       'Return the result in ACC
+        RET
+"""
+
+# Call a function recursively depth times, every call pushes one argument
+DEEP = """\
+        MOV {depth} ACC
+        PSH ACC
+        CLL F
+        INP STP
+        HLT
+F:      MOV BSP ACC
+        SUB 1
+        MOV [ACC] ACC
+        JEZ DONE
+        SUB 1
+        PSH ACC
+        CLL F
+        POP
+DONE:   RET
+"""
+
+# Count to n in ACC, written for the trimmed interpereter (jumps are counted
+# from 1, no tags, no comments)
+COUNT = """\
+MOV 0 ACC
+ADD 1
+MOV ACC BAK
+SUB {count}
+JEZ 8
+MOV BAK ACC
+JMP 2
+INP BAK
+HLT
+"""
+
+
+# Trimmed only, for --conformance. Reads the top of a stack which is empty,
+# since trimmed programs start with nothing on it.
+EMPTY = """\
+CHP 65
+MOV STK ACC
+CHP 66
+"""
+
+# Trimmed only, for --conformance. Covers what the benchmarks don't: STK read
+# and written, every kind of jump taken and not, and a jump past the end.
+STACK = """\
+PSH 3
+PSH 4
+MOV STK ACC
+ADD STK
+MOV ACC STK
+INP STK
+CHP 32
+POP
+MOV STK BAK
+INP BAK
+CHP 10
+MOV 3 ACC
+SUB 1
+INP ACC
+JGZ 13
+JNZ 11
+JEZ 19
+CHP 33
+SUB 1
+JLZ 22
+HLT
+INP ACC
+PSH ACC
+MOV STK BAK
+POP
+MOV BAK ACC
+ADD 2
+JGZ 30
+CHP 63
+INP ACC
+JMP 33
+CHP 63
+CHP 10
+JMP 36
+CHP 63
+"""
+
+
+# Operands random_program picks from
+SOURCES = ['0', '1', '2', '3', '7', '48', 'ACC', 'BAK', 'STP', 'SFP', 'BSP', '[STP]', '[SFP]', '[BSP]', '[0]', '[1]', '[ACC]']
+DESTINATIONS = ['ACC', 'BAK', '[STP]', '[SFP]', '[BSP]', '[1]', '[ACC]']
+
+
+# A random program of length lines for --conformance. Most of them stop on
+# an error or never stop at all, the ones that matter return to lines in the
+# middle of blocks, past the end and before the start of the program, which
+# nothing written by hand does on purpose.
+def random_program(rng, length):
+    lines = []
+    for _ in range(length):
+        opcode = rng.choice(['MOV', 'MOV', 'PSH', 'PSH', 'POP', 'ADD', 'SUB', 'CLL', 'RET', 'RET',
+                             'INP', 'CHP', 'JMP', 'JEZ', 'JNZ', 'JGZ', 'JLZ', 'HLT'])
+        if opcode == 'MOV':
+            lines.append(f'MOV {rng.choice(SOURCES)} {rng.choice(DESTINATIONS)}')
+        elif opcode in ('PSH', 'ADD', 'SUB', 'INP'):
+            lines.append(f'{opcode} {rng.choice(SOURCES)}')
+        elif opcode == 'CHP':
+            lines.append(f'CHP {rng.choice(["48", "65", "ACC"])}')
+        elif opcode == 'CLL':
+            lines.append(f'CLL {rng.choice([str(rng.randrange(length)), "ACC", "[STP]"])}')
+        elif opcode in ('POP', 'RET', 'HLT'):
+            lines.append(opcode)
+        else:
+            lines.append(f'{opcode} {rng.randrange(length + 1)}')
+    return '\n'.join(lines) + '\n'
+
+
+# Same for the trimmed interpereter, only what trimmed_reference.py knows:
+# no tags, STK and jumps to lines counting from 1
+def random_trimmed_program(rng, length):
+    sources = ['0', '1', '2', '5', '65', 'ACC', 'BAK', 'STK']
+    lines = []
+    for _ in range(length):
+        opcode = rng.choice(['MOV', 'MOV', 'PSH', 'PSH', 'POP', 'ADD', 'SUB', 'INP', 'INP', 'INP', 'CHP',
+                             'JMP', 'JEZ', 'JNZ', 'JGZ', 'JLZ', 'HLT'])
+        if opcode == 'MOV':
+            lines.append(f'MOV {rng.choice(sources)} {rng.choice(["ACC", "BAK", "STK"])}')
+        elif opcode in ('PSH', 'ADD', 'SUB', 'INP'):
+            lines.append(f'{opcode} {rng.choice(sources)}')
+        elif opcode == 'CHP':
+            lines.append(f'CHP {rng.choice(["48", "65", "10"])}')
+        elif opcode in ('POP', 'HLT'):
+            lines.append(opcode)
+        else:
+            lines.append(f'{opcode} {rng.randint(1, length + 1)}')
+    return '\n'.join(lines) + '\n'
+
+
+def example(name):
+    with open(os.path.join(EXAMPLES, name + '.risc')) as program_file:
+        return program_file.read()
+
+
+# Rewrite a program without tags for the trimmed interpereter: no comments
+# or blank lines, and jumps counted from 1 instead of 0
+def to_trimmed(source):
+    lines = [line.split("'")[0].split() for line in source.splitlines()]
+    numbers = {}
+    kept = []
+    for i,tokens in enumerate(lines):
+        numbers[i] = len(kept) + 1
+        if tokens:
+            kept.append(tokens)
+    numbers[len(lines)] = len(kept) + 1
+    out = []
+    for tokens in kept:
+        if tokens[0] in ('JMP', 'JEZ', 'JNZ', 'JGZ', 'JLZ'):
+            tokens = [tokens[0], str(numbers[int(tokens[1])])]
+        out.append(' '.join(tokens))
+    return '\n'.join(out) + '\n'
+
+
+# name -> (risc source, trimmed source or None, params)
+def benchmarks(scale):
+    abc = example('abc')
+    multiply = example('multiply').replace('PSH 6\nPSH 5', f'PSH 3\nPSH {20000 * scale}')
+    count = COUNT.format(count=20000 * scale)
+    # The same loop with jumps counted from 0
+    risc_count = COUNT.replace('JEZ 8', 'JEZ 7').replace('JMP 2', 'JMP 1').format(count=20000 * scale)
+    numbers = [str(i * 7919 % 100000) for i in range(1, 2000 * scale + 1)]
+    words = ['hello world'[:i % 11 + 1] for i in range(1000 * scale)]
+    return {
+        'abc':(abc, to_trimmed(abc), []),
+        'multiply':(example('multiply'), None, []),
+        'echo':(example('echo'), None, ['hello']),
+        'function':(example('function'), None, ['hello', 'world']),
+        'count':(risc_count, count, []),
+        'multiply_large':(multiply, None, []),
+        'atoi_many':(ATOI, None, numbers),
+        'function_many':(example('function'), None, words),
+        'deep_calls':(DEEP.format(depth=5000 * scale), None, []),
+    }
+
+
+# Count instructions by wrapping every instruction of an interpereter
+def count_instructions(interpereter):
+    counter = [0]
+    def counted(function):
+        def wrapper(*args):
+            counter[0] += 1
+            return function(*args)
+        return wrapper
+    if hasattr(interpereter, 'program'):
+        interpereter.program = [(counted(function), args) for function, args in interpereter.program]
+    else:
+        interpereter.instructions = {opcode:counted(function) for opcode, function in interpereter.instructions.items()}
+    return counter
+
+
+# Run once in process, returns (instructions or None, seconds in run())
+def run_in_process(name, source, params, count=False):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if name in ('risc', 'jit'):
+            output = risc.CaptureOutput()
+            interpereter = risc.Interpereter(source, output=output)
+            # Traces run many instructions at once, so count without them.
+            # The same instructions run either way.
+            if name == 'jit' and not count:
+                interpereter.jit()
+            interpereter.params(params)
+        else:
+            interpereter = risc.Interpereter(source, output=risc.CaptureOutput(), dialect='trimmed')
+        counter = count_instructions(interpereter) if count else [None]
+        start = time.perf_counter()
+        try:
+            interpereter.run()
+        except (risc.TagError, risc.InstructionError, risc.SourceError, risc.DestError, risc.IdexError):
+            pass
+        seconds = time.perf_counter() - start
+    return counter[0], seconds
+
+
+# Run as its own process, returns (wall seconds, peak memory in KiB)
+def run_process(name, path, params):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + INTERPERETERS[name] + [path] + params,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    # We reaped the process ourselves, let Popen know
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on linux and bytes on macOS
+    memory = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return wall, memory
+
+
+def measure(name, source, params, repeat, scratch, startup):
+    path = os.path.join(scratch, f'{name}.risc')
+    with open(path, 'w') as program_file:
+        program_file.write(source)
+
+    instructions, _ = run_in_process(name, source, params, count=True)
+    runs = [run_in_process(name, source, params)[1] for _ in range(repeat)]
+    processes = [run_process(name, path, params) for _ in range(repeat)]
+    run = statistics.median(runs)
+    return {
+        'instructions':instructions,
+        'ips':instructions / run if run else 0.0,
+        'run':run,
+        'wall':statistics.median(wall for wall, _ in processes),
+        'startup':startup,
+        'memory':max(memory for _, memory in processes),
+    }
+
+
+# What a trimmed program prints on the reference implementation
+# followed by <error> naming the python error it stopped on, if it did
+def reference_output(source):
+    output = io.StringIO()
+    stopped = ''
+    with contextlib.redirect_stdout(output):
+        try:
+            trimmed_reference.Interpereter(source).run()
+        except Exception as err:
+            stopped = f'<{type(err).__name__}>'
+    return (output.getvalue() + stopped).encode('utf-8')
+
+
+# What a program prints in a dialect, in process and, given a scratch
+# directory, as its own process. How it stops goes after the output when
+# that isn't halting, the same way reference_output() writes it. Runs only
+# get budget instructions, so a dialect that goes wrong can't hang the check.
+def dialect_outputs(source, dialect, params, scratch=None, budget=None):
+    output = risc.CaptureOutput()
+    interpereter = risc.Interpereter(source, output=output, dialect=dialect)
+    interpereter.params(params)
+    interpereter.limit(budget)
+    try:
+        status = interpereter.run()
+    except Exception as err:
+        status = type(err).__name__
+    stopped = '' if status == 'halted' else f'<{status}>'
+    outputs = ((output.getvalue() + stopped).encode('utf-8'),)
+    if scratch is None:
+        return outputs
+
+    path = os.path.join(scratch, f'conformance_{dialect}.risc')
+    with open(path, 'w') as program_file:
+        program_file.write(source)
+    budget = ['--budget', str(budget)] if budget else []
+    process = subprocess.run([sys.executable, INTERPERETERS['risc'][0], '--no-cache', '--dialect', dialect] + budget + [path] + params,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stopped = b''
+    if process.returncode:
+        # The last line of the traceback names the error
+        stopped = b'<' + process.stderr.strip().splitlines()[-1].split(b':')[0] + b'>'
+    return outputs + (process.stdout + stopped,)
+
+
+# Random trimmed programs which stop by themselves, many of them on an
+# error like POP on an empty stack.
+def generated_trimmed(count, seed=0):
+    rng = random.Random(seed)
+    programs = {}
+    tried = 0
+    while len(programs) < count:
+        tried += 1
+        source = random_trimmed_program(rng, rng.randint(3, 30))
+        interpereter = risc.Interpereter(source, output=risc.CaptureOutput(), dialect='trimmed')
+        interpereter.params([])
+        interpereter.limit(10000)
+        try:
+            if interpereter.run() == 'budget':
+                continue
+        except Exception:
+            pass
+        programs[f'random {tried}'] = (source, [('trimmed', source)], [])
+    return programs
+
+
+# Check programs against the reference, returns a line per mismatch.
+# programs is name -> (trimmed source, [(dialect, source)...], params), every
+# source has to print what the trimmed source does on the reference.
+# Generated ones are only run in process, a process each would take minutes.
+def conformance(programs, scratch):
+    found = []
+    for bench, (trimmed_source, runs, params) in programs.items():
+        expected = reference_output(trimmed_source)
+        for dialect, program in runs:
+            if bench.startswith('random'):
+                outputs = dialect_outputs(program, dialect, params, budget=10000)
+            else:
+                outputs = dialect_outputs(program, dialect, params, scratch, 10000000)
+            for how, got in zip(('in process', 'process'), outputs):
+                if got != expected:
+                    found.append(f'{bench}/{dialect} ({how}): expected {expected[:60]!r}, got {got[:60]!r}')
+    return found
+
+
+# The name of an error and, for the ones a program can raise, its text.
+# Python errors only have to be the same kind, the generated module keeps
+# its stack in a list where the interpereter has an array.
+def describe(err):
+    if type(err).__name__ in {error.__name__ for error in risc.ERRORS}:
+        return type(err).__name__, repr(err)
+    return type(err).__name__, None
+
+
+# (output, error) of a program on the interpereter, None if it is still going
+# after budget instructions
+def interpereter_result(source, params, budget=None):
+    output = risc.CaptureOutput()
+    interpereter = risc.Interpereter(source, output=output)
+    interpereter.params(params)
+    interpereter.limit(budget)
+    error = None
+    try:
+        if interpereter.run() == 'budget':
+            return None
+    except Exception as err:
+        error = describe(err)
+    return output.getvalue(), error
+
+
+# (output, error) of the same program as a module written by --emit-python
+def python_result(source, params):
+    module = {'__name__':'conformance'}
+    exec(risc.PythonCompiler(risc.Interpereter(source).instruction_list).emit(), module)
+    output = []
+    error = None
+    try:
+        module['run'](params, output.append, io.StringIO())
+    except Exception as err:
+        error = describe(err)
+    return ''.join(output), error
+
+
+# Check --emit-python against the interpereter, returns a line per mismatch.
+# programs is name -> (source, params), generated is how many random
+# programs to check on top of them.
+def python_conformance(programs, generated, seed=0):
+    programs = dict(programs)
+    rng = random.Random(seed)
+    tried = 0
+    while generated:
+        tried += 1
+        source = random_program(rng, rng.randint(3, 30))
+        params = rng.choice([[], ['a'], ['ab', 'c']])
+        if interpereter_result(source, params, 10000) is not None:
+            programs[f'random {tried}'] = (source, params)
+            generated -= 1
+
+    found = []
+    for name, (source, params) in programs.items():
+        expected = interpereter_result(source, params)
+        got = python_result(source, params)
+        if got != expected:
+            found.append(f'{name}: expected {str(expected)[:80]}, got {str(got)[:80]}')
+    return len(programs), found
+
+
+# Record every program with jit() on, which recorded runs have to do
+# without, and check the recording gets to the same state as a plain run at
+# a spread of steps. programs is name -> (source, params), returns a line
+# per mismatch.
+def recording_conformance(programs, scratch):
+    path = os.path.join(scratch, 'conformance.rrec')
+    found = []
+    for name, (source, params) in programs.items():
+        interpereter = risc.Interpereter(source, output=risc.CaptureOutput())
+        interpereter.jit(threshold=2)
+        interpereter.params(params)
+        recorder = interpereter.record(path, every=1000)
+        status = None
+        try:
+            status = interpereter.run()
+        except Exception:
+            pass
+        recorder.close(status)
+
+        recording = risc.Recording(path)
+        plain = risc.Interpereter(source, output=risc.CaptureOutput())
+        plain.params(params)
+        done = 0
+        try:
+            for step in sorted(set(range(0, recording.steps, recording.steps // 50 + 1)) | {recording.steps}):
+                try:
+                    if step > done:
+                        plain.run(step - done)
+                except Exception:
+                    pass
+                done = step
+                state = recording.state(step)
+                expected = (plain.instruction_ptr, plain.acc, plain.bak, plain.stp, plain.fp, plain.bp)
+                if tuple(state.registers[:6]) != expected or list(state.stack) != list(plain.stack.elements):
+                    found.append(f'{name}: step {step} replays to {state.registers[:6]}, a plain run is at {expected}')
+                    break
+        except ValueError as err:
+            found.append(f'{name}: {err}')
+        finally:
+            recording.close()
+    return found
+
+
+def startup_cost(name, repeat, scratch):
+    path = os.path.join(scratch, 'startup.risc')
+    with open(path, 'w') as program_file:
+        program_file.write('HLT\n')
+    return statistics.median(run_process(name, path, [])[0] for _ in range(repeat))
+
+
+# Compare results against a baseline, returning a line per regression.
+# Times and memory regress when they grow, ips when it shrinks.
+def regressions(results, baseline, threshold):
+    found = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ('run', 'wall', 'memory', 'ips'):
+            old, new = baseline[key][metric], result[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if metric == 'ips':
+                change = -change
+            if change > threshold:
+                found.append(f'{key}: {metric} {old:.6g} -> {new:.6g} ({change:+.0%})')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the interpereters in src/")
+    parser.add_argument("-r",
+                        "--repeat",
+                        type=int,
+                        default=3,
+                        help="Runs per benchmark, the median is reported")
+
+    parser.add_argument("--scale",
+                        type=int,
+                        default=1,
+                        help="Size multiplier for the generated benchmarks")
+
+    parser.add_argument("-k",
+                        "--filter",
+                        default=None,
+                        help="Only run benchmarks whose name contains this")
+
+    parser.add_argument("--save",
+                        metavar="file",
+                        default=None,
+                        help="Save the results as a json baseline")
+
+    parser.add_argument("--compare",
+                        metavar="file",
+                        default=None,
+                        help="Compare against a saved baseline and exit 1 on regressions")
+
+    parser.add_argument("--threshold",
+                        type=float,
+                        default=0.10,
+                        help="Relative change counted as a regression, default 0.10")
+
+    parser.add_argument("--conformance",
+                        action="store_true",
+                        default=False,
+                        help="Check both dialects print the same as the reference trimmed interpereter instead of timing anything")
+
+    parser.add_argument("--generated",
+                        type=int,
+                        default=300,
+                        help="Random programs --conformance checks the trimmed dialect and --emit-python on, 300 of each by default")
+
+    parser.add_argument("--scratch",
+                        default=os.path.join(ROOT, 'bench', 'programs'),
+                        help="Where generated programs are written")
+
+    args = parser.parse_args()
+    os.makedirs(args.scratch, exist_ok=True)
+
+    if args.conformance:
+        programs = {bench:(trimmed_source, [('trimmed', trimmed_source), ('risc', source)], params)
+                    for bench, (source, trimmed_source, params) in benchmarks(args.scale).items()
+                    if trimmed_source is not None}
+        # abc is written so it runs unchanged in both dialects
+        programs['abc'][1].append(('trimmed', example('abc')))
+        programs['stack'] = (STACK, [('trimmed', STACK)], [])
+        programs['empty'] = (EMPTY, [('trimmed', EMPTY)], [])
+        programs.update(generated_trimmed(args.generated))
+        if args.filter:
+            programs = {bench:program for bench, program in programs.items() if args.filter in bench}
+        found = conformance(programs, args.scratch)
+        for line in found:
+            print("mismatch: " + line)
+        print(f"{len(programs)} programs, {len(found)} mismatches")
+
+        compiled = {bench:(source, params) for bench, (source, _, params) in benchmarks(args.scale).items()
+                    if not args.filter or args.filter in bench}
+        checked, python_found = python_conformance(compiled, args.generated)
+        for line in python_found:
+            print("mismatch: --emit-python " + line)
+        print(f"{checked} programs compiled to python, {len(python_found)} mismatches")
+
+        recording_found = recording_conformance(compiled, args.scratch)
+        for line in recording_found:
+            print("mismatch: recording " + line)
+        print(f"{len(compiled)} programs recorded with --jit, {len(recording_found)} mismatches")
+        if found or python_found or recording_found:
+            sys.exit(1)
+        return
+
+    startups = {name:startup_cost(name, args.repeat, args.scratch) for name in INTERPERETERS}
+
+    results = {}
+    print("{:<28} {:>12} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "benchmark", "instructions", "ips", "run", "wall", "startup", "memory"))
+    for bench, (source, trimmed_source, params) in benchmarks(args.scale).items():
+        if args.filter and args.filter not in bench:
+            continue
+        for name, program in (('risc', source), ('jit', source), ('trimmed', trimmed_source)):
+            if program is None:
+                continue
+            key = f'{bench}/{name}'
+            result = measure(name, program, params, args.repeat, args.scratch, startups[name])
+            results[key] = result
+            print("{:<28} {:>12} {:>12.0f} {:>10.4f} {:>10.4f} {:>10.4f} {:>10}".format(
+                key, result['instructions'], result['ips'], result['run'],
+                result['wall'], result['startup'], result['memory']), flush=True)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(results, baseline, args.threshold)
+        for line in found:
+            print("regression: " + line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,18 @@
+import io
+import re
+import os
 import sys
+import mmap
+import json
+import math
+import time
+import struct
+import hashlib
 import argparse
+import tempfile
+import zlib
+from array import array
+from collections import deque
 
 
 # Registers:
@@ -16,6 +29,12 @@ import argparse
 #   BSP                 - Stack frame base pointer, this is the begining of the
 #                         stack frame.
 #
+#   DAT                 - Address of the first cell of the data segment, read
+#                         only. Always DATA_BASE.
+#
+#   DLN                 - Number of cells in the data segment, read only. 0
+#                         when there is no data segment.
+#
 # Placeholders:
 #   <SRC>               - This is the value being acted upon. It may represent a
 #                         hard-coded value, a register, or a location on the stack.
@@ -23,6 +42,12 @@ import argparse
 #   <DST>               - This is the location being acted upon. It may represent
 #                         a register or a location on the stack.
 #
+# Memory:
+#   [n]                 - Cell n of the stack when n is below the size of the
+#                         stack, cell n - DATA_BASE of the data segment when n
+#                         is DATA_BASE or above. The data segment is a file
+#                         mapped into memory, one cell per byte.
+#
 # Instructions:
 #   MOV <SRC> <DST>     - Move a value from <SRC> to <DST>. Will copy over the
 #                         top element on the stack.
@@ -61,6 +86,109 @@ import argparse
 #                         <SRC>
 #
 #   HLT                 - Halt interperetation
+#
+#   RDC <DST>           - Read the next character of input into <DST>. At the
+#                         end of the input <DST> is left alone and ACC is set
+#                         to -1.
+#
+#   RDI <DST>           - Read the next integer of input into <DST>, skipping
+#                         whitespace before it. Same as RDC at the end.
+
+
+# Operand kinds, the decode stage turns every operand token into one of these
+# so the interpereter never has to look at a string while it runs:
+#   IMM                 - A hard-coded integer value, (IMM, 42)
+#   REG                 - A register, (REG, 'ACC')
+#   MEM                 - A location on the stack, the value is the decoded
+#                         operand inside the brackets, (MEM, (REG, 'STP'))
+#   BAD                 - Anything else, (BAD, 'MOP'). Reported when executed.
+IMM = 0
+REG = 1
+MEM = 2
+BAD = 3
+
+REGISTERS = ('ACC', 'BAK', 'STP', 'SFP', 'BSP', 'DAT', 'DLN')
+
+# Where the data segment starts. Far above any stack we could ever hold, so
+# the two never overlap.
+DATA_BASE = 1 << 40
+
+# Numeric models, what ACC, BAK and the stack cells can hold:
+#   unbounded           - Any integer at all, the default
+#   wrap32              - Signed 32 bit integers, ADD and SUB wrap around
+#                         like they would on a machine int
+#   wrap64              - Same with signed 64 bit integers
+#   saturate            - -999 to 999 like the TIS-100, ADD and SUB stop at
+#                         the ends instead of going past them
+#
+# Outside of unbounded, numbers written in the program and numbers read by
+# RDC and RDI are fitted into the range the same way. Pointers are left as
+# they are: the registers STP, SFP, BSP and DAT, the lines CLL saves and the
+# numbers inside brackets or after CLL. INP prints the value as it is held,
+# and CHP stops with a SourceError on a value that is not a character
+# instead of letting chr() fail.
+#
+# name -> (lowest value, highest value, typecode of the stack array)
+NUMBERS = {
+    'unbounded':(None, None, 'q'),
+    'wrap32':(-(1 << 31), (1 << 31) - 1, 'i'),
+    'wrap64':(-(1 << 63), (1 << 63) - 1, 'q'),
+    'saturate':(-999, 999, 'i'),
+}
+
+
+# Turn a single operand token into its (kind, value) form
+def decode_operand(token):
+    if token in REGISTERS:
+        return (REG, token)
+    elif token[:1] == '[' and token[-1:] == ']':
+        return (MEM, decode_operand(token[1:-1]))
+    elif token[:1].isdigit():
+        try:
+            return (IMM, int(token))
+        except ValueError:
+            return (BAD, token)
+    else:
+        return (BAD, token)
+
+
+# Fit a value into the range of a numeric model
+def fit_number(numbers, value):
+    low, high, _ = NUMBERS[numbers]
+    if low is None or low <= value <= high:
+        return value
+    if numbers == 'saturate':
+        return high if value > high else low
+    return (value - low) % (high - low + 1) + low
+
+
+# What each instruction expects for its operands:
+#   SRC                 - Something we read a value from
+#   DST                 - Something we write a value to
+#   TAG                 - A line number to jump to, tags are already replaced
+SRC = 'SRC'
+DST = 'DST'
+TAG = 'TAG'
+
+OPERANDS = {
+    "MOV":(SRC, DST),
+    "PSH":(SRC,),
+    "POP":(),
+    "ADD":(SRC,),
+    "SUB":(SRC,),
+    "CLL":(SRC,),
+    "RET":(),
+    "CHP":(SRC,),
+    "INP":(SRC,),
+    "JMP":(TAG,),
+    "JEZ":(TAG,),
+    "JNZ":(TAG,),
+    "JGZ":(TAG,),
+    "JLZ":(TAG,),
+    "HLT":(),
+    "RDC":(DST,),
+    "RDI":(DST,)
+}
 
 
 # We want to tell the user when a tag does not exist
@@ -109,52 +237,708 @@ class IdexError(Exception):
         return '"{}", line {}'.format(self.message, self.line + 1)
 
 
+# We want to tell the user when the input isn't what RDI expects
+class InputError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+    def __repr__(self):
+        return '"{}", line {}'.format(self.message, self.line + 1)
+
+
+# And when a program ran more instructions than it was allowed to
+class BudgetError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+    def __repr__(self):
+        return '"{}", line {}'.format(self.message, self.line + 1)
+
+
+# And when a node of a Network waits on a port that will never be ready
+class DeadlockError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+    def __repr__(self):
+        return '"{}", line {}'.format(self.message, self.line + 1)
+
+
+# A parsed program as one flat table of ints, instead of a list for every
+# line holding a string for every token:
+#   strings             - Every distinct token once
+#   starts              - Index of the first token of every line, plus one
+#                         past the last token
+#   tokens              - Index into the strings for every token
+#   tags                - Tag name -> the line it is on
+#   duplicates          - (tag, earlier line, line) for every tag defined
+#                         more than once
+#
+# Indexing a line gives its tokens as a list of strings, the same as the
+# list of lists an instruction list can also be, so anything taking an
+# instruction list takes either. It is the layout ProgramCache keeps on disk.
+class ProgramTable:
+    def __init__(self, strings=None, starts=None, tokens=None, tags=None, duplicates=None):
+        self.strings = strings if strings is not None else []
+        self.starts = starts if starts is not None else array('I', [0])
+        self.tokens = tokens if tokens is not None else array('I')
+        self.tags = tags if tags is not None else {}
+        self.duplicates = duplicates if duplicates is not None else []
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, line):
+        if isinstance(line, slice):
+            return [self[i] for i in range(*line.indices(len(self)))]
+        if line < 0:
+            line += len(self)
+        if not 0 <= line < len(self):
+            raise IndexError('line out of range')
+        strings = self.strings
+        return [strings[i] for i in self.tokens[self.starts[line]:self.starts[line + 1]]]
+
+    def __iter__(self):
+        strings, tokens, starts = self.strings, self.tokens, self.starts
+        for line in range(len(self)):
+            yield [strings[i] for i in tokens[starts[line]:starts[line + 1]]]
+
+
+# How many characters parse_program reads from a file at a time
+PARSE_CHUNK = 1 << 16
+
+# The ways a program can be written, all of them parse into the same
+# instruction list and run on the same engine:
+#   risc                - What this file documents, the default
+#   trimmed             - What src/trimmed.py used to run on its own. STK is
+#                         the top of the stack, the same as [STP], and jumps
+#                         count lines from 1 instead of 0. Tags, comments and
+#                         everything else work the same as in risc.
+DIALECTS = ('risc', 'trimmed')
+
+
+# Rewrite the words of a trimmed line into risc. Only numbers written after
+# a jump move, tags already name the line they are on. Line 0 doesn't exist
+# when lines count from 1, so a jump to it is a TagError on the spot.
+def trimmed_words(words, line):
+    words = ['[STP]' if word == 'STK' else word for word in words]
+    if len(words) == 2 and OPERANDS.get(words[0]) == (TAG,) and words[1].isdigit():
+        if int(words[1]) == 0:
+            raise TagError(line, f'{words[1]} is not a line, trimmed programs count lines from 1')
+        words[1] = str(int(words[1]) - 1)
+    return words
+
+
+# Parse a program, a string or a text file, into a ProgramTable. The source
+# goes through once, a chunk at a time, so a file is never read in whole.
+#
+# Tags are resolved as they are found. An operand naming a tag we already
+# know gets its line right away. One naming a tag further down is kept as it
+# is with its position remembered, and patched when the tag turns up. Lines
+# are stored as numbers like any other token, so every reference to a tag
+# shares one string. Anything left unpatched at the end is not a tag and
+# stays as it was written, to be reported when it is run.
+#
+# Only operands can name tags, never the opcode, and operands that are
+# numbers, registers, ports or in brackets are never tags.
+#
+# A tag defined again is kept in duplicates and the last definition wins,
+# repatching everything the earlier one resolved. With strict it is a
+# TagError instead.
+#
+# dialect is one of DIALECTS, lines in any other are rewritten into risc
+# before anything else looks at them, which can be a TagError too.
+def parse_program(source, strict=False, dialect='risc'):
+    if dialect not in DIALECTS:
+        raise ValueError(f'{dialect} is not a dialect')
+    trimmed = dialect == 'trimmed'
+    if isinstance(source, str):
+        chunks = (source[i:i + PARSE_CHUNK] for i in range(0, len(source), PARSE_CHUNK))
+    else:
+        chunks = iter(lambda: source.read(PARSE_CHUNK), '')
+
+    table = ProgramTable()
+    strings, starts, tokens, tags = table.strings, table.starts, table.tokens, table.tags
+    ids = {}
+    # Tag name -> position in tokens of every operand naming it
+    refs = {}
+    # Tag name -> index of the string of its line
+    resolved = {}
+
+    def define(tag, line):
+        if tag in tags:
+            if strict:
+                raise TagError(line, f'{tag} is already a tag on line {tags[tag] + 1}')
+            table.duplicates.append((tag, tags[tag], line))
+        tags[tag] = line
+        name = str(line)
+        value = ids.get(name)
+        if value is None:
+            value = ids[name] = len(strings)
+            strings.append(name)
+        resolved[tag] = value
+        for pos in refs.setdefault(tag, array('I')):
+            tokens[pos] = value
+
+    def parse(lines):
+        for text in lines:
+            # Remove comments, tokenize
+            words = text.split("'", 1)[0].split()
+            if words and words[0][-1] == ':':
+                define(words[0][:-1], len(starts) - 1)
+                del words[0]
+            if trimmed:
+                words = trimmed_words(words, len(starts) - 1)
+            for i,word in enumerate(words):
+                if i and not (word[0].isdigit() or word[0] in '[@' or word in REGISTERS):
+                    if word in resolved:
+                        refs[word].append(len(tokens))
+                        tokens.append(resolved[word])
+                        continue
+                    refs.setdefault(word, array('I')).append(len(tokens))
+                value = ids.get(word)
+                if value is None:
+                    value = ids[word] = len(strings)
+                    strings.append(word)
+                tokens.append(value)
+            starts.append(len(tokens))
+
+    # Only whole lines get parsed, the last one in a chunk may go on in the
+    # next. So may a line ending in \r, the \n can be the next character.
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).splitlines(True)
+        rest = ''
+        if lines and (lines[-1][-1] == '\r' or lines[-1].splitlines()[0] == lines[-1]):
+            rest = lines.pop()
+        parse(lines)
+    parse(rest.splitlines())
+    return table
+
+
 # A simple stack class to make code more readable, self explanatory
+#
+# The cells live in one contiguous array of 64 bit integers instead of a list
+# of python ints, which takes 8 bytes a cell instead of a pointer plus an int
+# object. A value too big for 64 bits switches the stack over to a plain list,
+# since the registers themselves have no limit. The fixed width numeric
+# models pick a typecode their values always fit in, so only pointers bigger
+# than that can still widen it.
 class Stack:
-    def __init__(self, elements=None): self.elements = elements if elements else []
-    def push(self, element): self.elements.append(element)
+    def __init__(self, elements=None, typecode='q'):
+        self.elements = array(typecode)
+        self.extend(elements if elements else [])
+
+    def push(self, element):
+        try:
+            self.elements.append(element)
+        except OverflowError:
+            self.widen()
+            self.elements.append(element)
+
+    # Push many values at once
+    def extend(self, elements):
+        try:
+            self.elements.extend(elements)
+        except OverflowError:
+            self.widen()
+            self.elements.extend(elements)
+
     def pop(self): return self.elements.pop()
     def peek(self): return self.elements[-1]
 
+    # Overwrite a cell which is already on the stack
+    def set(self, pos, element):
+        try:
+            self.elements[pos] = element
+        except OverflowError:
+            self.widen()
+            self.elements[pos] = element
+
+    # Drop everything from length onwards, in place. Only the dropped cells
+    # are touched so this costs the same however deep the stack is
+    def truncate(self, length):
+        del self.elements[length:]
+
+    # Move over to a list which can hold any python int
+    def widen(self):
+        if isinstance(self.elements, array):
+            self.elements = list(self.elements)
+
+    def __len__(self): return len(self.elements)
+
+
+# Collects what CHP and INP print and writes it to a stream in large pieces
+# instead of one write per character. When to write is up to flush_on:
+#   halt                - Only when the program stops (HLT, end of program or
+#                         an error)
+#   line                - Whenever a newline is printed, and at halt
+#   size                - Whenever size characters are waiting, and at halt
+#
+# With no flush_on given, terminals flush on every line like print does and
+# everything else flushes by size. Binary streams are written utf-8 encoded.
+class BufferedOutput:
+    def __init__(self, stream=None, flush_on=None, size=65536):
+        # No stream means whatever sys.stdout is when we flush
+        self.stream = stream
+        self.size = size
+        if flush_on is None:
+            flush_on = 'line' if (stream or sys.stdout).isatty() else 'size'
+        if flush_on not in ('halt', 'line', 'size'):
+            raise ValueError(f'{flush_on} is not a valid flush policy')
+        self.flush_on = flush_on
+        self.buffer = []
+        self.length = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        if self.flush_on == 'size':
+            self.length += len(text)
+            if self.length >= self.size:
+                self.flush()
+        elif self.flush_on == 'line' and '\n' in text:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.length = 0
+        stream = self.stream or sys.stdout
+        if isinstance(stream, io.TextIOBase):
+            stream.write(text)
+        else:
+            stream.write(text.encode('utf-8'))
+        stream.flush()
+
+
+# An integer for RDI, after any amount of whitespace
+INTEGER = re.compile(r'\s*([+-]?[0-9]+)')
+
+
+# Where RDC and RDI read from. The stream is read in large pieces so a
+# program can work through any amount of input a character at a time while
+# only one piece is ever held in memory. No stream means whatever sys.stdin
+# is when we first read.
+#
+# Both reads return None at the end of the input.
+class InputReader:
+    def __init__(self, stream=None, size=65536):
+        self.stream = stream
+        self.size = size
+        self.buffer = ''
+        self.pos = 0
+
+    # Make sure there is something left in the buffer, False at the end
+    def _fill(self):
+        if self.pos < len(self.buffer):
+            return True
+        self.buffer = (self.stream or sys.stdin).read(self.size)
+        self.pos = 0
+        return self.buffer != ''
+
+    def read_char(self):
+        if not self._fill():
+            return None
+        char = self.buffer[self.pos]
+        self.pos += 1
+        return ord(char)
+
+    # Everything left to read, all at once
+    def read_rest(self):
+        text = self.buffer[self.pos:] + (self.stream or sys.stdin).read()
+        self.buffer = ''
+        self.pos = 0
+        return text
+
+    # Skip whitespace, then read an optionally signed integer. Reading stops
+    # right after the last digit. Raises ValueError with what was found
+    # instead when there are no digits.
+    def read_int(self):
+        # Almost every integer is in the buffer with something after it
+        match = INTEGER.match(self.buffer, self.pos)
+        if match and match.end() < len(self.buffer):
+            self.pos = match.end()
+            return int(match.group(1))
+
+        # Otherwise go a character at a time, reading more as we need it
+        while self._fill() and self.buffer[self.pos].isspace():
+            self.pos += 1
+        if not self._fill():
+            return None
+        text = ''
+        if self.buffer[self.pos] in '+-':
+            text = self.buffer[self.pos]
+            self.pos += 1
+        while self._fill() and self.buffer[self.pos] in '0123456789':
+            text += self.buffer[self.pos]
+            self.pos += 1
+        if text in ('', '+', '-'):
+            raise ValueError(text + (self.buffer[self.pos] if self._fill() else ''))
+        return int(text)
+
+
+# Map a file in as the data segment. Nothing is read until a cell is used,
+# so this takes the same time for any size of file, and only the pages a
+# program touches are ever loaded. Writes go to private copies of the pages
+# they change and never reach the file.
+def map_data(filename):
+    with open(filename, 'rb') as data_file:
+        # mmap can't map an empty file
+        if os.fstat(data_file.fileno()).st_size == 0:
+            return bytearray()
+        return mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+# Keeps everything CHP and INP print in memory, for running programs from
+# inside other python code
+class CaptureOutput:
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, text): self.buffer.append(text)
+    def flush(self): pass
+    def getvalue(self): return ''.join(self.buffer)
+
+
+# Execution counts and times gathered by Interpereter._profile_loop:
+#   counts, times       - Per line, how often it ran and for how long
+#   calls               - Per CLL target, how often it was called and how many
+#                         instructions ran inside it, with (inclusive) and
+#                         without (exclusive) the functions it called
+#
+# Per opcode and per tag totals are worked out from the per line numbers when
+# the report is made. A line belongs to the closest tag above it.
+class Profiler:
+    def __init__(self, interpereter):
+        self.instruction_list = interpereter.instruction_list
+        self.tags = interpereter.tags
+        self.counts = [0] * len(self.instruction_list)
+        self.times = [0.0] * len(self.instruction_list)
+        self.executed = 0
+        self.calls = {}
+
+        # One [target, executed when called, instructions in callees] entry
+        # per call which has not returned yet
+        self.frames = []
+
+    def call(self, target):
+        self.frames.append([target, self.executed, 0])
+
+    def ret(self):
+        # A RET without a CLL ends the program, nothing to count
+        if self.frames:
+            self._close(self.frames.pop())
+
+    def _close(self, frame):
+        target, start, callees = frame
+        inclusive = self.executed - start
+        totals = self.calls.setdefault(target, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += inclusive
+        totals[2] += inclusive - callees
+        if self.frames:
+            self.frames[-1][2] += inclusive
+
+    # Name of the tag a line belongs to
+    def _tag(self, line, starts):
+        name = '(top)'
+        for start, tag in starts:
+            if start > line:
+                break
+            name = tag
+        return name
+
+    # Everything the profiler knows as plain dicts and lists
+    def summary(self):
+        # Functions still running (we halted inside them) count up to now
+        while self.frames:
+            self._close(self.frames.pop())
+
+        starts = sorted((line, tag) for tag, line in self.tags.items())
+        names = {line:tag for tag, line in self.tags.items()}
+        lines = []
+        opcodes = {}
+        tags = {}
+        for i,tokens in enumerate(self.instruction_list):
+            # Empty lines and lines with only a tag aren't worth reporting
+            if not self.counts[i] or not tokens:
+                continue
+            lines.append({"line":i + 1,
+                          "count":self.counts[i],
+                          "time":self.times[i],
+                          "instruction":' '.join(tokens)})
+            totals = opcodes.setdefault(tokens[0], {"count":0, "time":0.0})
+            totals["count"] += self.counts[i]
+            totals["time"] += self.times[i]
+            totals = tags.setdefault(self._tag(i, starts), {"count":0, "time":0.0})
+            totals["count"] += self.counts[i]
+            totals["time"] += self.times[i]
+
+        calls = {}
+        for target, (count, inclusive, exclusive) in self.calls.items():
+            calls[names.get(target, f'line {target + 1}')] = {"calls":count,
+                                                              "inclusive":inclusive,
+                                                              "exclusive":exclusive}
+
+        return {"instructions":self.executed,
+                "time":sum(self.times),
+                "lines":lines,
+                "opcodes":opcodes,
+                "tags":tags,
+                "calls":calls}
+
+    # Human readable version of the summary
+    def report(self, stream=None):
+        stream = stream if stream else sys.stderr
+        summary = self.summary()
+        write = lambda text='': print(text, file=stream)
+
+        write()
+        write("profile: {} instructions in {:.6f}s".format(summary["instructions"], summary["time"]))
+
+        write()
+        write("{:>6} {:>10} {:>10}  {}".format("line", "count", "time", "instruction"))
+        for line in summary["lines"]:
+            write("{:>6} {:>10} {:>10.6f}  {}".format(line["line"], line["count"], line["time"], line["instruction"]))
+
+        for title, totals in (("opcode", summary["opcodes"]), ("tag", summary["tags"])):
+            write()
+            write("{:>6} {:>10} {:>10}".format(title, "count", "time"))
+            for name, total in sorted(totals.items(), key=lambda item: -item[1]["time"]):
+                write("{:>6} {:>10} {:>10.6f}".format(name, total["count"], total["time"]))
+
+        if summary["calls"]:
+            write()
+            write("{:>6} {:>10} {:>10} {:>10}".format("call", "calls", "inclusive", "exclusive"))
+            for name, total in sorted(summary["calls"].items(), key=lambda item: -item[1]["inclusive"]):
+                write("{:>6} {:>10} {:>10} {:>10}".format(name, total["calls"], total["inclusive"], total["exclusive"]))
+
+    def write_json(self, filename):
+        with open(filename, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+
+
+# Watches a running program without printing the whole state every cycle:
+#   trace               - The last trace_size instructions run, with the
+#                         registers before each one. Only printed on request
+#                         or when the program stops on an error
+#   breakpoints         - Tags or line numbers (counting from 1) to stop at
+#   watches             - Registers (ACC, BAK, ...) or stack cells ([12]) to
+#                         stop at whenever their value changes
+#
+# Every cycle costs the same however big the stack is, the full stack is
+# never looked at unless it is asked for.
+class Debugger:
+    def __init__(self, interpereter, trace_size=100, breakpoints=(), watches=(), stream=None):
+        self.interpereter = interpereter
+        self.stream = stream if stream else sys.stderr
+        self.trace = deque(maxlen=trace_size)
+
+        self.breakpoints = set()
+        for location in breakpoints:
+            if location in interpereter.tags:
+                self.breakpoints.add(interpereter.tags[location])
+            elif location.isdigit():
+                self.breakpoints.add(int(location) - 1)
+            else:
+                raise TagError(0, f'{location} is not a valid breakpoint')
+
+        self.watches = []
+        for watch in watches:
+            kind, value = decode_operand(watch)
+            if not (kind == REG or (kind == MEM and value[0] == IMM)):
+                raise SourceError(0, f'{watch} is not a valid watch, use a register or [n]')
+            watched = self._watched(kind, value)
+            self.watches.append([watch, watched, watched()])
+
+        # Stop before the next instruction, set by the step command
+        self.stepping = False
+
+    # Build a function returning the current value of a decoded watch, a
+    # register or stack cell, so after() never decodes anything
+    def _watched(self, kind, value):
+        interpereter = self.interpereter
+        if kind == REG:
+            return {'ACC':lambda: interpereter.acc,
+                    'BAK':lambda: interpereter.bak,
+                    'STP':lambda: interpereter.stp,
+                    'SFP':lambda: interpereter.fp,
+                    'BSP':lambda: interpereter.bp,
+                    'DAT':lambda: DATA_BASE,
+                    'DLN':lambda: len(interpereter.data)}[value]
+        pos = value[1]
+        def cell():
+            elements = interpereter.stack.elements
+            if pos < len(elements):
+                return elements[pos]
+            if 0 <= pos - DATA_BASE < len(interpereter.data):
+                return interpereter.data[pos - DATA_BASE]
+            return None
+        return cell
+
+    # Called before every instruction
+    def before(self, line):
+        interpereter = self.interpereter
+        self.trace.append((line, interpereter.acc, interpereter.bak,
+                           interpereter.stp, interpereter.fp, interpereter.bp))
+        if self.stepping or line in self.breakpoints:
+            self.stepping = False
+            self.stop(f'break at line {line + 1}')
+
+    # Called after every instruction
+    def after(self):
+        for watch in self.watches:
+            value = watch[1]()
+            if value != watch[2]:
+                message = f'{watch[0]} changed from {watch[2]} to {value}'
+                watch[2] = value
+                self.stop(message)
+
+    def write(self, text=''):
+        print(text, file=self.stream)
+
+    # One line with the registers and the instruction
+    def _state(self, line, acc, bak, stp, fp, bp):
+        tokens = self.interpereter.instruction_list[line] if 0 <= line < len(self.interpereter.instruction_list) else []
+        return '{:>6}  acc={} bak={} stp={} sfp={} bsp={}  {}'.format(
+            line + 1, acc, bak, stp, fp, bp, ' '.join(tokens))
+
+    def print_trace(self):
+        self.write(f'last {len(self.trace)} instructions:')
+        for state in self.trace:
+            self.write(self._state(*state))
+
+    # The top of the stack, down to the current frame at most
+    def print_stack(self, cells=16):
+        elements = self.interpereter.stack.elements
+        start = max(0, len(elements) - cells, min(self.interpereter.bp, len(elements)))
+        self.write('stack[{}:{}]: {}'.format(start, len(elements), list(elements[start:])))
+
+    # Stop and ask what to do, or just report when there's nobody to ask
+    def stop(self, message):
+        interpereter = self.interpereter
+        interpereter.output.flush()
+        self.write()
+        self.write(message)
+        self.write(self._state(interpereter.instruction_ptr, interpereter.acc, interpereter.bak,
+                               interpereter.stp, interpereter.fp, interpereter.bp))
+        if not sys.stdin.isatty():
+            return
+        while True:
+            self.stream.write('(c)ontinue, (s)tep, (t)race, s(t)ack (k), (q)uit: ')
+            self.stream.flush()
+            command = sys.stdin.readline().strip()
+            if command in ('', 'c'):
+                return
+            elif command == 's':
+                self.stepping = True
+                return
+            elif command == 't':
+                self.print_trace()
+            elif command == 'k':
+                self.print_stack()
+            elif command == 'q':
+                interpereter.do_continue = False
+                return
+
+
+# What hooks get called with. Lines count from 0 like they do in errors, and
+# the registers are as they are right after the line ran. value depends on
+# the event:
+#   instruction         - None
+#   call                - The line called
+#   return              - The line returned to
+#   output              - The text printed
+#   stack               - The size of the stack, which has never been this big
+#                         before during this run
+#   halt                - None, the program halted or ran off the end
+#   error               - The exception the program stopped on
+HOOK_EVENTS = ('instruction', 'call', 'return', 'output', 'stack', 'halt', 'error')
+
+class Event:
+    def __init__(self, name, interpereter, line, value=None):
+        self.name = name
+        self.line = line
+        tokens = interpereter.instruction_list[line] if 0 <= line < len(interpereter.instruction_list) else []
+        self.opcode = tokens[0] if tokens else None
+        self.operands = tokens[1:]
+        self.acc = interpereter.acc
+        self.bak = interpereter.bak
+        self.stp = interpereter.stp
+        self.fp = interpereter.fp
+        self.bp = interpereter.bp
+        self.value = value
+
+    def __repr__(self):
+        return 'Event({}, line {}, {}, acc={} bak={} stp={} sfp={} bsp={}, value={!r})'.format(
+            self.name, self.line + 1, ' '.join([self.opcode or ''] + self.operands),
+            self.acc, self.bak, self.stp, self.fp, self.bp, self.value)
+
+
+# Passes everything on to the real output, telling the output hooks first
+class HookedOutput:
+    def __init__(self, output, interpereter):
+        self.output = output
+        self.interpereter = interpereter
+
+    def write(self, text):
+        self.interpereter._fire('output', self.interpereter.instruction_ptr, text)
+        self.output.write(text)
+
+    def flush(self): self.output.flush()
+
 
 class Interpereter:
-    def __init__(self, instructions, DEBUG=False, STEP=False):
+    def __init__(self, instructions, DEBUG=False, STEP=False, output=None, profile=False, tags=None, input=None, data=None, numbers='unbounded', strict_tags=False, ports=None, dialect='risc'):
         self.DEBUG = DEBUG
         self.STEP = STEP
 
-        # Controlls the continuation of the main interpereter loop, HLT will
-        # set this false and stop the loop
-        self.do_continue = True
+        # The numeric model, one of NUMBERS. low and high are None when
+        # values have no limit
+        if numbers not in NUMBERS:
+            raise ValueError(f'{numbers} is not a numeric model')
+        self.numbers = numbers
+        self.low, self.high, self.typecode = NUMBERS[numbers]
+
+        # Everything CHP and INP print goes through the output, which only
+        # needs a write(text) and a flush()
+        self.output = output if output else BufferedOutput()
+
+        # RDC and RDI read from the input, which only needs a read_char() and
+        # a read_int()
+        self.input = input if input else InputReader()
+
+        # Ports are the operands @NAME, connected to channels to other
+        # interpereters by a Network. Port name -> (channel, True for a port
+        # we read from and False for one we write to)
+        self.ports = ports if ports else {}
 
-        # The instruction list is simply a list of lists:
+        # The instruction list is a list of lists:
         #   - Each line
         #   - Each token on each line
         #
-        # Parsing the instructions is a simple line break and split on spaces
-        self.instruction_list = self.parse_instructions(instructions)
-
-        # The instruction pointer keeps track of where we are in the code
-        # Changing this pointer is how we preform a jump
-        self.instruction_ptr = 0
-
-        # The stack is an infinite* memory storage location where we can only
-        # access memory on top of the stack, it makes big programs and concepts
-        # like functions possible.
+        # Parsing a program, a string or a text file, gives a ProgramTable
+        # which looks like one, see parse_program. With strict_tags a tag
+        # defined twice is a TagError, and dialect is what the program is
+        # written in. An already parsed instruction list (say from another
+        # interpereter or the cache) is used as it is, along with where its
+        # tags were if we know.
         #
-        # * infinite really means as much physical memory as we have
-        self.stack = Stack()
+        # Everything after parsing runs the same in every dialect, except
+        # params(), see there.
+        self.dialect = dialect
+        if isinstance(instructions, str) or hasattr(instructions, 'read'):
+            self.instruction_list = self.parse_instructions(instructions, strict_tags, dialect)
+        else:
+            self.instruction_list = instructions
+            self.tags = tags if tags else {}
 
-        # ACC, BAK, STP, SFP and BSP are the registers. They store integer values
-        # ACC is where mathematic and comparison operations are preformed
-        # BAK is a backup register for extra use
-        # STP is where the current pointer to the head of the stack, -1 if empty
-        # SFP is the head of the stack frame. This is where general use starts
-        # BSP is the begining of the stack frame. This is how stack arguments are passed
-        self.acc = 0
-        self.bak = 0
-        self.stp = -1
-        self.fp  = 0
-        self.bp = 0
+        self.reset()
 
         # A dictionary of instructions allows us to look up functions by keyword.
         # This is useful when we are parsing code because we don't need if else 
@@ -175,295 +959,3171 @@ class Interpereter:
             "JNZ":self._jnz,
             "JGZ":self._jgz,
             "JLZ":self._jlz,
-            "HLT":self._halt
+            "HLT":self._halt,
+            "RDC":self._read_char,
+            "RDI":self._read_int
         }
 
-    # Take a textfile and turn it into an indexable list of instructions
-    def parse_instructions(self, instruction_file):
-        tags = {}
-        instructions = []
-
-        # Remove comments, tokenize lines
-        instructions = [line[:line.find("'")].strip().split() if line.find("'") != -1 else line.strip().split() for line in instruction_file.splitlines()]
-
-        # Locate tags
-        for i,tokens in enumerate(instructions):
-            #If we actually have tokens and the first token is a tag
-            if tokens and tokens[0][-1] == ':':
-                # Save name of tag with line it was found on
-                tags[tokens[0][:-1]] = str(i)
-                # Save remaining instructions without the tag
-                tokens = tokens[1:]
-            # Update instruction
-            instructions[i] = tokens
-
-        # Replace tags with line numbers
-        for i,tokens in enumerate(instructions):
-                # Replace jumps
-                tokens = [tags[token] if token in tags else token for token in tokens]
-                instructions[i] = tokens
-        return instructions
+        # The fixed width models keep ACC in range after every ADD and SUB.
+        # Unbounded runs keep the plain versions so they pay nothing for it.
+        if self.low is not None:
+            self.instructions["ADD"] = self._add_fixed
+            self.instructions["SUB"] = self._sub_fixed
+            self.instructions["CHP"] = self._char_print_fixed
 
-    def params(self, parameters):
-        self.stack.push(len(parameters))
-        self.stp += 1
+        # The program is the decoded form of the instruction list, one
+        # (function, arguments) pair per line. Every operand has already been
+        # turned into something we can call, so running an instruction never
+        # has to compare strings or parse integers.
+        self.program = self.decode_instructions(self.instruction_list)
 
-        if parameters:
-            # Initialize argv array
-            for parameter in parameters:
-                self.stack.push(0)
-                self.stp += 1
-
-            # Fill argv pointer values
-            for i,parameter in enumerate(parameters):
-                # Set pointer to our variable
-                self.stack.elements[i+1] = self.stp + 1
-                for char in parameter:
-                    self.stack.push(ord(char))
-                    self.stp += 1
-                # Push null terminator
-                self.stack.push(0)
-                self.stp += 1
+        # Only set when profiling, runs go through a separate loop then so
+        # the normal loop doesn't pay anything for it
+        self.profiler = Profiler(self) if profile else None
 
-        # Set registers accordingly
-        self.bp = 0
-        self.fp = self.stp
+        # Same for the debugger, which is set up from outside since it needs
+        # to know where the tags are
+        self.debugger = None
 
-    # Preform interperetation
-    def run(self):
-        #The main interpereter loop
-        while self.do_continue and self.instruction_ptr < len(self.instruction_list):
+        # And for recording, see record()
+        self.recorder = None
 
+        # Compiled traces by the line they start at, and how many more times
+        # a loop has to go round before it gets traced. Only used after jit()
+        self.traces = {}
+        self.hot = {}
 
-            #DEBUG -- Debug info on each cycle.
-            if self.DEBUG:
-                #STEP -- Wait for user to step each cycle
-                #if STEP and readchar.readchar() == 'q': self.do_continue = False
-                #STEP uses the readchar module, do or don't it's not required
-                print('')
-                print("------------")
-
-                # Print the stack in such a way that we can see where the
-                # pointers are pointing
-                print("stack:")
-                matrix = [[] for _ in range(6)]
-                for i,element in enumerate(self.stack.elements):
-                    val_len = len(str(element)) + 2
-                    new_val = [' '] * val_len
-                    for j in range(6):
-                        matrix[j] += new_val
-                    if self.acc == i:
-                        matrix[0][-val_len + 1] = '^'
-                        matrix[3][-val_len + 1] = 'A'
-                    if self.bak == i:
-                        matrix[0][-val_len + 1] = '^'
-                        matrix[4][-val_len + 1] = 'K'
-                    if self.bp == i:
-                        matrix[0][-val_len + 1] = '^'
-                        matrix[1][-val_len + 1] = 'B'
-                    if self.fp == i:
-                        matrix[0][-val_len + 1] = '^'
-                        matrix[2][-val_len + 1] = 'F'
-                    if self.stp == i:
-                        matrix[0][-val_len + 1] = '^'
-                        matrix[5][-val_len + 1] = 'T'
-                print(self.stack.elements)
-                for line in matrix:
-                    print("".join(line))
-                print('')
-
-                print("ip     : {}".format(self.instruction_ptr))
-                print("sbp  B : {}".format(self.bp))
-                print("sfp  F : {}".format(self.fp))
-                print("acc  A : {}".format(self.acc))
-                print("bak  K : {}".format(self.bak))
-                print("stp  T : {}".format(self.stp))
-                print("ins    : {}".format(self.instruction_list[self.instruction_ptr]))
-                print("------------")
-                if self.STEP: input("<enter to continue>")
-
-            #DEBUG
-
-            # The instruction which is currently being pointed to
-            instruction = self.instruction_list[self.instruction_ptr]
-
-
-            # If empty line, don't run a command
-            if instruction == []:
-                self.instruction_ptr += 1
-                continue
+        # Event name -> [callback, every, count] for every hook added with
+        # add_hook(). Runs only go through the hooked loop when there are any
+        self.hooks = {}
 
-            # The opcode of the current instruction
-            #   - MOV, PSH, POP etc...
-            #
-            # The opcode is always the first element of the instruction
-            opcode = instruction[0]
+        # The data segment, [DATA_BASE] onwards. Empty unless a file is mapped
+        # in with map_data()
+        self.data = data if data is not None else b''
 
+    # Put the machine back to where it was before params() and run(), so one
+    # interpereter can run the same program over and over
+    def reset(self):
+        # Controlls the continuation of the main interpereter loop, HLT will
+        # set this false and stop the loop
+        self.do_continue = True
 
-            # If the opcode is not valid, raise an error so the user 
-            # can correct it
-            if opcode not in self.instructions:
-                raise InstructionError(self.instruction_ptr, f'{opcode} is not a valid instruction')
+        # The instruction pointer keeps track of where we are in the code
+        # Changing this pointer is how we preform a jump
+        self.instruction_ptr = 0
 
-            # Index into the instructions dictionary and call it with the
-            # remaining pieces of the instruction tokens
-            #
-            # *instruction[1:] is special
-            #   > This takes all the tokens except for the first one
-            #   > If there are no other tokens, it returns an empty list
-            #   > The * ('splat') operator takes the list and passes each element
-            #     as an argument to the function
-            #   > if * recieves an empty list, it passes nothing
-            #
-            # Because the *instruction[1:] is so special, we don't have to write
-            # any special code to handle instructions with varying argument length
-            self.instructions[opcode](*instruction[1:])
+        # The stack is an infinite* memory storage location where we can only
+        # access memory on top of the stack, it makes big programs and concepts
+        # like functions possible.
+        #
+        # * infinite really means as much physical memory as we have
+        self.stack = Stack(typecode=self.typecode)
 
-            # Increment the instruction pointer to the next instruction
-            self.instruction_ptr += 1
+        # ACC, BAK, STP, SFP and BSP are the registers. They store integer values
+        # ACC is where mathematic and comparison operations are preformed
+        # BAK is a backup register for extra use
+        # STP is where the current pointer to the head of the stack, -1 if empty
+        # SFP is the head of the stack frame. This is where general use starts
+        # BSP is the begining of the stack frame. This is how stack arguments are passed
+        self.acc = 0
+        self.bak = 0
+        self.stp = -1
+        self.fp  = 0
+        self.bp = 0
 
-    # Push the instruction pointer onto the stack
-    # Push the previous base function pointer to the stack
-    # Push the previous function pointer to the stack
-    # Take argument pointers
-    # Increment stack ptr +3
-    # Set the function pointer to STP - 1
-    # Set the instruction pointer to <SRC>
-    def _call(self, src):
-        old_bp = self.bp
-        self.bp = self.stp + 1
-        self.stack.push(self.instruction_ptr)
-        self.stack.push(old_bp)
-        self.stack.push(self.fp)
-        self.stp += 3
-        self.fp = self.stp 
-        self.instruction_ptr = self._get_src(src) - 1
+        # Instructions run by runs with limits so far, and the limits. The
+        # budget is the number of steps to stop at and the deadline a
+        # time.monotonic() time, see limit()
+        self.steps = 0
+        self.budget = None
+        self.deadline = None
+        self.seconds = None
+        self.limited = False
 
-    # Set instruction pointer to value at function pointer + 1
-    # Set the stack pointer to function pointer - 1
-    # Set the function pointer to the value at function pointer
-    # Trim stack
-    def _return(self):
-        old_bp = self.bp
-        self.instruction_ptr = self.stack.elements[self.bp]
-        self.fp = self.stack.elements[self.bp + 2]
-        self.stp = self.bp - 1
-        self.bp = self.stack.elements[self.bp + 1]
-        self.stack.elements = self.stack.elements[:old_bp]
-
-    # Get the appropriate integer value for the specified source
-    def _get_src(self, src):
-        if src == 'ACC':
-            return self.acc
-        elif src == 'BAK':
-            return self.bak
-        elif src == 'STP':
-            return self.stp
-        elif src == 'SFP':
-            return self.fp
-        elif src == 'BSP':
-            return self.bp
-        elif src[0] =='[' and src[-1] ==']':
-            pos = self._get_src(src[1:-1])
-            if pos >= len(self.stack.elements):
-                raise IdexError(self.instruction_ptr, f'{pos} is out of stack bounds')
-            else:
-                return self.stack.elements[pos]
-        elif src[0].isdigit():
-            # if it wasn't a register or the stack, check if it's an integer
-            return int(src)
-        else:
-            # if it wasn't any of those things, it was an error
-            raise SourceError(self.instruction_ptr, f'{src} is not a valid source value')
-
-    # Generally set the destination to the provided value
-    def _set_dest(self, value, dest):
-        if dest == 'ACC':
-            self.acc = value
-        elif dest == 'BAK':
-            self.bak = value
-        elif dest[0] == '[' and dest[-1] == ']':
-            pos = self._get_src(dest[1:-1])
-            if pos >= len(self.stack.elements):
-                raise IdexError(self.instruction_ptr, f'{pos} is out of stack bounds')
-            else:
-                self.stack.elements[pos] = value
-        else:
-            raise DestError(self.instruction_ptr, f'{dest} is not a valid destination value')
+        # (port, channel, reading) of the port a run stopped on, see
+        # _port_line
+        self.blocked = None
 
-    # The only instruction with the DST argument
-    # Overwrites the specified location with the provided value
-    def _move(self, src, dest):
-        self._set_dest(self._get_src(src), dest)
+    # Take a textfile and turn it into an indexable list of instructions
+    def parse_instructions(self, instruction_file, strict=False, dialect='risc'):
+        table = parse_program(instruction_file, strict, dialect)
+        # Remember where the tags were for reports like the profiler's
+        self.tags = table.tags
+        return table
 
-    # Pushes the specified value to the stack, does not overwrite
-    def _push(self, src):
-        self.stack.push(self._get_src(src))
-        self.stp += 1
+    # Turn the parsed instruction list into (function, arguments) pairs.
+    #
+    # Anything that is wrong with a line is not reported here, it becomes a
+    # function that raises the same error the line always raised so that
+    # programs only fail when (and if) the bad line is actually executed.
+    def decode_instructions(self, instruction_list):
+        # Decoded lines and operands only look at the interpereter when they
+        # run, so every line reading the same can share them. Big programs
+        # repeat the same few lines and operands over and over.
+        self._operands = {}
+        lines = {}
+        program = []
+        for tokens in instruction_list:
+            key = tuple(tokens)
+            decoded = lines.get(key)
+            if decoded is None:
+                decoded = lines[key] = self._decode(tokens)
+            program.append(decoded)
+        return program
 
-    # Removes the top value on the stack
-    def _pop(self):
-        self.stack.pop()
-        self.stp -= 1
+    def _decode(self, tokens):
+        # Empty lines and lines with only a tag do nothing
+        if not tokens:
+            return (self._skip, ())
 
-    # Adds the specified value to acc
-    def _add(self, src):
-        self.acc += self._get_src(src)
+        opcode, operands = tokens[0], tokens[1:]
+        if opcode not in self.instructions:
+            return (self._bad_instruction, (opcode,))
 
-    # Subtracts the specified value from acc
-    def _sub(self, src):
-        self.acc -= self._get_src(src)
+        # Hand the wrong number of operands over untouched, calling the
+        # instruction will complain about it the same way it always has
+        kinds = OPERANDS[opcode]
+        if len(operands) != len(kinds):
+            return (self.instructions[opcode], tuple(operands))
 
-    # Print the specified value as a char
-    def _char_print(self, src):
-        print(chr(self._get_src(src)), end='')
+        args = []
+        waits = []
+        for kind, token in zip(kinds, operands):
+            if kind == TAG:
+                # Jumps only take line numbers, which become the instruction
+                # pointer right before it gets incremented
+                if not token.isdigit():
+                    return (self._bad_tag, (token,))
+                args.append(int(token) - 1)
+            elif token[:1] == '@':
+                operand, wait = self._decode_port(opcode, kind, token)
+                if wait:
+                    waits.append(wait)
+                args.append(operand)
+            else:
+                # Numbers are fitted into the numeric model, unless CLL uses
+                # them as the line to call
+                fit = kind == SRC and opcode != "CLL" and self.low is not None
+                operand = self._operands.get((kind, token, fit))
+                if operand is None:
+                    if kind == SRC:
+                        operand = self._decode_src(token, fit)
+                    else:
+                        operand = self._decode_dest(token)
+                    self._operands[(kind, token, fit)] = operand
+                args.append(operand)
+        if waits:
+            return (self._port_line, (tuple(waits), self.instructions[opcode], tuple(args)))
+        return (self.instructions[opcode], tuple(args))
 
-    # Print the specified value as an integer
-    def _int_print(self, src):
-        print(int(self._get_src(src)), end='')
+    # Build the function reading or writing a port operand, along with what
+    # the line has to wait for before it can use it. A port which can't be
+    # used there raises its error when run like any other bad operand.
+    def _decode_port(self, opcode, kind, token):
+        problem = self._port_error(opcode, kind, token)
+        if problem:
+            error, message = problem
+            def bad_port(*element):
+                raise error(self.instruction_ptr, message)
+            return bad_port, None
 
-    # Unconditionally jump to specified location
-    def _jmp(self, src):
-        if not src.isdigit():
-            raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+        channel, reading = self.ports[token[1:]]
+        if reading:
+            return channel.receive, (token, channel, True)
+        # Channels between processes hold 64 bit integers, so all of them do
+        low, high, _ = NUMBERS['wrap64']
+        def send(element):
+            if not low <= element <= high:
+                raise DestError(self.instruction_ptr, f'{element} is too big for a port')
+            channel.send(element)
+        return send, (token, channel, False)
 
-        self.instruction_ptr = self._get_src(src) - 1
+    # What is wrong with a port operand as (error class, message), None if
+    # nothing is. CLL pushes its frame before reading where to go, so it
+    # can't wait on a port.
+    def _port_error(self, opcode, kind, token):
+        port = self.ports.get(token[1:])
+        error = SourceError if kind == SRC else DestError
+        if port is None:
+            return error, f'{token} is not a connected port'
+        if opcode == "CLL":
+            return error, f"{token} can't be called"
+        if port[1] != (kind == SRC):
+            return error, f'{token} is an {"input" if port[1] else "output"} port'
+        return None
 
-    # If acc equals zero, jump to specified location
-    def _jez(self, src):
-        if not src.isdigit():
-            raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+    # Lines using ports only run once every port on them can go, a value to
+    # read or room to write, so a line never stops half done. Until then the
+    # run stops with the line still to run and run() says it is blocked.
+    # One reader and one writer per channel means nothing else can take
+    # that away once we've looked.
+    def _port_line(self, waits, function, args):
+        for token, channel, reading in waits:
+            if not (channel.ready() if reading else channel.space()):
+                self.blocked = (token, channel, reading)
+                self.do_continue = False
+                self.instruction_ptr -= 1
+                return
+        function(*args)
 
+    # Whether the port a blocked run stopped on can go now
+    def ready(self):
+        token, channel, reading = self.blocked
+        return channel.ready() if reading else channel.space()
+
+    # The error to report for a run that is blocked for good
+    def deadlock_error(self):
+        token, channel, reading = self.blocked
+        return DeadlockError(self.instruction_ptr, f'blocked {"reading" if reading else "writing"} {token}')
+
+    # Build a function returning the current value of a decoded <SRC>, with
+    # fit a number is fitted into the numeric model first
+    def _decode_src(self, token, fit=False):
+        kind, value = decode_operand(token)
+        if kind == IMM:
+            if fit:
+                value = fit_number(self.numbers, value)
+            return lambda: value
+        elif kind == REG:
+            return {
+                'ACC':lambda: self.acc,
+                'BAK':lambda: self.bak,
+                'STP':lambda: self.stp,
+                'SFP':lambda: self.fp,
+                'BSP':lambda: self.bp,
+                'DAT':lambda: DATA_BASE,
+                'DLN':lambda: len(self.data)
+            }[value]
+        elif kind == MEM:
+            pointer = self._decode_src(token[1:-1])
+            def load():
+                pos = pointer()
+                if pos >= len(self.stack.elements):
+                    return self._load_data(pos)
+                return self.stack.elements[pos]
+            return load
+        elif value[:1].isdigit():
+            # Looked like a number but isn't one, let int() complain
+            return lambda: int(value)
+        else:
+            def bad_src():
+                raise SourceError(self.instruction_ptr, f'{value} is not a valid source value')
+            return bad_src
+
+    # Build a function storing a value into a decoded <DST>
+    def _decode_dest(self, token):
+        kind, value = decode_operand(token)
+        if kind == REG and value == 'ACC':
+            def store(element): self.acc = element
+            return store
+        elif kind == REG and value == 'BAK':
+            def store(element): self.bak = element
+            return store
+        elif kind == MEM:
+            pointer = self._decode_src(token[1:-1])
+            def store(element):
+                pos = pointer()
+                if pos >= len(self.stack.elements):
+                    return self._store_data(pos, element)
+                self.stack.set(pos, element)
+            return store
+        else:
+            def bad_dest(element):
+                raise DestError(self.instruction_ptr, f'{token} is not a valid destination value')
+            return bad_dest
+
+    # Check the whole program before running it. Returns every error found,
+    # each one the same error the line would raise once it is executed, so
+    # a program can be fixed in one go instead of one run per mistake.
+    def validate(self):
+        errors = []
+        for line,tokens in enumerate(self.instruction_list):
+            if not tokens:
+                continue
+
+            opcode, operands = tokens[0], tokens[1:]
+            if opcode not in self.instructions:
+                errors.append(InstructionError(line, f'{opcode} is not a valid instruction'))
+                continue
+
+            kinds = OPERANDS[opcode]
+            if len(operands) != len(kinds):
+                errors.append(InstructionError(line, f'{opcode} takes {len(kinds)} operands, not {len(operands)}'))
+                continue
+
+            for kind, token in zip(kinds, operands):
+                if kind != TAG and token[:1] == '@':
+                    problem = self._port_error(opcode, kind, token)
+                    error = problem[0](line, problem[1]) if problem else None
+                else:
+                    error = self._check_operand(line, kind, token)
+                if error:
+                    errors.append(error)
+
+        return errors
+
+    def _check_operand(self, line, kind, token):
+        if kind == TAG:
+            if not token.isdigit():
+                return TagError(line, f'{token} is not a valid jump location')
+            return None
+
+        if kind == DST and not self._is_dest(token):
+            return DestError(line, f'{token} is not a valid destination value')
+
+        # Brackets can nest, what's inside the innermost ones has to be
+        # something we can read
+        while decode_operand(token)[0] == MEM:
+            token = token[1:-1]
+        if decode_operand(token)[0] == BAD:
+            return SourceError(line, f'{token} is not a valid source value')
+        return None
+
+    # Peephole optimization, replaces common sequences of instructions with
+    # a single fused instruction doing the same work in one dispatch:
+    #   increment           - MOV BAK ACC / ADD <n> / MOV ACC BAK, also SUB
+    #   pop                 - MOV [STP] <DST> / POP
+    #   load argument       - MOV BSP ACC / SUB <n> / MOV [ACC] <DST>
+    #
+    # Only the first line of a sequence is replaced and it moves the
+    # instruction pointer past the rest, the other lines stay as they are.
+    # Sequences with a jump, call or return landing in the middle of them are
+    # left alone, and nothing is fused when a CLL jumps to a computed line
+    # since it could land anywhere.
+    #
+    # Returns (first line, last line, name) for every fused sequence
+    def optimize(self):
+        targets = self._jump_targets()
+        if targets is None:
+            return []
+
+        fused = []
+        i = 0
+        while i < len(self.instruction_list):
+            for size, match in ((3, self._match_increment),
+                                (2, self._match_pop),
+                                (3, self._match_load_argument)):
+                lines = self.instruction_list[i:i + size]
+                if len(lines) < size or any(line in targets for line in range(i + 1, i + size)):
+                    continue
+                found = match(*lines)
+                if found:
+                    name, function, args = found
+                    self.program[i] = (function, args)
+                    fused.append((i, i + size - 1, name))
+                    i += size - 1
+                    break
+            i += 1
+        return fused
+
+    # Every line something can jump into, None if that can't be known
+    def _jump_targets(self):
+        targets = set()
+        for i,tokens in enumerate(self.instruction_list):
+            if len(tokens) != 2:
+                continue
+            opcode, operand = tokens
+            if OPERANDS.get(opcode) == (TAG,) and operand.isdigit():
+                targets.add(int(operand))
+            elif opcode == "CLL":
+                kind, value = decode_operand(operand)
+                if kind != IMM:
+                    return None
+                targets.add(value)
+                # RET comes back to the line after the call
+                targets.add(i + 1)
+        return targets
+
+    def _is_dest(self, token):
+        kind, value = decode_operand(token)
+        return kind == MEM or (kind == REG and value in ('ACC', 'BAK'))
+
+    def _is_number(self, token):
+        return decode_operand(token)[0] == IMM
+
+    # Increments and argument loads do their own ADD or SUB, which only
+    # works out when values have no limit
+    def _match_increment(self, first, second, third):
+        if (self.low is None and first == ['MOV', 'BAK', 'ACC'] and third == ['MOV', 'ACC', 'BAK']
+                and len(second) == 2 and second[0] in ('ADD', 'SUB') and self._is_number(second[1])):
+            step = int(second[1]) if second[0] == 'ADD' else -int(second[1])
+            return ('increment', self._fused_increment, (step,))
+
+    def _match_pop(self, first, second):
+        if (len(first) == 3 and first[:2] == ['MOV', '[STP]'] and self._is_dest(first[2])
+                and second == ['POP']):
+            return ('pop', self._fused_pop, (self._decode_dest(first[2]),))
+
+    def _match_load_argument(self, first, second, third):
+        if (self.low is None and first == ['MOV', 'BSP', 'ACC'] and second[:1] == ['SUB'] and len(second) == 2
+                and self._is_number(second[1]) and len(third) == 3
+                and third[:2] == ['MOV', '[ACC]'] and self._is_dest(third[2])):
+            return ('load argument', self._fused_load_argument, (int(second[1]), self._decode_dest(third[2])))
+
+    # Trimmed programs start with an empty stack, like they always have, so
+    # they take no params
+    def params(self, parameters):
+        if self.dialect == 'trimmed':
+            if parameters:
+                raise ValueError("trimmed programs don't take params")
+            return
+
+        # Build argc, the argv array and the strings in one go, then push
+        # them all at once
+        cells = [len(parameters)] + [0] * len(parameters)
+
+        # Fill argv pointer values
+        for i,parameter in enumerate(parameters):
+            # Set pointer to our variable
+            cells[i+1] = self.stp + 1 + len(cells)
+            cells.extend(ord(char) for char in parameter)
+            # Push null terminator
+            cells.append(0)
+
+        self.stack.extend(cells)
+        self.stp += len(cells)
+
+        # Set registers accordingly
+        self.bp = 0
+        self.fp = self.stp
+
+    # Addresses past the end of the stack, which is fine as long as they are
+    # in the data segment
+    def _data_offset(self, pos):
+        offset = pos - DATA_BASE
+        if offset < 0:
+            raise IdexError(self.instruction_ptr, f'{pos} is out of stack bounds')
+        if offset >= len(self.data):
+            raise IdexError(self.instruction_ptr, f'{pos} is out of data bounds')
+        return offset
+
+    def _load_data(self, pos):
+        return self.data[self._data_offset(pos)]
+
+    # Data cells are bytes, writes only change our copy and never the file
+    def _store_data(self, pos, element):
+        offset = self._data_offset(pos)
+        if not 0 <= element < 256:
+            raise DestError(self.instruction_ptr, f'{element} does not fit in a data cell')
+        self.data[offset] = element
+
+    # Call callback(event) on every event-th time the event happens, see
+    # Event for the events there are. Runs which are profiled, debugged or
+    # recorded don't call hooks and raise ValueError instead.
+    def add_hook(self, event, callback, every=1):
+        if event not in HOOK_EVENTS:
+            raise ValueError(f'{event} is not a hook event, use one of {", ".join(HOOK_EVENTS)}')
+        if every < 1:
+            raise ValueError('every has to be at least 1')
+        self.hooks.setdefault(event, []).append([callback, every, 0])
+
+    def remove_hook(self, event, callback):
+        self.hooks[event] = [hook for hook in self.hooks.get(event, []) if hook[0] != callback]
+        if not self.hooks[event]:
+            del self.hooks[event]
+
+    # Count the event count times for every hook on it, calling the ones
+    # which are due. The Event is only built when one of them is.
+    def _fire(self, name, line, value=None, count=1):
+        event = None
+        for hook in self.hooks.get(name, ()):
+            hook[2] += count
+            if hook[2] % hook[1] == 0:
+                if event is None:
+                    event = Event(name, self, line, value)
+                hook[0](event)
+
+    # Preform interperetation. With max_steps only that many instructions
+    # are run, calling run again carries on from there. Returns why it
+    # stopped:
+    #   halted              - HLT, or the program ran off the end
+    #   yielded             - max_steps instructions ran
+    #   budget              - The budget set with limit() ran out
+    #   timeout             - The deadline set with limit() went by
+    #   blocked             - Waiting on a port, see _port_line. ready()
+    #                         says when it is worth running again
+    def run(self, max_steps=None):
+        status = None
+        if self.blocked:
+            self.blocked = None
+            self.do_continue = True
+        try:
+            if max_steps is None and self.budget is None and self.deadline is None:
+                self._steps(-1)
+                status = 'blocked' if self.blocked else 'halted'
+            else:
+                status = self._limited_run(max_steps)
+            return status
+        finally:
+            # Never lose output, even when the program raised an error. A run
+            # which only yielded keeps it for its flush policy to deal with
+            if status != 'yielded':
+                self.output.flush()
+
+    # Run for at most steps instructions with whichever loop is needed, -1
+    # runs until the program stops. Returns how many steps were left over.
+    # Only the hooked loop calls hooks, so they can't go with the loops which
+    # look at every line for something else.
+    def _steps(self, steps):
+        if self.hooks and (self.profiler or self.DEBUG or self.debugger or self.recorder):
+            raise ValueError("hooks can't be used while profiling, debugging or recording")
+        if self.profiler:
+            return self._profile_loop(steps)
+        elif self.DEBUG or self.debugger:
+            return self._debug_loop(steps)
+        elif self.recorder:
+            return self._recording_loop(steps)
+        elif self.hooks:
+            return self._hook_loop(steps)
+        elif steps < 0:
+            self._loop()
+            return steps
+        else:
+            return self._counted_loop(steps)
+
+    # Runs with limits go in pieces, small enough that the clock is looked
+    # at every CLOCK_EVERY instructions when there is a deadline. Traces
+    # can't be stopped part way, so they sit these runs out.
+    CLOCK_EVERY = 10000
+
+    def _limited_run(self, max_steps):
+        ran = 0
+        self.limited = True
+        try:
+            while True:
+                steps = []
+                if max_steps is not None:
+                    steps.append(max_steps - ran)
+                if self.budget is not None:
+                    steps.append(self.budget - self.steps)
+                if self.deadline is not None:
+                    steps.append(self.CLOCK_EVERY)
+                steps = min(steps)
+                if steps <= 0:
+                    return 'yielded' if max_steps is not None and ran >= max_steps else 'budget'
+
+                # A loop which raises leaves the steps it had left in
+                # self.left, so the ones which ran before still count
+                self.left = steps
+                try:
+                    self.left = self._steps(steps)
+                finally:
+                    done = steps - self.left
+                    ran += done
+                    self.steps += done
+                if self.blocked:
+                    # The line waiting on the port didn't run
+                    self.steps -= 1
+                    return 'blocked'
+                if not (self.do_continue and self.instruction_ptr < len(self.program)):
+                    return 'halted'
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    return 'timeout'
+        finally:
+            self.limited = False
+
+    # Copy of the whole state of the run, see Snapshot
+    def snapshot(self):
+        return Snapshot.capture(self)
+
+    # Stop runs once budget more instructions have run, or seconds from now.
+    # None leaves that one unlimited. reset() clears both.
+    def limit(self, budget=None, seconds=None):
+        self.budget = None if budget is None else self.steps + budget
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.seconds = seconds
+
+    # The error to report for a run which stopped on its budget or deadline,
+    # None for the other results of run()
+    def limit_error(self, result):
+        if result == 'budget':
+            return BudgetError(self.instruction_ptr, f'ran out of budget after {self.steps} instructions')
+        elif result == 'timeout':
+            return BudgetError(self.instruction_ptr, f'ran out of time after {self.seconds} seconds')
+        return None
+
+    #The main interpereter loop
+    def _loop(self):
+        while self.do_continue and self.instruction_ptr < len(self.program):
+            # Look up the decoded instruction which is currently being pointed
+            # to and call it with its already decoded operands.
+            #
+            # *args is special
+            #   > The * ('splat') operator takes the tuple and passes each
+            #     element as an argument to the function
+            #   > if * recieves an empty tuple, it passes nothing
+            #
+            # Because *args is so special, we don't have to write any special
+            # code to handle instructions with varying argument length
+            function, args = self.program[self.instruction_ptr]
+            function(*args)
+
+            # Increment the instruction pointer to the next instruction
+            self.instruction_ptr += 1
+
+    # The same for at most steps instructions, returns how many were left.
+    # Like every loop taking steps, it leaves that in self.left when an
+    # instruction raises, counting the one which did.
+    def _counted_loop(self, steps):
+        program = self.program
+        try:
+            while steps and self.do_continue and self.instruction_ptr < len(program):
+                function, args = program[self.instruction_ptr]
+                function(*args)
+                self.instruction_ptr += 1
+                steps -= 1
+        except Exception:
+            self.left = steps - 1
+            raise
+        return steps
+
+    # The other loops take steps the same way, -1 counts down forever
+    #
+    # The main loop with every instruction counted and timed
+    def _profile_loop(self, steps=-1):
+        profiler = self.profiler
+        clock = time.perf_counter
+        call = self._call
+        ret = self._return
+        while steps and self.do_continue and self.instruction_ptr < len(self.program):
+            steps -= 1
+            if self.DEBUG:
+                self._print_state()
+
+            line = self.instruction_ptr
+            function, args = self.program[line]
+            start = clock()
+            try:
+                function(*args)
+            except Exception:
+                self.left = steps
+                raise
+            finally:
+                profiler.times[line] += clock() - start
+                profiler.counts[line] += 1
+                profiler.executed += 1
+
+            if function == call:
+                profiler.call(self.instruction_ptr + 1)
+            elif function == ret:
+                profiler.ret()
+
+            self.instruction_ptr += 1
+        return steps
+
+    # The main loop telling the hooks what happens
+    def _hook_loop(self, steps=-1):
+        hooks = self.hooks
+        fire = self._fire
+        call = self.instructions["CLL"]
+        ret = self.instructions["RET"]
+        calls = 'call' in hooks or 'return' in hooks
+        stack = 'stack' in hooks
+
+        # Instruction hooks are only looked at every so many instructions,
+        # as many as all of them have in common
+        every = 0
+        for hook in hooks.get('instruction', ()):
+            every = math.gcd(every, hook[1])
+        countdown = every
+
+        line = self.instruction_ptr
+        # Only what was there before we started counts as stack growth
+        deepest = self.stp
+        output = self.output
+        if 'output' in hooks:
+            self.output = HookedOutput(output, self)
+        try:
+            while steps and self.do_continue and self.instruction_ptr < len(self.program):
+                steps -= 1
+                line = self.instruction_ptr
+                function, args = self.program[line]
+                function(*args)
+
+                if countdown:
+                    countdown -= 1
+                    if not countdown:
+                        countdown = every
+                        fire('instruction', line, count=every)
+                if calls:
+                    if function is call:
+                        fire('call', line, self.instruction_ptr + 1)
+                    elif function is ret:
+                        fire('return', line, self.instruction_ptr + 1)
+                if stack and self.stp > deepest:
+                    deepest = self.stp
+                    fire('stack', line, deepest + 1)
+
+                self.instruction_ptr += 1
+        except Exception as err:
+            self.left = steps
+            fire('error', line, err)
+            raise
+        finally:
+            self.output = output
+        if not (self.do_continue and self.instruction_ptr < len(self.program)):
+            fire('halt', line)
+        return steps
+
+    # The main loop writing down every line it runs, see Recorder. Input
+    # and output are written down as they go through.
+    def _recording_loop(self, steps=-1):
+        recorder = self.recorder
+        program = self.program
+        output, input = self.output, self.input
+        self.output = RecordedOutput(output, recorder)
+        self.input = RecordedInput(input, recorder)
+        batch = run = 0
+        try:
+            while steps and self.do_continue and self.instruction_ptr < len(program):
+                # Run up to the end of the chunk, or of steps if that is sooner
+                left = recorder.every - len(recorder.lines)
+                run = batch = left if steps < 0 or steps > left else steps
+                append = recorder.lines.append
+                while run and self.do_continue and self.instruction_ptr < len(program):
+                    run -= 1
+                    # The line goes in first, so a line which raises is there
+                    append(self.instruction_ptr)
+                    function, args = program[self.instruction_ptr]
+                    function(*args)
+                    self.instruction_ptr += 1
+                if steps > 0:
+                    steps -= batch - run
+                batch = run
+                if len(recorder.lines) == recorder.every:
+                    recorder.flush()
+        except Exception as err:
+            self.left = steps - (batch - run) if steps > 0 else steps
+            recorder.error = err
+            raise
+        finally:
+            self.output, self.input = output, input
+        return steps
+
+    # Write everything this interpereter runs into a recording at path from
+    # now on, with a keyframe every so many instructions. Returns the
+    # Recorder, which has to be closed once the run is over. Traces from
+    # jit() sit recorded runs out, but a line fused by optimize() runs the
+    # lines after it without them being written down, so those can't be
+    # recorded.
+    def record(self, path, every=None):
+        fused = (self._fused_increment, self._fused_pop, self._fused_load_argument)
+        if any(function in fused for function, _ in self.program):
+            raise ValueError("programs fused by optimize() can't be recorded")
+        return Recorder(path, self, every)
+
+    # The main loop with the debugger looking on
+    def _debug_loop(self, steps=-1):
+        debugger = self.debugger
+        try:
+            while steps and self.do_continue and self.instruction_ptr < len(self.program):
+                steps -= 1
+                #DEBUG -- Debug info on each cycle.
+                if self.DEBUG:
+                    self._print_state()
+
+                if debugger:
+                    debugger.before(self.instruction_ptr)
+                    if not self.do_continue:
+                        break
+
+                function, args = self.program[self.instruction_ptr]
+                function(*args)
+
+                if debugger:
+                    debugger.after()
+
+                self.instruction_ptr += 1
+        except Exception:
+            self.left = steps
+            # Show how we got here
+            if debugger:
+                self.output.flush()
+                debugger.print_trace()
+            raise
+        return steps
+
+    #DEBUG -- Debug info on each cycle.
+    def _print_state(self):
+        # Keep the program output in order with the debug info
+        self.output.flush()
+
+        #STEP -- Wait for user to step each cycle
+        #if STEP and readchar.readchar() == 'q': self.do_continue = False
+        #STEP uses the readchar module, do or don't it's not required
+        print('')
+        print("------------")
+
+        # Print the stack in such a way that we can see where the
+        # pointers are pointing
+        print("stack:")
+        matrix = [[] for _ in range(6)]
+        for i,element in enumerate(self.stack.elements):
+            val_len = len(str(element)) + 2
+            new_val = [' '] * val_len
+            for j in range(6):
+                matrix[j] += new_val
+            if self.acc == i:
+                matrix[0][-val_len + 1] = '^'
+                matrix[3][-val_len + 1] = 'A'
+            if self.bak == i:
+                matrix[0][-val_len + 1] = '^'
+                matrix[4][-val_len + 1] = 'K'
+            if self.bp == i:
+                matrix[0][-val_len + 1] = '^'
+                matrix[1][-val_len + 1] = 'B'
+            if self.fp == i:
+                matrix[0][-val_len + 1] = '^'
+                matrix[2][-val_len + 1] = 'F'
+            if self.stp == i:
+                matrix[0][-val_len + 1] = '^'
+                matrix[5][-val_len + 1] = 'T'
+        print(list(self.stack.elements))
+        for line in matrix:
+            print("".join(line))
+        print('')
+
+        print("ip     : {}".format(self.instruction_ptr))
+        print("sbp  B : {}".format(self.bp))
+        print("sfp  F : {}".format(self.fp))
+        print("acc  A : {}".format(self.acc))
+        print("bak  K : {}".format(self.bak))
+        print("stp  T : {}".format(self.stp))
+        print("ins    : {}".format(self.instruction_list[self.instruction_ptr]))
+        print("------------")
+        if self.STEP: input("<enter to continue>")
+
+    # Push the instruction pointer onto the stack
+    # Push the previous base function pointer to the stack
+    # Push the previous function pointer to the stack
+    # Take argument pointers
+    # Increment stack ptr +3
+    # Set the function pointer to STP - 1
+    # Set the instruction pointer to <SRC>
+    def _call(self, src):
+        old_bp = self.bp
+        self.bp = self.stp + 1
+        self.stack.push(self.instruction_ptr)
+        self.stack.push(old_bp)
+        self.stack.push(self.fp)
+        self.stp += 3
+        self.fp = self.stp 
+        self.instruction_ptr = src() - 1
+
+    # Set instruction pointer to value at function pointer + 1
+    # Set the stack pointer to function pointer - 1
+    # Set the function pointer to the value at function pointer
+    # Trim stack
+    def _return(self):
+        old_bp = self.bp
+        self.instruction_ptr = self.stack.elements[self.bp]
+        self.fp = self.stack.elements[self.bp + 2]
+        self.stp = self.bp - 1
+        self.bp = self.stack.elements[self.bp + 1]
+        self.stack.truncate(old_bp)
+
+    # The only instruction with the DST argument
+    # Overwrites the specified location with the provided value
+    def _move(self, src, dest):
+        dest(src())
+
+    # Pushes the specified value to the stack, does not overwrite
+    def _push(self, src):
+        self.stack.push(src())
+        self.stp += 1
+
+    # Removes the top value on the stack
+    def _pop(self):
+        self.stack.pop()
+        self.stp -= 1
+
+    # Adds the specified value to acc
+    def _add(self, src):
+        self.acc += src()
+
+    # Subtracts the specified value from acc
+    def _sub(self, src):
+        self.acc -= src()
+
+    # ADD and SUB for the fixed width models. Results which are already in
+    # range, nearly all of them, only cost a comparison
+    def _add_fixed(self, src):
+        acc = self.acc + src()
+        self.acc = acc if self.low <= acc <= self.high else fit_number(self.numbers, acc)
+
+    def _sub_fixed(self, src):
+        acc = self.acc - src()
+        self.acc = acc if self.low <= acc <= self.high else fit_number(self.numbers, acc)
+
+    # Print the specified value as a char
+    def _char_print(self, src):
+        self.output.write(chr(src()))
+
+    # Same for the fixed width models, which report values that are not a
+    # character like any other bad value
+    def _char_print_fixed(self, src):
+        value = src()
+        if not 0 <= value <= 0x10FFFF:
+            raise SourceError(self.instruction_ptr, f'{value} is not a valid character')
+        self.output.write(chr(value))
+
+    # Print the specified value as an integer
+    def _int_print(self, src):
+        self.output.write(str(int(src())))
+
+    # Unconditionally jump to specified location
+    def _jmp(self, target):
+        self.instruction_ptr = target
+
+    # If acc equals zero, jump to specified location
+    def _jez(self, target):
         if self.acc == 0:
-            self.instruction_ptr = self._get_src(src) - 1
+            self.instruction_ptr = target
+
+    # If acc does not equal zero, jump to specified location
+    def _jnz(self, target):
+        if self.acc != 0:
+            self.instruction_ptr = target
+
+    # If acc is greater than zero, jump to specified location
+    def _jgz(self, target):
+        if self.acc > 0:
+            self.instruction_ptr = target
+
+    # If acc is less than zero, jump to specified location
+    def _jlz(self, target):
+        if self.acc < 0:
+            self.instruction_ptr = target
+
+    # Read the next character of input into the specified location, at the
+    # end of the input the location is left alone and acc is set to -1
+    def _read_char(self, dest):
+        value = self.input.read_char()
+        if value is None:
+            self.acc = -1
+        else:
+            dest(fit_number(self.numbers, value))
+
+    # Same for the next integer, whitespace before it is skipped
+    def _read_int(self, dest):
+        try:
+            value = self.input.read_int()
+        except ValueError as err:
+            raise InputError(self.instruction_ptr, f'{err} is not a valid integer')
+        if value is None:
+            self.acc = -1
+        else:
+            dest(fit_number(self.numbers, value))
+
+    # Halt program interperetation
+    def _halt(self):
+        self.do_continue = False
+        self.output.flush()
+
+    # Empty lines and lines with only a tag
+    def _skip(self):
+        pass
+
+    # Decoded in place of lines whose opcode does not exist
+    def _bad_instruction(self, opcode):
+        raise InstructionError(self.instruction_ptr, f'{opcode} is not a valid instruction')
+
+    # Decoded in place of jumps to something that is not a line number
+    def _bad_tag(self, src):
+        raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+
+    # MOV BAK ACC / ADD <n> / MOV ACC BAK
+    def _fused_increment(self, step):
+        self.acc = self.bak = self.bak + step
+        self.instruction_ptr += 2
+
+    # MOV [STP] <DST> / POP
+    def _fused_pop(self, dest):
+        if self.stp >= len(self.stack.elements):
+            raise IdexError(self.instruction_ptr, f'{self.stp} is out of stack bounds')
+        dest(self.stack.elements[self.stp])
+        self.instruction_ptr += 1
+        self.stack.pop()
+        self.stp -= 1
+
+    # MOV BSP ACC / SUB <n> / MOV [ACC] <DST>
+    def _fused_load_argument(self, offset, dest):
+        self.acc = self.bp - offset
+        self.instruction_ptr += 2
+        if self.acc >= len(self.stack.elements):
+            raise IdexError(self.instruction_ptr, f'{self.acc} is out of stack bounds')
+        dest(self.stack.elements[self.acc])
+
+
+
+    # Turn on tracing of hot loops. Every backward jump counts how often it
+    # is taken, and once a loop has gone round threshold times one trip
+    # around it is recorded and compiled into a python function by
+    # TraceCompiler. From then on taking the jump runs the compiled trace
+    # instead, until one of its guards fails and the interpereter carries on.
+    #
+    # Traces never run while debugging, profiling or with hooks added, those
+    # see every line.
+    def jit(self, threshold=100, limit=500):
+        self.jit_threshold = threshold
+        self.jit_limit = limit
+        jumps = (self._jmp, self._jez, self._jnz, self._jgz, self._jlz)
+        for i,(function, args) in enumerate(self.program):
+            if function in jumps and len(args) == 1 and args[0] < i:
+                self.program[i] = (self._hot_jump, (function, args[0]))
+
+    # A backward jump, counting and running traces once it is taken
+    def _hot_jump(self, jump, target):
+        jump(target)
+        if (self.instruction_ptr != target or self.DEBUG or self.debugger or self.profiler or self.hooks
+                or self.limited or self.recorder):
+            return
+
+        # The next line to run, traces return the one they stopped at
+        line = target + 1
+        if line not in self.traces:
+            count = self.hot.get(line, self.jit_threshold) - 1
+            self.hot[line] = count
+            if count > 0:
+                return
+            line = self._record(line)
+
+        trace = self.traces.get(line)
+        while trace:
+            line = trace(self)
+            if line is None:
+                return
+            trace = self.traces.get(line)
+        self.instruction_ptr = line - 1
+
+    # Run the loop starting at header once through the normal instructions,
+    # noting every line and which way every jump went, then compile what
+    # ran. Recording stops early at anything a trace can't hold (CLL, RET,
+    # HLT and bad lines) or at the start of another trace, the trace then
+    # ends by going there. Returns the next line to run.
+    def _record(self, header):
+        traceable = (self._move, self._push, self._pop, self._add, self._sub,
+                     self._char_print, self._int_print, self._skip,
+                     self._add_fixed, self._sub_fixed, self._char_print_fixed,
+                     self._fused_increment, self._fused_pop, self._fused_load_argument)
+        jumps = (self._jmp, self._jez, self._jnz, self._jgz, self._jlz)
+
+        path = []
+        self.instruction_ptr = header
+        while len(path) < self.jit_limit:
+            line = self.instruction_ptr
+            if line >= len(self.program) or (path and (line == header or line in self.traces)):
+                break
+            function, args = self.program[line]
+            if function == self._hot_jump:
+                function, args = args[0], args[1:]
+            if function not in traceable and function not in jumps:
+                break
+            function(*args)
+            if function in jumps:
+                path.append((line, self.instruction_ptr == args[0]))
+            else:
+                # Fused instructions cover more than one line
+                path.extend((covered, None) for covered in range(line, self.instruction_ptr + 1))
+            self.instruction_ptr += 1
+        else:
+            # Too long to be worth it, try again much later
+            self.hot[header] = self.jit_threshold * 10
+            return self.instruction_ptr
+
+        if not path:
+            self.hot[header] = self.jit_threshold * 10
+        else:
+            compiler = TraceCompiler(self.instruction_list, data=len(self.data) > 0, numbers=self.numbers)
+            self.traces[header] = compiler.compile(header, path, self.instruction_ptr)
+        return self.instruction_ptr
+
+
+# The start of every module written by PythonCompiler. The error classes and
+# the input reader are copies of the ones above so the generated module does
+# not need risc.py
+PYTHON_HEADER = """\
+# Generated by risc.py --emit-python from {source}
+#
+# Run it the same way as the original program:
+#   python {module} params...
+import re
+import sys
+
+
+class RiscError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+    def __repr__(self):
+        return '"{{}}", line {{}}'.format(self.message, self.line + 1)
+
+
+class TagError(RiscError): pass
+class InstructionError(RiscError): pass
+class SourceError(RiscError): pass
+class DestError(RiscError): pass
+class IdexError(RiscError): pass
+class InputError(RiscError): pass
+
+
+DATA_BASE = {data_base}
+
+
+def load_data(data, pos, line):
+    offset = pos - DATA_BASE
+    if offset < 0:
+        raise IdexError(line, f'{{pos}} is out of stack bounds')
+    if offset >= len(data):
+        raise IdexError(line, f'{{pos}} is out of data bounds')
+    return data[offset]
+
+
+def store_data(data, pos, element, line):
+    offset = pos - DATA_BASE
+    if offset < 0:
+        raise IdexError(line, f'{{pos}} is out of stack bounds')
+    if offset >= len(data):
+        raise IdexError(line, f'{{pos}} is out of data bounds')
+    if not 0 <= element < 256:
+        raise DestError(line, f'{{element}} does not fit in a data cell')
+    data[offset] = element
+
+
+INTEGER = re.compile(r'\\s*([+-]?[0-9]+)')
+
+
+class InputReader:
+    def __init__(self, stream=None, size=65536):
+        self.stream = stream
+        self.size = size
+        self.buffer = ''
+        self.pos = 0
+
+    def _fill(self):
+        if self.pos < len(self.buffer):
+            return True
+        self.buffer = (self.stream or sys.stdin).read(self.size)
+        self.pos = 0
+        return self.buffer != ''
+
+    def read_char(self):
+        if not self._fill():
+            return None
+        char = self.buffer[self.pos]
+        self.pos += 1
+        return ord(char)
+
+    def read_int(self):
+        match = INTEGER.match(self.buffer, self.pos)
+        if match and match.end() < len(self.buffer):
+            self.pos = match.end()
+            return int(match.group(1))
+        while self._fill() and self.buffer[self.pos].isspace():
+            self.pos += 1
+        if not self._fill():
+            return None
+        text = ''
+        if self.buffer[self.pos] in '+-':
+            text = self.buffer[self.pos]
+            self.pos += 1
+        while self._fill() and self.buffer[self.pos] in '0123456789':
+            text += self.buffer[self.pos]
+            self.pos += 1
+        if text in ('', '+', '-'):
+            raise ValueError(text + (self.buffer[self.pos] if self._fill() else ''))
+        return int(text)
+
+
+# data is the data segment, anything holding bytes like a bytearray or mmap
+def run(parameters=(), write=sys.stdout.write, input=None, data=b''):
+    reader = InputReader(input)
+
+    # Same argc/argv layout Interpereter.params builds
+    stack = [len(parameters)] + [0] * len(parameters)
+    for i,parameter in enumerate(parameters):
+        stack[i+1] = len(stack)
+        stack.extend(ord(char) for char in parameter)
+        stack.append(0)
+
+    acc = 0
+    bak = 0
+    stp = len(stack) - 1
+    fp = stp
+    bp = 0
+    ip = 0
+    while True:
+"""
+
+# Goes after the blocks, where ip is not the start of any of them: either we
+# ran off the end of the program, or RET came back to a line in the middle of
+# a block. The RET at the top of a program does that, so does a return line
+# the program wrote over. Those lines run one at a time until ip lands on the
+# start of a block again. Negative lines count from the end like they do in
+# the interpereter.
+PYTHON_FALLBACK = """\
+        if ip >= {length}:
+            return
+        line = ip + {length} if ip < 0 else ip
+        if line < 0:
+            raise IndexError('list index out of range')
+"""
+
+PYTHON_FOOTER = """\
+
+
+def main():
+    try:
+        run(sys.argv[1:])
+    except (TagError, InstructionError, SourceError, DestError, IdexError, InputError)  as err:
+        print("error: {{}}".format(repr(err)))
+
+
+if __name__ == '__main__':
+    main()
+"""
+
+
+# Ahead of time translation of a parsed program into a python module.
+#
+# The program is split into basic blocks, one for every line something can
+# jump to: line 0, jump and call targets, and the line after every CLL since
+# that is where RET lands. Each block becomes straight-line python working on
+# local variables, and a block that jumps back to its own start becomes a
+# python while loop so hot loops never go back through the block dispatch.
+# A RET can still land anywhere, so every line is also written out on its own
+# for PYTHON_FALLBACK.
+class PythonCompiler:
+    def __init__(self, instruction_list, numbers='unbounded'):
+        self.instruction_list = instruction_list
+        self.numbers = numbers
+        self.low, self.high, _ = NUMBERS[numbers]
+
+        # Same idea as Interpereter.instructions, one function per opcode
+        # which returns the lines of python for that instruction
+        self.instructions = {
+            "MOV":self._move,
+            "PSH":self._push,
+            "POP":self._pop,
+            "ADD":self._add,
+            "SUB":self._sub,
+            "CLL":self._call,
+            "RET":self._return,
+            "CHP":self._char_print,
+            "INP":self._int_print,
+            "JMP":self._jmp,
+            "JEZ":self._jez,
+            "JNZ":self._jnz,
+            "JGZ":self._jgz,
+            "JLZ":self._jlz,
+            "HLT":self._halt,
+            "RDC":self._read_char,
+            "RDI":self._read_int
+        }
+
+        self.leaders = self._find_leaders()
+
+    # Lines that can be jumped to and therefore have to start a block
+    def _find_leaders(self):
+        length = len(self.instruction_list)
+        leaders = {0}
+        for i,tokens in enumerate(self.instruction_list):
+            if not tokens or tokens[0] not in OPERANDS:
+                continue
+            opcode, operands = tokens[0], tokens[1:]
+            if len(operands) != len(OPERANDS[opcode]):
+                continue
+            if OPERANDS[opcode] == (TAG,) and operands[0].isdigit():
+                leaders.add(int(operands[0]))
+            elif opcode == "CLL":
+                kind, value = decode_operand(operands[0])
+                if kind != IMM:
+                    # A computed call can land anywhere
+                    return list(range(length))
+                leaders.add(value)
+                leaders.add(i + 1)
+        return sorted(leader for leader in leaders if leader < length)
+
+    # Write the whole module
+    def emit(self, source='<program>', module='program.py'):
+        lines = PYTHON_HEADER.format(source=source, module=module, data_base=DATA_BASE).splitlines()
+        lines += self._dispatch(self.leaders, 2, self._block)
+        lines += PYTHON_FALLBACK.format(length=len(self.instruction_list)).splitlines()
+        lines += self._dispatch(list(range(len(self.instruction_list))), 2, self._line, 'line')
+        lines += PYTHON_FOOTER.splitlines()
+        return '\n'.join(lines) + '\n'
+
+    # Binary search over the block start lines so finding a block costs
+    # log(blocks) comparisons instead of one per block. translate writes the
+    # code for a single one.
+    def _dispatch(self, leaders, depth, translate, variable='ip'):
+        indent = '    ' * depth
+        if not leaders:
+            return []
+        if len(leaders) == 1:
+            return [f'{indent}if {variable} == {leaders[0]}:'] + translate(leaders[0], depth + 1)
+        middle = len(leaders) // 2
+        return ([f'{indent}if {variable} < {leaders[middle]}:']
+                + self._dispatch(leaders[:middle], depth + 1, translate, variable)
+                + [f'{indent}else:']
+                + self._dispatch(leaders[middle:], depth + 1, translate, variable))
+
+    # A single line for PYTHON_FALLBACK. ip can be negative there, so it
+    # stands in for the line number errors and CLL use.
+    def _line(self, line, depth):
+        self.start = None
+        self.exit = 'continue'
+        tokens = self.instruction_list[line]
+        body = [f"# {line}: {' '.join(tokens)}"] if tokens else []
+        code, done = self._translate('ip', tokens)
+        body += code
+        if not done:
+            body += ['ip += 1', 'continue']
+        indent = '    ' * depth
+        return [indent + code for code in body]
+
+    # Translate the lines from a block start up to the next block start
+    def _block(self, start, depth):
+        following = [leader for leader in self.leaders if leader > start]
+        end = following[0] if following else len(self.instruction_list)
+
+        # Blocks which jump back to their own start loop in python
+        loops = any(self._jump_target(tokens) == start for tokens in self.instruction_list[start:end])
+        self.start = start
+        self.exit = 'break' if loops else 'continue'
+
+        body = []
+        for line in range(start, end):
+            if self.instruction_list[line]:
+                body += [f"# {line}: {' '.join(self.instruction_list[line])}"]
+            code, done = self._translate(line, self.instruction_list[line])
+            body += code
+            if done:
+                break
+        else:
+            # Fall through into the next block
+            body += self._goto(end)
+
+        indent = '    ' * depth
+        if loops:
+            body = ['while True:'] + ['    ' + code for code in body] + ['continue']
+        return [indent + code for code in body]
+
+    def _jump_target(self, tokens):
+        if tokens and OPERANDS.get(tokens[0]) == (TAG,) and tokens[1:2] and tokens[1].isdigit():
+            return int(tokens[1])
+        return None
+
+    # Lines of python for a single instruction, and whether the block ends
+    def _translate(self, line, tokens):
+        if not tokens:
+            return [], False
+        opcode, operands = tokens[0], tokens[1:]
+        if opcode not in self.instructions:
+            return [f'raise InstructionError({line}, {opcode + " is not a valid instruction"!r})'], True
+        if len(operands) != len(OPERANDS[opcode]):
+            message = f'{opcode} takes {len(OPERANDS[opcode])} operands but {len(operands)} were given'
+            return [f'raise TypeError({message!r})'], True
+        for kind, token in zip(OPERANDS[opcode], operands):
+            if kind == TAG and not token.isdigit():
+                return [f'raise TagError({line}, {token + " is not a valid jump location"!r})'], True
+        self.temps = 0
+        return self.instructions[opcode](line, *operands)
+
+    # Leave the block for the one starting at target
+    def _goto(self, target):
+        if target == self.start and self.exit == 'break':
+            return ['continue']
+        if target >= len(self.instruction_list):
+            return ['return']
+        return [f'ip = {target}', self.exit]
+
+    # Lines computing a <SRC> and the expression holding its value. Numbers
+    # are fitted into the numeric model unless fit is off, which it is for
+    # pointers
+    def _src(self, line, token, fit=True):
+        kind, value = decode_operand(token)
+        if kind == IMM:
+            return [], str(fit_number(self.numbers, value) if fit else value)
+        elif kind == REG:
+            return [], {'ACC':'acc', 'BAK':'bak', 'STP':'stp', 'SFP':'fp', 'BSP':'bp',
+                        'DAT':'DATA_BASE', 'DLN':'len(data)'}[value]
+        elif kind == MEM:
+            code, pointer = self._src(line, token[1:-1], False)
+            pos = self._temp()
+            return code + [f'{pos} = {pointer}'], f'(stack[{pos}] if {pos} < len(stack) else load_data(data, {pos}, {line}))'
+        elif value[:1].isdigit():
+            return [], f'int({value!r})'
+        else:
+            return [f'raise SourceError({line}, {value + " is not a valid source value"!r})'], None
+
+    # Lines storing the expression value into a <DST>
+    def _dest(self, line, token, value):
+        kind, operand = decode_operand(token)
+        if kind == REG and operand in ('ACC', 'BAK'):
+            return [f'{operand.lower()} = {value}']
+        elif kind == MEM:
+            code, pointer = self._src(line, token[1:-1], False)
+            if pointer is None:
+                return code
+            pos = self._temp()
+            return code + [f'{pos} = {pointer}',
+                           f'if {pos} < len(stack):',
+                           f'    stack[{pos}] = {value}',
+                           'else:',
+                           f'    store_data(data, {pos}, {value}, {line})']
+        else:
+            return [f'raise DestError({line}, {token + " is not a valid destination value"!r})']
+
+    def _temp(self):
+        self.temps += 1
+        return f'p{self.temps}'
+
+    # A source which has to be read before something else happens is saved
+    # to a temporary so the order of errors stays the same as the interpereter
+    def _value(self, line, token):
+        code, value = self._src(line, token)
+        if value is None or not code:
+            return code, value
+        temp = self._temp()
+        return code + [f'{temp} = {value}'], temp
+
+    def _move(self, line, src, dest):
+        if decode_operand(dest)[0] == MEM:
+            code, value = self._value(line, src)
+        else:
+            code, value = self._src(line, src)
+        if value is None:
+            return code, True
+        return code + self._dest(line, dest, value), False
+
+    def _push(self, line, src):
+        code, value = self._src(line, src)
+        if value is None:
+            return code, True
+        return code + [f'stack.append({value})', 'stp += 1'], False
+
+    def _pop(self, line):
+        return ['stack.pop()', 'stp -= 1'], False
+
+    def _add(self, line, src):
+        code, value = self._src(line, src)
+        if value is None:
+            return code, True
+        return code + [f'acc += {value}'] + self._fit('acc'), False
+
+    def _sub(self, line, src):
+        code, value = self._src(line, src)
+        if value is None:
+            return code, True
+        return code + [f'acc -= {value}'] + self._fit('acc'), False
+
+    # Lines fitting a variable into the numeric model, none when values have
+    # no limit
+    def _fit(self, name):
+        low, high = self.low, self.high
+        if low is None:
+            return []
+        if self.numbers == 'saturate':
+            fitted = f'{high} if {name} > {high} else {low}'
+        else:
+            fitted = f'({name} - {low}) % {high - low + 1} + {low}'
+        return [f'if not {low} <= {name} <= {high}:',
+                f'    {name} = {fitted}']
+
+    # Same frame as Interpereter._call, the saved instruction pointer is the
+    # line of the CLL itself
+    def _call(self, line, src):
+        code = [f'stack.append({line})',
+                'stack.append(bp)',
+                'stack.append(fp)',
+                'bp = stp + 1',
+                'stp += 3',
+                'fp = stp']
+        kind, value = decode_operand(src)
+        if kind == IMM:
+            return code + self._goto(value), True
+        more, value = self._src(line, src)
+        if value is None:
+            return code + more, True
+        return code + more + [f'ip = {value}', self.exit], True
+
+    def _return(self, line):
+        return ['old_bp = bp',
+                'ip = stack[bp] + 1',
+                'fp = stack[bp + 2]',
+                'stp = bp - 1',
+                'bp = stack[bp + 1]',
+                'del stack[old_bp:]',
+                self.exit], True
+
+    def _char_print(self, line, src):
+        if self.low is None:
+            code, value = self._src(line, src)
+        else:
+            code, value = self._value(line, src)
+        if value is None:
+            return code, True
+        if self.low is not None:
+            code += [f'if not 0 <= {value} <= 0x10FFFF:',
+                     f"    raise SourceError({line}, f'{{{value}}} is not a valid character')"]
+        return code + [f'write(chr({value}))'], False
+
+    def _int_print(self, line, src):
+        code, value = self._src(line, src)
+        if value is None:
+            return code, True
+        return code + [f'write(str(int({value})))'], False
+
+    def _jmp(self, line, src):
+        return self._goto(int(src)), True
+
+    def _branch(self, condition, src):
+        return [f'if {condition}:'] + ['    ' + code for code in self._goto(int(src))], False
+
+    def _jez(self, line, src):
+        return self._branch('acc == 0', src)
+
+    def _jnz(self, line, src):
+        return self._branch('acc != 0', src)
+
+    def _jgz(self, line, src):
+        return self._branch('acc > 0', src)
+
+    def _jlz(self, line, src):
+        return self._branch('acc < 0', src)
+
+    def _halt(self, line):
+        return ['return'], True
+
+    # Store a value which was read, or set acc at the end of the input
+    def _stored(self, line, dest, value):
+        return ([f'if {value} is None:',
+                 '    acc = -1',
+                 'else:']
+                + ['    ' + code for code in self._fit(value) + self._dest(line, dest, value)])
+
+    def _read_char(self, line, dest):
+        value = self._temp()
+        return [f'{value} = reader.read_char()'] + self._stored(line, dest, value), False
+
+    def _read_int(self, line, dest):
+        value = self._temp()
+        return (['try:',
+                 f'    {value} = reader.read_int()',
+                 'except ValueError as err:',
+                 f"    raise InputError({line}, f'{{err}} is not a valid integer')"]
+                + self._stored(line, dest, value)), False
+
+# Start of every trace. Registers live in locals while the trace runs and
+# are written back whenever it returns. The lines are indented to go into
+# the try block of TRACE_FOOTER.
+TRACE_HEADER = """\
+def trace(self):
+    acc = self.acc
+    bak = self.bak
+    stp = self.stp
+    fp = self.fp
+    bp = self.bp
+    stack = self.stack.elements
+    data = self.data
+    write = self.output.write
+    try:
+        while True:
+"""
+
+# Leaving a trace. An access out of range, a value too big for the stack
+# array or one which doesn't fit in a data cell puts the registers back as
+# they were before the failing line, which the interpereter then runs
+# itself. That way those errors come out exactly as they always do, and the
+# stack gets widened as usual. Anything else is raised from the failing line
+# like the interpereter would.
+TRACE_FOOTER = """\
+    except (IndexError, OverflowError, ValueError) as error:
+        self.acc = acc
+        self.bak = bak
+        self.stp = stp
+        self.instruction_ptr = LINES[error.__traceback__.tb_lineno] - 1
+        return None
+    except BaseException as error:
+        self.acc = acc
+        self.bak = bak
+        self.stp = stp
+        self.instruction_ptr = LINES.get(error.__traceback__.tb_lineno, START)
+        raise
+    self.acc = acc
+    self.bak = bak
+    self.stp = stp
+    return ip
+"""
+
+
+# Compiles a trace recorded by Interpereter._record into a python function
+# taking the interpereter and returning the next line to run, or None when
+# the interpereter has to run the line the trace stopped on.
+#
+# The path is every line the trace went through in order, with whether it
+# jumped for the jump instructions. Taken jumps become guards leaving the
+# trace when they would not jump, and the other way around. A trace which
+# ends back at its first line loops in python.
+class TraceCompiler(PythonCompiler):
+    # With data set the trace reads and writes the data segment itself,
+    # otherwise only the stack
+    def __init__(self, instruction_list, data=False, numbers='unbounded'):
+        super().__init__(instruction_list, numbers)
+        self.data = data
+
+    def _find_leaders(self):
+        return []
+
+    def compile(self, header, path, end):
+        self.start = header
+        self.exit = 'break'
+        body = []
+        for line, taken in path:
+            tokens = self.instruction_list[line]
+            opcode = tokens[0] if tokens else None
+            if tokens:
+                body += [(line, f"# {line}: {' '.join(tokens)}")]
+            if opcode in ('JEZ', 'JNZ', 'JGZ', 'JLZ'):
+                condition = {'JEZ':'acc == 0', 'JNZ':'acc != 0', 'JGZ':'acc > 0', 'JLZ':'acc < 0'}[opcode]
+                if taken:
+                    condition, target = f'not ({condition})', line + 1
+                else:
+                    target = int(tokens[1])
+                body += [(line, f'if {condition}:'), (line, f'    ip = {target}'), (line, '    break')]
+            elif opcode != 'JMP':
+                code, _ = self._translate(line, tokens)
+                body += [(line, code) for code in code]
+        if end != header:
+            body += [(end, f'ip = {end}'), (end, 'break')]
+        elif all(code.startswith('#') for _, code in body):
+            body += [(header, 'pass')]
+
+        lines = TRACE_HEADER.splitlines()
+        table = {}
+        for line, code in body:
+            lines.append('            ' + code)
+            table[len(lines)] = line
+        lines += TRACE_FOOTER.splitlines()
+
+        namespace = {'LINES':table, 'START':header, 'DATA_BASE':DATA_BASE, 'SourceError':SourceError}
+        exec(compile('\n'.join(lines) + '\n', f'<trace at line {header}>', 'exec'), namespace)
+        return namespace['trace']
+
+    # Accesses out of range raise IndexError, which sends the line back to
+    # the interpereter to report properly, so no bounds checks here
+    def _src(self, line, token, fit=True):
+        if decode_operand(token)[0] == MEM:
+            code, pointer = self._src(line, token[1:-1], False)
+            if not self.data:
+                return code, f'stack[{pointer}]'
+            pos = self._temp()
+            return code + [f'{pos} = {pointer}'], (f'(stack[{pos}] if {pos} < len(stack) else '
+                                                   f'data[{pos} - DATA_BASE] if {pos} >= DATA_BASE else stack[{pos}])')
+        return super()._src(line, token, fit)
+
+    def _dest(self, line, token, value):
+        if decode_operand(token)[0] == MEM:
+            code, pointer = self._src(line, token[1:-1], False)
+            if not self.data:
+                return code + [f'stack[{pointer}] = {value}']
+            pos = self._temp()
+            return code + [f'{pos} = {pointer}',
+                           f'if {pos} < len(stack) or {pos} < DATA_BASE:',
+                           f'    stack[{pos}] = {value}',
+                           'else:',
+                           f'    data[{pos} - DATA_BASE] = {value}']
+        return super()._dest(line, token, value)
+
+
+# Bump whenever parsing changes, so programs cached by an older risc.py are
+# parsed again instead of loaded
+VERSION = 3
+
+
+# Keeps parsed (tag resolved) programs on disk so launching the same program
+# again skips parsing. Files are named after a hash of the interpereter
+# version and the program source, or the bytes of the program file, so an
+# edited program or a new risc.py never loads a stale entry.
+#
+# The file format is a ProgramTable as it is in memory, made to be memory
+# mapped and read without parsing. All numbers are little endian 32 bit
+# unsigned ints:
+#   header              - b'RISC', format version, then the number of lines,
+#                         tokens, distinct strings and tags and the size of
+#                         the string data
+#   line starts         - Index of the first token of every line, plus one
+#                         past the last token
+#   tokens              - Index into the strings for every token
+#   string offsets      - Where every string starts in the string data, plus
+#                         one past the end
+#   tags                - Line of every tag, then its index into the strings
+#   string data         - utf-8, every distinct token then every tag name
+#
+# Files are written to a temporary name and renamed into place, so programs
+# launched at the same time never see a half written file. A file that
+# can't be read is ignored and written again.
+#
+# Every edit of a program makes a new entry, so the directory is kept to
+# size bytes ($RISC_CACHE_SIZE megabytes, 64 by default). Loading an entry
+# touches it, and whenever a write takes the directory over size the
+# entries used longest ago are removed until it is down to three quarters
+# of it, so the next few writes don't have to remove anything.
+class ProgramCache:
+    MAGIC = b'RISC'
+    HEADER = struct.Struct('<4s6I')
+    SIZE = 64 << 20
+
+    def __init__(self, directory=None, size=None):
+        if directory is None:
+            directory = os.environ.get('RISC_CACHE_DIR')
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(base, 'risc_py')
+        if size is None and os.environ.get('RISC_CACHE_SIZE'):
+            size = int(float(os.environ['RISC_CACHE_SIZE']) * (1 << 20))
+        self.directory = directory
+        self.size = self.SIZE if size is None else size
+
+    # Cache key of a program source in a dialect
+    def key(self, source, dialect='risc'):
+        return hashlib.sha256(f'{VERSION}\0{dialect}\0{source}'.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    # Cache key of a program file, hashed as it is read so it never has to
+    # be in memory all at once
+    def file_key(self, filename, dialect='risc'):
+        digest = hashlib.sha256(f'{VERSION}\0{dialect}\0file\0'.encode('utf-8'))
+        with open(filename, 'rb') as program_file:
+            for chunk in iter(lambda: program_file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.rpc')
 
-    # If acc does not equal zero, jump to specified location
-    def _jnz(self, src):
-        if not src.isdigit():
-            raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+    # The ProgramTable for a key, or None if it isn't cached
+    def load(self, key):
+        try:
+            with open(self.path(key), 'rb') as cache_file:
+                with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    table = self._decode(data)
+                # Recently used, for prune()
+                os.utime(cache_file.fileno())
+                return table
+        except (OSError, ValueError, struct.error, UnicodeDecodeError, IndexError):
+            return None
 
-        if self.acc != 0:
-            self.instruction_ptr = self._get_src(src) - 1
+    def _decode(self, data):
+        magic, version, lines, tokens, strings, tags, size = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != VERSION:
+            raise ValueError('not a cached program')
 
-    # If acc is greater than zero, jump to specified location
-    def _jgz(self, src):
-        if not src.isdigit():
-            raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+        def table(offset, count):
+            values = array('I')
+            values.frombytes(data[offset:offset + 4 * count])
+            return values, offset + 4 * count
 
-        if self.acc > 0:
-            self.instruction_ptr = self._get_src(src) - 1
+        offset = self.HEADER.size
+        starts, offset = table(offset, lines + 1)
+        token_strings, offset = table(offset, tokens)
+        string_offsets, offset = table(offset, strings + 1)
+        tag_lines, offset = table(offset, tags)
+        tag_strings, offset = table(offset, tags)
+        if offset + size != len(data) or starts[-1] != tokens or (tokens and max(token_strings) >= strings):
+            raise ValueError('cached program is the wrong size')
 
-    # If acc is less than zero, jump to specified location
-    def _jlz(self, src):
-        if not src.isdigit():
-            raise TagError(self.instruction_ptr, f'{src} is not a valid jump location')
+        text = data[offset:offset + size].decode('utf-8', 'surrogatepass')
+        names = [text[string_offsets[i]:string_offsets[i + 1]] for i in range(strings)]
+        return ProgramTable(names, starts, token_strings, {names[name]:line for line, name in zip(tag_lines, tag_strings)})
 
-        if self.acc < 0:
-            self.instruction_ptr = self._get_src(src) - 1
+    # Save a parsed program. Failing to write (read only home, full disk) is
+    # not worth stopping the program for, it just won't be cached. Programs
+    # with a tag defined twice aren't cached either, so parsing them again
+    # warns about it again.
+    def store(self, key, table):
+        if table.duplicates:
+            return
 
-    # Halt program interperetation
-    def _halt(self):
-        self.do_continue = False
+        # Tag names go after the tokens' strings
+        names = table.strings + list(table.tags)
+        tag_lines = list(table.tags.values())
+        tag_strings = range(len(table.strings), len(names))
+
+        # Offsets count characters, which is what the loader slices by
+        string_offsets = [0]
+        for name in names:
+            string_offsets.append(string_offsets[-1] + len(name))
+        text = ''.join(names).encode('utf-8', 'surrogatepass')
+
+        data = b''.join([self.HEADER.pack(self.MAGIC, VERSION, len(table), len(table.tokens),
+                                          len(names), len(tag_lines), len(text)),
+                         table.starts.tobytes(),
+                         table.tokens.tobytes(),
+                         array('I', string_offsets).tobytes(),
+                         array('I', tag_lines).tobytes(),
+                         array('I', tag_strings).tobytes(),
+                         text])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as cache_file:
+                    cache_file.write(data)
+                os.replace(temporary, self.path(key))
+            except BaseException:
+                os.unlink(temporary)
+                raise
+            self.prune()
+        except OSError:
+            pass
+
+    # Remove the entries used longest ago while the cache is over its size.
+    # Temporary files left behind by a writer that died go too, once they are
+    # an hour old. Other programs can remove the same files at the same time.
+    def prune(self):
+        entries = []
+        stale = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith('.rpc'):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+                elif entry.name.endswith('.tmp') and now - stat.st_mtime > 3600:
+                    stale.append(entry.path)
+        if total > self.size:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.size * 3 // 4:
+                    break
+                stale.append(path)
+                total -= size
+        for path in stale:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+# Snapshots of a run: the program, the registers, the stack and any output
+# not written yet, enough to carry on later exactly where the run was. Also
+# good as a starting point for many runs, every restore gets its own copy.
+# Not in a snapshot: the data segment, how far the input was read, hooks,
+# the profiler and the debugger.
+#
+# The file starts with SNAPSHOT_HEADER, then sections each with a 32 bit
+# length in front, all little endian:
+#   registers           - ip, acc, bak, stp, sfp, bsp and the steps run so
+#                         far as signed ints of any size
+#   program             - Lines of space separated tokens, zlib compressed
+#   tags                - json object of tag name to line
+#   stack               - zlib compressed. The raw cells for an array stack,
+#                         signed ints like the registers for a widened one
+#   output              - Output not written yet, utf-8
+#
+# The program is in the snapshot so a run can be resumed with nothing else.
+SNAPSHOT_MAGIC = b'RSNP'
+
+# The umask can only be read by setting it. Done once here, since snapshots
+# are saved from a background thread.
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+SNAPSHOT_VERSION = 1
+# magic, version, numeric model, stack typecode ('l' for a list), byte order
+# of the stack, whether the program was still running
+SNAPSHOT_HEADER = struct.Struct('<4sH16s1s1s?')
+
+
+def _pack_ints(values):
+    parts = []
+    for value in values:
+        size = (value.bit_length() + 8) // 8
+        parts.append(struct.pack('<I', size) + value.to_bytes(size, 'little', signed=True))
+    return b''.join(parts)
+
+
+def _unpack_ints(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        size, = struct.unpack_from('<I', data, pos)
+        values.append(int.from_bytes(data[pos + 4:pos + 4 + size], 'little', signed=True))
+        pos += 4 + size
+    return values
+
+
+def _pack_sections(sections):
+    return b''.join(struct.pack('<I', len(section)) + section for section in sections)
+
+
+def _unpack_sections(data, pos=0):
+    sections = []
+    while pos < len(data):
+        size, = struct.unpack_from('<I', data, pos)
+        sections.append(data[pos + 4:pos + 4 + size])
+        pos += 4 + size
+    return sections
+
+
+# Stacks are held like snapshots hold them, raw cells or a widened list as
+# signed ints
+def _pack_stack(stack):
+    if isinstance(stack, array):
+        return [stack.typecode.encode('ascii'), stack.tobytes()]
+    return [b'l', _pack_ints(stack)]
+
+
+def _unpack_stack(typecode, data, byteorder):
+    typecode = typecode.decode('ascii')
+    if typecode == 'l':
+        return _unpack_ints(data)
+    stack = array(typecode, data)
+    if byteorder != sys.byteorder[0]:
+        stack.byteswap()
+    return stack
+
+
+class Snapshot:
+    def __init__(self, instruction_list, tags, numbers, registers, stack, output, running=True):
+        self.instruction_list = instruction_list
+        self.tags = tags
+        self.numbers = numbers
+        # ip, acc, bak, stp, fp, bp, steps
+        self.registers = registers
+        # An array or a list, never shared with an interpereter
+        self.stack = stack
+        self.output = output
+        self.running = running
+
+    # Copy the state out of an interpereter between instructions, which is
+    # between calls to run(). Only copies, so the run can go on right away.
+    @classmethod
+    def capture(cls, interpereter):
+        output = interpereter.output
+        pending = ''.join(output.buffer) if isinstance(output, (BufferedOutput, CaptureOutput)) else ''
+        registers = (interpereter.instruction_ptr, interpereter.acc, interpereter.bak, interpereter.stp,
+                     interpereter.fp, interpereter.bp, interpereter.steps)
+        return cls(interpereter.instruction_list, dict(interpereter.tags), interpereter.numbers,
+                   registers, interpereter.stack.elements[:], pending, interpereter.do_continue)
+
+    # Put the interpereter into the state of the snapshot. It has to run the
+    # same program, which it does when it came from interpereter() below.
+    def restore(self, interpereter):
+        interpereter.reset()
+        (interpereter.instruction_ptr, interpereter.acc, interpereter.bak, interpereter.stp,
+         interpereter.fp, interpereter.bp, interpereter.steps) = self.registers
+        interpereter.do_continue = self.running
+        interpereter.stack.elements = self.stack[:]
+        if self.output:
+            interpereter.output.write(self.output)
+
+    # A new interpereter in the state of the snapshot, options are passed on
+    # to Interpereter
+    def interpereter(self, **options):
+        interpereter = Interpereter(self.instruction_list, tags=self.tags, numbers=self.numbers, **options)
+        self.restore(interpereter)
+        return interpereter
+
+    def encode(self):
+        typecode, stack = _pack_stack(self.stack)
+        program = '\n'.join(' '.join(tokens) for tokens in self.instruction_list)
+        sections = [_pack_ints(self.registers),
+                    zlib.compress(program.encode('utf-8', 'surrogatepass'), 1),
+                    json.dumps(self.tags).encode('utf-8'),
+                    zlib.compress(stack, 1),
+                    self.output.encode('utf-8', 'surrogatepass')]
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.numbers.encode('ascii'),
+                                    typecode, sys.byteorder[0].encode('ascii'),
+                                    self.running) + _pack_sections(sections)
+
+    @classmethod
+    def decode(cls, data):
+        magic, version, numbers, typecode, byteorder, running = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('not a snapshot')
+        registers, program, tags, stack, output = _unpack_sections(data, SNAPSHOT_HEADER.size)
+
+        program = zlib.decompress(program).decode('utf-8', 'surrogatepass')
+        instruction_list = [line.split(' ') if line else [] for line in program.split('\n')]
+        stack = _unpack_stack(typecode, zlib.decompress(stack), byteorder.decode('ascii'))
+        return cls(instruction_list, json.loads(tags), numbers.rstrip(b'\0').decode('ascii'),
+                   tuple(_unpack_ints(registers)), stack, output.decode('utf-8', 'surrogatepass'), running)
+
+    # Written to a temporary file and renamed into place like the program
+    # cache, so a crash while saving leaves the last snapshot as it was.
+    # Temporary files are only readable by us, a snapshot gets the mode any
+    # other file we write would.
+    def save(self, path):
+        data = self.encode()
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as snapshot_file:
+                snapshot_file.write(data)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.chmod(temporary, 0o666 & ~UMASK)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as snapshot_file:
+            return cls.decode(snapshot_file.read())
+
+
+# Saves snapshots of a run to a file while it goes on. Capturing one only
+# copies the state, compressing and writing it is done by a thread in the
+# background. A snapshot taken while the last one is still being written
+# replaces any other one waiting, only the newest is worth writing.
+class Checkpointer:
+    def __init__(self, path):
+        import threading
+        self.path = path
+        self.waiting = None
+        self.writing = False
+        self.error = None
+        self.requested = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def save(self, interpereter):
+        snapshot = Snapshot.capture(interpereter)
+        with self.condition:
+            self.waiting = snapshot
+            self.condition.notify_all()
+
+    # Ask for a snapshot at the next chance, safe to call from a signal handler
+    def request(self, *_):
+        self.requested = True
+
+    # Run the interpereter like run() does, saving a snapshot every
+    # instructions (when given) and whenever one was requested. Without every
+    # requests are looked at every CHECK_EVERY instructions. A run stopped by
+    # its budget or deadline is saved too, so it can be carried on later.
+    CHECK_EVERY = 100000
+
+    def run(self, interpereter, every=None):
+        while True:
+            status = interpereter.run(every or self.CHECK_EVERY)
+            if status in ('yielded', 'budget', 'timeout') and (every or self.requested or status != 'yielded'):
+                self.requested = False
+                self.save(interpereter)
+            if status != 'yielded':
+                return status
+
+    # Wait for the last snapshot to be written
+    def close(self):
+        with self.condition:
+            while self.waiting is not None or self.writing:
+                self.condition.wait()
+        if self.error:
+            raise self.error
+
+    def _write(self):
+        while True:
+            with self.condition:
+                while self.waiting is None:
+                    self.condition.wait()
+                snapshot, self.waiting = self.waiting, None
+                self.writing = True
+            try:
+                snapshot.save(self.path)
+            except Exception as err:
+                self.error = err
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+# Recordings of runs, written by Interpereter.record() and read back by
+# Recording, see risc_replay.py for looking at one.
+#
+# A run is cut into chunks of every instructions. Each chunk starts with a
+# keyframe of the whole state at that point and then has the line of every
+# instruction run, what RDC and RDI read and what was printed. Running the
+# same program from a keyframe on the same input does exactly the same
+# thing again, so that is all it takes to get back the registers and stack
+# at any step, and going to a step only means running the rest of one
+# chunk. Writing down every register and stack change instead would have
+# the interpereter loop doing it on every instruction.
+#
+# A chunk is compressed and written by a thread in the background while the
+# run goes on, the interpereter loop only has to remember the line.
+#
+# The file is a run of records, a kind and a length followed by the record:
+#   header              - RECORDING_HEADER, then sections like a snapshot's:
+#                         the steps run before recording started, the program
+#                         and the tags
+#   chunk               - RECORDING_CHUNK, then zlib compressed sections: the
+#                         keyframe, the lines, the input and the output
+#   end                 - zlib compressed sections: how the run stopped, the
+#                         error it stopped on and a keyframe of where it was
+#
+# A recording cut short, say because the process was killed, has every
+# chunk up to the one that was being written and no end.
+#
+# Keyframes are the registers ip, acc, bak, stp, sfp, bsp and whether the
+# program was still running as signed ints of any size, then the stack like
+# a snapshot holds it. Lines are 32 bit ints. The input is a json list of
+# [step, value] for every read, the value None at the end of the input and a
+# string for something RDI couldn't read as an integer. The output is 32 bit
+# ints, the step and the length of every piece printed, then all the text.
+# Steps in a chunk count from its first one.
+RECORDING_MAGIC = b'RREC'
+RECORDING_VERSION = 1
+# magic, version, numeric model, byte order, steps between keyframes
+RECORDING_HEADER = struct.Struct('<4sH16s1sI')
+# kind, size
+RECORDING_RECORD = struct.Struct('<cI')
+# first step, steps
+RECORDING_CHUNK = struct.Struct('<QI')
+RECORD_EVERY = 1 << 16
+
+
+# Passes everything on to the real output, writing it down first
+class RecordedOutput:
+    def __init__(self, output, recorder):
+        self.output = output
+        self.recorder = recorder
+
+    def write(self, text):
+        self.recorder.outputs.extend((len(self.recorder.lines) - 1, len(text)))
+        self.recorder.texts.append(text)
+        self.output.write(text)
+
+    def flush(self): self.output.flush()
+
+
+# Passes on reads from the real input, writing down what they got
+class RecordedInput:
+    def __init__(self, input, recorder):
+        self.input = input
+        self.recorder = recorder
+
+    def read_char(self):
+        value = self.input.read_char()
+        self.recorder.inputs.append([len(self.recorder.lines) - 1, value])
+        return value
+
+    def read_int(self):
+        try:
+            value = self.input.read_int()
+        except ValueError as err:
+            self.recorder.inputs.append([len(self.recorder.lines) - 1, str(err)])
+            raise
+        self.recorder.inputs.append([len(self.recorder.lines) - 1, value])
+        return value
+
+
+# Gives back what a recorded run read, in the same order
+class ReplayedInput:
+    def __init__(self, inputs):
+        self.values = deque(value for _, value in inputs)
+
+    def read_char(self):
+        return self.values.popleft() if self.values else None
+
+    def read_int(self):
+        value = self.values.popleft() if self.values else None
+        if isinstance(value, str):
+            raise ValueError(value)
+        return value
+
+
+# Records an interpereter into a file, see the notes on recordings above.
+# Interpereter._recording_loop fills in the lines, flush() hands a full
+# chunk over to the writer thread. Only a few chunks are ever waiting, a run
+# faster than the disk waits for it instead of filling up memory.
+class Recorder:
+    def __init__(self, path, interpereter, every=None):
+        import queue
+        import threading
+        self.interpereter = interpereter
+        self.every = every or RECORD_EVERY
+        if not 0 < self.every < 1 << 32:
+            raise ValueError(f'{self.every} is not a valid number of steps between keyframes')
+        self.error = None
+        self.failed = None
+
+        # The chunk being filled in
+        self.first = 0
+        self.lines = array('I')
+        self.inputs = []
+        self.outputs = array('I')
+        self.texts = []
+        self.keyframe = self._keyframe()
+
+        program = '\n'.join(' '.join(tokens) for tokens in interpereter.instruction_list)
+        header = RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, interpereter.numbers.encode('ascii'),
+                                       sys.byteorder[0].encode('ascii'), self.every)
+        header += _pack_sections([_pack_ints([interpereter.steps]),
+                                  zlib.compress(program.encode('utf-8', 'surrogatepass'), 1),
+                                  json.dumps(interpereter.tags).encode('utf-8')])
+        self.file = open(path, 'wb')
+        self.file.write(RECORDING_RECORD.pack(b'H', len(header)) + header)
+
+        self.queue = queue.Queue(maxsize=4)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        interpereter.recorder = self
+
+    def _keyframe(self):
+        interpereter = self.interpereter
+        registers = (interpereter.instruction_ptr, interpereter.acc, interpereter.bak, interpereter.stp,
+                     interpereter.fp, interpereter.bp, int(interpereter.do_continue))
+        return registers, interpereter.stack.elements[:]
+
+    # Hand the chunk over to the writer and start the next one from here
+    def flush(self):
+        if not self.lines:
+            return
+        self.queue.put((b'C', (self.first, self.keyframe, self.lines, self.inputs, self.outputs, self.texts)))
+        self.first += len(self.lines)
+        self.lines, self.inputs, self.outputs, self.texts = array('I'), [], array('I'), []
+        self.keyframe = self._keyframe()
+
+    # Stop recording, status is what run() returned or None when it raised.
+    # Waits for everything to be written.
+    def close(self, status=None):
+        self.flush()
+        if status is None:
+            status = 'error' if self.error else 'stopped'
+        self.queue.put((b'E', (status, repr(self.error) if self.error else '', self._keyframe())))
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self.interpereter.recorder = None
+        if self.failed:
+            raise self.failed
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # Keep taking chunks after a failed write so the run never waits
+            if self.failed:
+                continue
+            kind, record = item
+            try:
+                if kind == b'C':
+                    data = self._chunk(*record)
+                else:
+                    data = self._end(*record)
+                self.file.write(RECORDING_RECORD.pack(kind, len(data)) + data)
+            except Exception as err:
+                self.failed = err
+
+    @staticmethod
+    def _chunk(first, keyframe, lines, inputs, outputs, texts):
+        registers, stack = keyframe
+        sections = [_pack_ints(registers)] + _pack_stack(stack)
+        sections += [lines.tobytes(), json.dumps(inputs).encode('utf-8'), outputs.tobytes(),
+                     ''.join(texts).encode('utf-8', 'surrogatepass')]
+        return RECORDING_CHUNK.pack(first, len(lines)) + zlib.compress(_pack_sections(sections))
+
+    @staticmethod
+    def _end(status, error, keyframe):
+        registers, stack = keyframe
+        sections = [status.encode('utf-8'), error.encode('utf-8', 'surrogatepass'), _pack_ints(registers)]
+        return zlib.compress(_pack_sections(sections + _pack_stack(stack)))
+
+
+# One chunk of a recording, see Recording.chunk()
+class Chunk:
+    def __init__(self, first, registers, stack, lines, inputs, outputs, text):
+        self.first = first
+        self.registers = registers
+        self.stack = stack
+        self.lines = lines
+        self.inputs = inputs
+        # (step, length) of every piece printed, and all of it
+        self.outputs = outputs
+        self.text = text
+
+    # Everything printed before step, counted from the start of the chunk
+    def output(self, step):
+        length = 0
+        for i in range(0, len(self.outputs), 2):
+            if self.outputs[i] >= step:
+                break
+            length += self.outputs[i + 1]
+        return self.text[:length]
+
+
+# A recording read back. Only the header and where every chunk is are read
+# up front, chunks are read and decompressed when they are needed.
+#   steps               - Instructions recorded
+#   status, error       - How the run stopped, None when the recording was
+#                         cut short
+class Recording:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        # (first step, steps, offset, size) of every chunk
+        self.chunks = []
+        self.status = None
+        self.error = None
+        self.end = None
+
+        try:
+            header = self._read_record()
+            if header is None or header[0] != b'H':
+                raise ValueError('not a recording')
+            data = header[1]
+            magic, version, numbers, byteorder, self.every = RECORDING_HEADER.unpack_from(data)
+            if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+                raise ValueError('not a recording')
+            start, program, tags = _unpack_sections(data, RECORDING_HEADER.size)
+            self.numbers = numbers.rstrip(b'\0').decode('ascii')
+            self.byteorder = byteorder.decode('ascii')
+            self.start = _unpack_ints(start)[0]
+            program = zlib.decompress(program).decode('utf-8', 'surrogatepass')
+            self.instruction_list = [line.split(' ') if line else [] for line in program.split('\n')]
+            self.tags = json.loads(tags)
+
+            while True:
+                offset = self.file.tell()
+                record = self._read_record(skip=True)
+                if record is None:
+                    break
+                kind, data = record
+                if kind == b'C':
+                    first, steps = data
+                    self.chunks.append((first, steps, offset, self.file.tell() - offset))
+                elif kind == b'E':
+                    status, error, registers, typecode, stack = _unpack_sections(zlib.decompress(data))
+                    self.status = status.decode('utf-8')
+                    self.error = error.decode('utf-8', 'surrogatepass') or None
+                    self.end = (_unpack_ints(registers), _unpack_stack(typecode, stack, self.byteorder))
+            self.size = self.file.tell()
+        except Exception:
+            self.file.close()
+            raise
+        self.firsts = [first for first, _, _, _ in self.chunks]
+        self.steps = self.chunks[-1][0] + self.chunks[-1][1] if self.chunks else 0
+
+    def close(self):
+        self.file.close()
+
+    # The next whole record, or None at the end of the file or of what got
+    # written. With skip only the RECORDING_CHUNK part of a chunk is read.
+    def _read_record(self, skip=False):
+        head = self.file.read(RECORDING_RECORD.size)
+        if len(head) < RECORDING_RECORD.size:
+            return None
+        kind, size = RECORDING_RECORD.unpack(head)
+        if skip and kind == b'C':
+            data = self.file.read(RECORDING_CHUNK.size)
+            end = self.file.seek(size - RECORDING_CHUNK.size, os.SEEK_CUR)
+            if len(data) < RECORDING_CHUNK.size or end > os.fstat(self.file.fileno()).st_size:
+                return None
+            return kind, RECORDING_CHUNK.unpack(data)
+        data = self.file.read(size)
+        if len(data) < size:
+            return None
+        return kind, data
+
+    # 32 bit ints written on a machine with our byte order or the other
+    def _ints(self, data):
+        values = array('I', data)
+        if self.byteorder != sys.byteorder[0]:
+            values.byteswap()
+        return values
+
+    def chunk(self, index):
+        first, steps, offset, size = self.chunks[index]
+        self.file.seek(offset + RECORDING_RECORD.size + RECORDING_CHUNK.size)
+        data = zlib.decompress(self.file.read(size - RECORDING_RECORD.size - RECORDING_CHUNK.size))
+        registers, typecode, stack, lines, inputs, outputs, text = _unpack_sections(data)
+        return Chunk(first, _unpack_ints(registers), _unpack_stack(typecode, stack, self.byteorder),
+                     self._ints(lines), json.loads(inputs), self._ints(outputs),
+                     text.decode('utf-8', 'surrogatepass'))
+
+    # Every chunk in order
+    def __iter__(self):
+        for index in range(len(self.chunks)):
+            yield self.chunk(index)
+
+    # An interpereter at the start of a chunk, ready to run it again
+    def interpereter(self, chunk, **options):
+        snapshot = Snapshot(self.instruction_list, self.tags, self.numbers,
+                            tuple(chunk.registers[:6]) + (self.start + chunk.first,),
+                            chunk.stack, '', bool(chunk.registers[6]))
+        options.setdefault('output', CaptureOutput())
+        return snapshot.interpereter(input=ReplayedInput(chunk.inputs), **options)
+
+    # The state before step ran, after step instructions, as a Snapshot
+    # which can be resumed with risc.py --resume. Steps inside a chunk are
+    # got to by running it again from its keyframe.
+    def state(self, step):
+        if not 0 <= step <= self.steps:
+            raise ValueError(f'step {step} is not in the recording, it has {self.steps} steps')
+        if step == self.steps:
+            if self.end is None:
+                raise ValueError(f'the recording was cut short, step {step} is past the last one kept')
+            registers, stack = self.end
+            return Snapshot(self.instruction_list, self.tags, self.numbers,
+                            tuple(registers[:6]) + (self.start + step,), stack, '', bool(registers[6]))
+
+        import bisect
+        chunk = self.chunk(bisect.bisect_right(self.firsts, step) - 1)
+        interpereter = self.interpereter(chunk)
+        if step > chunk.first:
+            interpereter.run(step - chunk.first)
+        # Anything else is not the program that was recorded
+        if interpereter.instruction_ptr != chunk.lines[step - chunk.first]:
+            raise ValueError(f'step {step} ran line {interpereter.instruction_ptr + 1} '
+                             f'instead of line {chunk.lines[step - chunk.first] + 1}')
+        interpereter.steps = self.start + step
+        snapshot = interpereter.snapshot()
+        # What it printed on the way was printed by the recorded run
+        snapshot.output = ''
+        return snapshot
+
+    # Everything printed before step ran, the whole output when it is None
+    def output(self, step=None):
+        if step is None:
+            step = self.steps
+        texts = []
+        for chunk in self:
+            if chunk.first >= step:
+                break
+            texts.append(chunk.output(step - chunk.first))
+        return ''.join(texts)
+
+
+# Errors a program can stop on, as opposed to bugs in the interpereter
+ERRORS = (TagError, InstructionError, SourceError, DestError, IdexError, InputError, BudgetError)
+
+
+# Batch runs: one program run over many sets of params by a pool of worker
+# processes. Every worker builds one interpereter from the already parsed
+# program when it starts and resets it between runs.
+_batch_interpereter = None
+_batch_data = None
+_batch_limits = (None, None)
+
+def _batch_start(instruction_list, optimize, data=None, numbers='unbounded', limits=(None, None)):
+    global _batch_interpereter, _batch_data, _batch_limits
+    _batch_interpereter = Interpereter(instruction_list, output=CaptureOutput(), numbers=numbers)
+    _batch_data = data
+    _batch_limits = limits
+    if optimize:
+        _batch_interpereter.optimize()
+
+def _batch_run(job):
+    index, parameters = job
+    interpereter = _batch_interpereter
+    interpereter.reset()
+    interpereter.output = CaptureOutput()
+    # Workers all share our stdin, give every run nothing to read instead
+    interpereter.input = InputReader(io.StringIO())
+    # Mapped again for every run so writes from one run don't show up in
+    # the next, mapping costs next to nothing
+    if _batch_data:
+        interpereter.data = map_data(_batch_data)
+    interpereter.params(parameters)
+    interpereter.limit(*_batch_limits)
+    status, error = 'ok', None
+    try:
+        limit_error = interpereter.limit_error(interpereter.run())
+        if limit_error:
+            status, error = 'error', repr(limit_error)
+    except ERRORS as err:
+        status, error = 'error', repr(err)
+    except Exception as err:
+        # Things like POP on an empty stack, which take a normal run down with
+        # a traceback. Keep going with the other runs.
+        status, error = 'crash', f'{type(err).__name__}: {err}'
+    return {"index":index,
+            "params":parameters,
+            "output":interpereter.output.getvalue(),
+            "status":status,
+            "error":error}
+
+
+# Run the instruction list once for every list of params, yields a result
+# dict per run in the same order as param_sets. jobs is the number of worker
+# processes, all cores by default, and 1 runs everything in this process.
+# data is the name of a file every run gets as its data segment, numbers the
+# numeric model they run with and limits the (budget, seconds) for limit().
+def run_batch(instruction_list, param_sets, jobs=None, optimize=False, data=None, numbers='unbounded', limits=(None, None)):
+    jobs = jobs if jobs else os.cpu_count() or 1
+    param_sets = list(param_sets)
+    if jobs == 1 or len(param_sets) < 2:
+        _batch_start(instruction_list, optimize, data, numbers, limits)
+        yield from map(_batch_run, enumerate(param_sets))
+        return
+
+    # Big enough chunks that workers aren't waiting on the queue, small
+    # enough that they all finish around the same time
+    chunksize = max(1, len(param_sets) // (jobs * 8))
+
+    # Imported here, it's slow to import and most runs don't need it
+    import multiprocessing
+    with multiprocessing.Pool(jobs, initializer=_batch_start, initargs=(instruction_list, optimize, data, numbers, limits)) as pool:
+        yield from pool.imap(_batch_run, enumerate(param_sets), chunksize)
+
+
+# Runs many interpereters in this process by taking turns, each one runs a
+# slice of instructions and goes to the back of the line. Nothing a program
+# does can hold up the others for longer than its slice, so they all make
+# progress at the same rate. Budgets and deadlines are set on the
+# interpereters themselves with limit().
+#
+# Interpereters blocked on a port sit out until it is ready. When every one
+# left is blocked none of them can ever go on, and they all stop with a
+# DeadlockError saying which port they were waiting on.
+#
+# run() returns a result dict per interpereter in the order they were added:
+#   name                - As given to add(), the position by default
+#   status              - halted, budget, timeout, deadlock, error or crash
+#   error               - What risc.py would print after error:, or None
+#   steps               - Instructions the program ran
+#
+# Everything a program printed up to where it stopped stays in its output.
+class Scheduler:
+    def __init__(self, slice=10000):
+        self.slice = slice
+        self.queue = deque()
+        self.blocked = []
+        self.results = []
+
+    def add(self, interpereter, name=None):
+        result = {"name":len(self.results) if name is None else name,
+                  "status":None,
+                  "error":None,
+                  "steps":0}
+        self.results.append(result)
+        self.queue.append((interpereter, result))
+
+    def run(self):
+        while self.queue:
+            interpereter, result = self.queue.popleft()
+            status, error = self.turn(interpereter)
+            result["steps"] = interpereter.steps
+            if status == 'yielded':
+                self.queue.append((interpereter, result))
+            elif status == 'blocked':
+                self.blocked.append((interpereter, result))
+            else:
+                result["status"], result["error"] = status, error
+
+            # Whatever that turn sent or took may be what others wait on
+            if self.blocked:
+                waiting = []
+                for entry in self.blocked:
+                    (self.queue if entry[0].ready() else waiting).append(entry)
+                self.blocked = waiting
+
+        for interpereter, result in self.blocked:
+            result["status"], result["error"] = 'deadlock', repr(interpereter.deadlock_error())
+        self.blocked = []
+        return self.results
+
+    # Run one slice, returns (status, error)
+    def turn(self, interpereter):
+        try:
+            status = interpereter.run(self.slice)
+        except ERRORS as err:
+            return 'error', repr(err)
+        except Exception as err:
+            # Like for batch runs, crashes only take down their own program
+            return 'crash', f'{type(err).__name__}: {err}'
+        error = interpereter.limit_error(status)
+        return status, repr(error) if error else None
+
+
+# Networks: TIS-100 style nodes, each running its own program and passing
+# values to the others over ports. A channel joins a port one node writes to
+# with a port another node reads from, and holds up to capacity values.
+# Reading an empty channel or writing a full one waits until the node on the
+# other end has caught up.
+#
+# Programs use ports as @NAME anywhere a register could be read or written,
+# not in brackets and not with CLL:
+#
+#   LOOP:   MOV @IN ACC         'wait for a value
+#           ADD ACC
+#           MOV ACC @OUT        'and pass it on doubled
+#           JMP LOOP
+#
+# Channels have the same four methods wherever they are: ready() when there
+# is a value to read, space() when there is room to write, receive() and
+# send(value). Only the one reader calls the first and third and only the
+# one writer the others.
+class Channel:
+    def __init__(self, capacity=1):
+        self.capacity = capacity
+        self.values = deque()
+
+    def ready(self): return len(self.values) > 0
+    def space(self): return len(self.values) < self.capacity
+    def receive(self): return self.values.popleft()
+    def send(self, value): self.values.append(value)
+
+
+# The same between processes: a ring of 64 bit cells in shared memory, with
+# counts of the values sent and received so far. Only the counts need a
+# lock, a count going up is the other end's cue to look at the cells. The
+# other end is only woken up when it is asleep waiting for that.
+class SharedChannel:
+    def __init__(self, capacity, context):
+        self.capacity = capacity
+        self.cells = context.RawArray('q', capacity)
+        # sent, received, ends asleep in wait()
+        self.counts = context.RawArray('q', 3)
+        self.condition = context.Condition()
+
+    def ready(self): return self.counts[0] > self.counts[1]
+    def space(self): return self.counts[0] - self.counts[1] < self.capacity
+
+    def receive(self):
+        with self.condition:
+            value = self.cells[self.counts[1] % self.capacity]
+            self.counts[1] += 1
+            if self.counts[2]:
+                self.condition.notify_all()
+        return value
+
+    def send(self, value):
+        with self.condition:
+            self.cells[self.counts[0] % self.capacity] = value
+            self.counts[0] += 1
+            if self.counts[2]:
+                self.condition.notify_all()
+
+    # Sleep until there is a value to read, or room to write
+    def wait(self, reading):
+        with self.condition:
+            self.counts[2] += 1
+            self.condition.wait_for(self.ready if reading else self.space)
+            self.counts[2] -= 1
+
+
+# Node states in Network.run_processes, anything else is the index of the
+# port the node is blocked on
+RUNNING = -1
+FINISHED = -2
+
+
+# A network of nodes, built from a topology with load_topology():
+#   nodes               - (name, instruction list, params) for every node
+#   channels            - (writer, port, reader, port, capacity) for every
+#                         channel, by node name and port name
+#   input               - Name of the node RDC and RDI read the input in,
+#                         the others read nothing
+#   dialect             - What the programs were written in, trimmed nodes
+#                         start with an empty stack
+#
+# run() gives a result dict for every node like Scheduler.run() does. Every
+# node prints to the same output, so it's best left to one of them.
+class Network:
+    def __init__(self, nodes, channels, input=None, numbers='unbounded', limits=(None, None), optimize=False, flush_on=None, dialect='risc'):
+        self.nodes = nodes
+        self.dialect = dialect
+        self.channels = channels
+        self.input = input
+        self.numbers = numbers
+        self.limits = limits
+        self.optimize = optimize
+        self.flush_on = flush_on
+        # Every port as (node, @port, channel, reading), the index in here is
+        # how a process says which port it is blocked on
+        self.ports = []
+        for i,(writer, out, reader, inp, capacity) in enumerate(channels):
+            self.ports.append((writer, '@' + out, i, False))
+            self.ports.append((reader, '@' + inp, i, True))
+
+    # The interpereter for a node, with its ports on the given channels
+    def interpereter(self, index, channels, input=None):
+        name, instruction_list, parameters = self.nodes[index]
+        ports = {port[1:]:(channels[channel], reading) for node, port, channel, reading in self.ports if node == name}
+        if name != self.input:
+            input = InputReader(io.StringIO(''))
+        interpereter = Interpereter(instruction_list, output=BufferedOutput(flush_on=self.flush_on), input=input,
+                                    tags=getattr(instruction_list, 'tags', None), numbers=self.numbers, ports=ports,
+                                    dialect=self.dialect)
+        if self.optimize:
+            interpereter.optimize()
+        interpereter.params(parameters)
+        interpereter.limit(*self.limits)
+        return interpereter
+
+    # Every mistake in every node as (name, error), before running anything
+    def validate(self):
+        channels = [Channel(capacity) for *_, capacity in self.channels]
+        errors = []
+        for index, (name, _, _) in enumerate(self.nodes):
+            errors.extend((name, error) for error in self.interpereter(index, channels).validate())
+        return errors
+
+    # A process for every node when there is more than one, and more than
+    # one core to run them on, and processes are allowed. The in process
+    # scheduler otherwise.
+    def run(self, processes=True, input=None, slice=10000):
+        if processes and len(self.nodes) > 1 and (os.cpu_count() or 1) > 1:
+            return self.run_processes(input, slice)
+        return self.run_scheduled(input, slice)
+
+    def run_scheduled(self, input=None, slice=10000):
+        channels = [Channel(capacity) for *_, capacity in self.channels]
+        scheduler = Scheduler(slice)
+        for index, (name, _, _) in enumerate(self.nodes):
+            scheduler.add(self.interpereter(index, channels, input), name)
+        return scheduler.run()
+
+    # Every node in a process of its own. Nodes publish what they are
+    # blocked on in shared memory, and we look in on them every POLL
+    # seconds: when every node still running is blocked on a port that
+    # can't go, and nothing was sent or received since the last look, it
+    # is a deadlock and they are all stopped.
+    POLL = 0.02
+
+    def run_processes(self, input=None, slice=10000):
+        import multiprocessing
+        context = multiprocessing.get_context()
+        channels = [SharedChannel(capacity, context) for *_, capacity in self.channels]
+        count = len(self.nodes)
+        # Node state, the line it is on and the steps it ran, kept up to date
+        # whenever it blocks
+        states = context.RawArray('q', [RUNNING] * count)
+        lines = context.RawArray('q', count)
+        steps = context.RawArray('q', count)
+        finished = context.Queue()
+
+        # Child processes don't get our stdin. Ones started by fork share
+        # our other files, so the input node gets a copy of its file
+        # descriptor, otherwise all of the input read up front.
+        input = input or InputReader()
+        if self.input is None:
+            input = None
+        elif context.get_start_method() == 'fork':
+            if input.stream is None:
+                input.stream = os.fdopen(os.dup(sys.stdin.fileno()), encoding=sys.stdin.encoding)
+        else:
+            input = InputReader(io.StringIO(input.read_rest()))
+
+        sys.stdout.flush()
+        processes = [context.Process(target=_run_node, args=(self, index, channels, states, lines, steps, finished, input, slice), daemon=True)
+                     for index in range(count)]
+        for process in processes:
+            process.start()
+
+        results = [{"name":name, "status":None, "error":None, "steps":0} for name, _, _ in self.nodes]
+        done = 0
+        last = None
+        try:
+            while done < count:
+                time.sleep(self.POLL)
+                while not finished.empty():
+                    index, status, error, ran = finished.get()
+                    results[index].update(status=status, error=error, steps=ran)
+                    done += 1
+
+                # A process which died without saying so
+                for index, process in enumerate(processes):
+                    if results[index]["status"] is None and process.exitcode is not None and states[index] != FINISHED:
+                        results[index].update(status='crash', error=f'node process died with exit code {process.exitcode}', steps=steps[index])
+                        states[index] = FINISHED
+                        done += 1
+
+                now = (states[:], [channel.counts[:] for channel in channels])
+                if done < count and now == last and self._deadlocked(*now):
+                    for index, state in enumerate(now[0]):
+                        if state >= 0 and results[index]["status"] is None:
+                            _, port, _, reading = self.ports[state]
+                            error = DeadlockError(lines[index], f'blocked {"reading" if reading else "writing"} {port}')
+                            results[index].update(status='deadlock', error=repr(error), steps=steps[index])
+                    break
+                last = now
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        # Nodes which finished while we were stopping the rest
+        while not finished.empty():
+            index, status, error, ran = finished.get()
+            if results[index]["status"] is None:
+                results[index].update(status=status, error=error, steps=ran)
+        return results
+
+    # Whether every node not finished is blocked on a port that can't go
+    def _deadlocked(self, states, counts):
+        for state in states:
+            if state == RUNNING:
+                return False
+            if state == FINISHED:
+                continue
+            _, _, channel, reading = self.ports[state]
+            sent, received, _ = counts[channel]
+            if (sent > received) if reading else (sent - received < self.channels[channel][4]):
+                return False
+        return True
+
+
+# One node of Network.run_processes
+def _run_node(network, index, channels, states, lines, steps, finished, input, slice):
+    status, error = None, None
+    interpereter = None
+    try:
+        interpereter = network.interpereter(index, channels, input)
+        ports = {port:i for i,(node, port, _, _) in enumerate(network.ports) if node == network.nodes[index][0]}
+        while True:
+            status = interpereter.run(slice)
+            steps[index] = interpereter.steps
+            if status == 'yielded':
+                continue
+            if status != 'blocked':
+                break
+            port, channel, reading = interpereter.blocked
+            lines[index] = interpereter.instruction_ptr
+            states[index] = ports[port]
+            channel.wait(reading)
+            states[index] = RUNNING
+        error = interpereter.limit_error(status)
+        error = repr(error) if error else None
+    except ERRORS as err:
+        status, error = 'error', repr(err)
+    except Exception as err:
+        status, error = 'crash', f'{type(err).__name__}: {err}'
+    finished.put((index, status, error, interpereter.steps if interpereter else 0))
+    finished.close()
+    finished.join_thread()
+    states[index] = FINISHED
+
+
+# Load a network from a topology file, json like:
+#
+#   {"nodes": {"double": "double.risc",
+#              "print": {"program": "print.risc", "params": ["x"]}},
+#    "channels": [["double.OUT", "print.IN"],
+#                 ["print.ACK", "double.ACK", 4]],
+#    "capacity": 1,
+#    "input": "double"}
+#
+# Programs are found relative to the topology file. A channel is the writing
+# node and port, the reading node and port and optionally its capacity,
+# "capacity" is the one for the others and 1 by default. Nodes without
+# params of their own get params, and every program is written in dialect.
+# Anything wrong with the topology is a ValueError.
+def load_topology(filename, params=(), dialect='risc', **options):
+    with open(filename) as topology_file:
+        topology = json.load(topology_file)
+    if not isinstance(topology, dict) or not isinstance(topology.get("nodes"), dict) or not topology["nodes"]:
+        raise ValueError('a topology needs a "nodes" object naming at least one node')
+
+    def capacity(value):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError(f'{value!r} is not a valid channel capacity')
+        return value
+    default = capacity(topology.get("capacity", 1))
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    nodes = []
+    for name, node in topology["nodes"].items():
+        if isinstance(node, str):
+            node = {"program":node}
+        if not isinstance(node, dict) or not isinstance(node.get("program"), str):
+            raise ValueError(f'node {name} needs a program')
+        with open(os.path.join(directory, node["program"])) as program_file:
+            table = parse_program(program_file, dialect=dialect)
+        nodes.append((name, table, [str(parameter) for parameter in node.get("params", params)]))
+
+    names = {name for name, _, _ in nodes}
+    used = set()
+    def port(end):
+        node, _, name = str(end).partition('.')
+        if node not in names or not name:
+            raise ValueError(f'{end} is not a node and port like node.PORT')
+        if (node, name) in used:
+            raise ValueError(f'{end} is on more than one channel')
+        used.add((node, name))
+        return node, name
+
+    channels = []
+    for channel in topology.get("channels", []):
+        if not isinstance(channel, list) or len(channel) not in (2, 3):
+            raise ValueError(f'{channel!r} is not a channel, it should be [writer, reader] or [writer, reader, capacity]')
+        writer = port(channel[0])
+        reader = port(channel[1])
+        channels.append(writer + reader + (capacity(channel[2]) if len(channel) == 3 else default,))
+
+    input = topology.get("input")
+    if input is not None and input not in names:
+        raise ValueError(f'input {input} is not a node')
+    if dialect == 'trimmed' and any(parameters for _, _, parameters in nodes):
+        raise ValueError("trimmed programs don't take params")
+    return Network(nodes, channels, input, dialect=dialect, **options)
+
+
+# Read a batch file, one set of params per line. A line holding a json list,
+# or a json object with a "params" list, is used as is. Anything else is split
+# like a shell would split it. A blank line is a run without params, so the
+# index of every result is the line it came from, counting from 0.
+def read_batch(filename):
+    import shlex
+    param_sets = []
+    with open(filename) as batch_file:
+        for line in batch_file:
+            line = line.strip()
+            if line[:1] in ('[', '{'):
+                parameters = json.loads(line)
+                if isinstance(parameters, dict):
+                    parameters = parameters["params"]
+                param_sets.append([str(parameter) for parameter in parameters])
+            else:
+                param_sets.append(shlex.split(line))
+    return param_sets
+
+
+# Server mode: risc.py --serve listens on a unix socket and runs programs for
+# clients like risc_client.py, so runs don't pay for starting python and
+# parsing the program every time.
+#
+# Every connection sends requests and gets replies, one json object per line.
+# A request is
+#   {"program":path} or {"source":text}
+#                       - The program to run, paths should be absolute
+#   "params":[...]      - Params for the program, none by default
+#   "input":text        - What RDC and RDI read, nothing by default
+#   "budget":n          - Stop with an error after n instructions
+#   "seconds":n         - Stop with an error after n seconds
+#
+# and the replies to it are
+#   {"output":text}     - Whatever the program printed, as it prints it
+#   {"status":s, "errors":[...]}
+#                       - Last, s is ok, error or crash like for batch runs and
+#                         errors holds what risc.py would print after error:
+#
+# A pool of worker processes all accept connections on the one socket. Each
+# worker keeps the programs it ran last, decoded and validated, keyed by
+# path, modification time and size, or by a hash of the source.
+
+# Where the server listens and the client connects unless told otherwise
+def default_socket():
+    if os.environ.get('RISC_SOCKET'):
+        return os.environ['RISC_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, f'risc_py-{os.getuid()}.sock')
+
+
+# Sends everything written to it to the client as output replies
+class ReplyStream(io.TextIOBase):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, text):
+        send_reply(self.connection, {"output":text})
+        return len(text)
+
+
+def send_reply(connection, reply):
+    connection.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class Server:
+    # options are passed on to every Interpereter, optimize and jit are done
+    # once for every program that gets cached
+    def __init__(self, cache_size=64, cache=None, optimize=False, jit=False, numbers='unbounded', dialect='risc'):
+        self.cache_size = cache_size
+        self.cache = cache
+        self.optimize = optimize
+        self.jit = jit
+        self.numbers = numbers
+        self.dialect = dialect
+        # key -> (interpereter, validation errors), least recently used first
+        self.programs = {}
+
+    # The interpereter and validation errors for a request, parsed only
+    # when it isn't one of the recent programs
+    def program(self, request):
+        if "source" in request:
+            source = request["source"]
+            key = hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+            path = None
+        else:
+            path = request["program"]
+            status = os.stat(path)
+            key = (path, status.st_mtime_ns, status.st_size)
+            source = None
+
+        found = self.programs.pop(key, None)
+        if found is None:
+            found = self._load(source, path)
+            while len(self.programs) >= self.cache_size:
+                del self.programs[next(iter(self.programs))]
+        # Dicts keep their order, so putting it back makes it the newest
+        self.programs[key] = found
+        return found
+
+    # Parse a source, or the file at path when there is none
+    def _load(self, source, path):
+        key = None
+        if self.cache:
+            key = self.cache.key(source, self.dialect) if source is not None else self.cache.file_key(path, self.dialect)
+        table = self.cache.load(key) if key else None
+        if table is None:
+            if source is None:
+                with open(path) as program_file:
+                    table = parse_program(program_file, dialect=self.dialect)
+            else:
+                table = parse_program(source, dialect=self.dialect)
+            if key:
+                self.cache.store(key, table)
+        interpereter = Interpereter(table, output=CaptureOutput(), tags=table.tags, numbers=self.numbers, dialect=self.dialect)
+        errors = interpereter.validate()
+        if self.optimize:
+            interpereter.optimize()
+        if self.jit:
+            interpereter.jit()
+        return interpereter, errors
+
+    # Answer requests until the client hangs up
+    def handle(self, connection):
+        with connection, connection.makefile('r', encoding='utf-8') as requests:
+            for line in requests:
+                if line.strip():
+                    status, errors = self.run(line, connection)
+                    send_reply(connection, {"status":status, "errors":errors})
+
+    # Run one request, returns (status, errors)
+    def run(self, line, connection):
+        try:
+            request = json.loads(line)
+            interpereter, errors = self.program(request)
+            parameters = [str(parameter) for parameter in request.get("params", [])]
+            budget = request.get("budget")
+            seconds = request.get("seconds")
+            if parameters and self.dialect == 'trimmed':
+                raise ValueError("trimmed programs don't take params")
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as err:
+            return 'error', [f'bad request: {err}']
+        except TagError as err:
+            return 'error', [repr(err)]
+        if errors:
+            return 'error', [repr(err) for err in errors]
+
+        interpereter.reset()
+        interpereter.output = BufferedOutput(ReplyStream(connection), flush_on='line')
+        interpereter.input = InputReader(io.StringIO(request.get("input", "")))
+        interpereter.limit(budget, seconds)
+
+        try:
+            interpereter.params(parameters)
+            limit_error = interpereter.limit_error(interpereter.run())
+            if limit_error:
+                return 'error', [repr(limit_error)]
+            return 'ok', []
+        except ERRORS as err:
+            return 'error', [repr(err)]
+        except Exception as err:
+            # Anything but the client going away is the program's fault,
+            # like POP on an empty stack
+            if isinstance(err, OSError):
+                raise
+            return 'crash', [f'{type(err).__name__}: {err}']
+        finally:
+            interpereter.output = CaptureOutput()
+
+    # Accept connections on listener until interrupted
+    def serve(self, listener):
+        try:
+            while True:
+                connection, _ = listener.accept()
+                try:
+                    self.handle(connection)
+                except OSError:
+                    # The client hung up on us, on to the next one
+                    pass
+        except KeyboardInterrupt:
+            pass
+
+
+# Listen on path and serve with jobs worker processes, all cores by default.
+# A socket file left behind by a server which is gone is replaced.
+def serve(path, jobs=None, **options):
+    import signal
+    import socket
+    import multiprocessing
+    # Being killed stops the server the same way ctrl-c does, so the socket
+    # file is always cleaned up
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+        else:
+            raise OSError(f'something is already listening on {path}')
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    jobs = jobs if jobs else os.cpu_count() or 1
+    workers = []
+    try:
+        if jobs == 1:
+            Server(**options).serve(listener)
+            return
+        for _ in range(jobs):
+            worker = multiprocessing.Process(target=Server(**options).serve, args=(listener,), daemon=True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        listener.close()
+        os.unlink(path)
+
+
+# risc.py --nodes, the file and params after the topology are all params
+# for the nodes
+def run_nodes(parser, args):
+    if (args.batch or args.resume or args.checkpoint or args.emit_python or args.debug or args.step
+            or args.profile or args.profile_json or args.jit or args.data or args.record):
+        parser.error("--nodes can't be used with --batch, --resume, --checkpoint, --emit-python, "
+                     "--debug, --step, --profile, --jit, --data or --record")
+    params = [args.File] + args.Params if args.File is not None else []
+    try:
+        network = load_topology(args.nodes, params, args.dialect, numbers=args.numbers, limits=(args.budget, args.timeout),
+                                optimize=args.optimize, flush_on=args.flush)
+    except (OSError, ValueError) as err:
+        parser.error(f"can't load {args.nodes}: {err}")
+    except TagError as err:
+        parser.error(f"can't load {args.nodes}: {repr(err)}")
+
+    if not args.no_validate:
+        errors = network.validate()
+        for name, err in errors:
+            print("error: {}: {}".format(name, repr(err)))
+        if errors:
+            return
+
+    input = InputReader(open(args.input, newline='') if args.input else None)
+    for result in network.run(processes=args.jobs != 1, input=input):
+        if result["status"] == 'deadlock':
+            print("deadlock: {}: {}".format(result["name"], result["error"]))
+        elif result["error"]:
+            print("error: {}: {}".format(result["name"], result["error"]))
 
 
 # Setup for interperetation
@@ -481,8 +4141,171 @@ def main():
                         default=False,
                         help="Enable stepping in debug mode")
 
+    parser.add_argument("--flush",
+                        choices=("halt", "line", "size"),
+                        default=None,
+                        help="When to write buffered program output, by default on every line for terminals and in large pieces otherwise")
+
+    parser.add_argument("--trace",
+                        metavar="n",
+                        type=int,
+                        default=None,
+                        help="Keep the last n instructions and print them if the program stops on an error")
+
+    parser.add_argument("-b",
+                        "--break",
+                        dest="breakpoints",
+                        metavar="tag",
+                        action="append",
+                        default=[],
+                        help="Stop at a tag or line number, may be given more than once")
+
+    parser.add_argument("-w",
+                        "--watch",
+                        dest="watches",
+                        metavar="location",
+                        action="append",
+                        default=[],
+                        help="Stop whenever a register or stack cell ([n]) changes, may be given more than once")
+
+    parser.add_argument("-p",
+                        "--profile",
+                        action="store_true",
+                        default=False,
+                        help="Print execution counts and times per line, opcode, tag and function when the program stops")
+
+    parser.add_argument("--profile-json",
+                        metavar="file",
+                        default=None,
+                        help="Also write the profile to a json file")
+
+    parser.add_argument("--no-validate",
+                        action="store_true",
+                        default=False,
+                        help="Don't check the program before running it, errors are only reported when a bad line runs")
+
+    parser.add_argument("-O",
+                        "--optimize",
+                        action="store_true",
+                        default=False,
+                        help="Fuse common instruction sequences before running, ignored when debugging or profiling")
+
+    parser.add_argument("--jit",
+                        action="store_true",
+                        default=False,
+                        help="Compile hot loops into python while running, ignored when debugging or profiling")
+
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        default=False,
+                        help="Always parse the program instead of loading it from the cache of parsed programs")
+
+    parser.add_argument("--strict-tags",
+                        action="store_true",
+                        default=False,
+                        help="Stop with an error on a tag defined twice instead of warning and using the last one")
+
+    parser.add_argument("--dialect",
+                        choices=DIALECTS,
+                        default='risc',
+                        help="What the program is written in: risc (the default), or trimmed with STK and jumps counted from 1")
+
+    parser.add_argument("--input",
+                        metavar="file",
+                        default=None,
+                        help="Read RDC and RDI input from file instead of stdin")
+
+    parser.add_argument("--data",
+                        metavar="file",
+                        default=None,
+                        help="Map file into memory as the data segment, one cell per byte starting at [DAT]")
+
+    parser.add_argument("--numbers",
+                        choices=tuple(NUMBERS),
+                        default='unbounded',
+                        help="What values can hold: any integer (the default), wrapping 32 or 64 bit integers, or -999 to 999 saturating like the TIS-100")
+
+    parser.add_argument("--budget",
+                        metavar="n",
+                        type=int,
+                        default=None,
+                        help="Stop the program with an error after n instructions, for every run with --batch")
+
+    parser.add_argument("--timeout",
+                        metavar="seconds",
+                        type=float,
+                        default=None,
+                        help="Stop the program with an error after this many seconds, for every run with --batch")
+
+    parser.add_argument("--checkpoint",
+                        metavar="file",
+                        default=None,
+                        help="Save snapshots of the run to file, on SIGUSR1 and every --checkpoint-every instructions")
+
+    parser.add_argument("--checkpoint-every",
+                        metavar="n",
+                        type=int,
+                        default=None,
+                        help="Instructions between snapshots for --checkpoint")
+
+    parser.add_argument("--record",
+                        metavar="file",
+                        default=None,
+                        help="Record everything the run does into file, to look at with risc_replay.py")
+
+    parser.add_argument("--record-every",
+                        metavar="n",
+                        type=int,
+                        default=None,
+                        help=f"Instructions between keyframes for --record, {RECORD_EVERY} by default")
+
+    parser.add_argument("--resume",
+                        metavar="snapshot",
+                        default=None,
+                        help="Carry on the run saved in a snapshot instead of running a file, params are ignored")
+
+    parser.add_argument("--batch",
+                        metavar="file",
+                        default=None,
+                        help="Run the program once for every line of params in file and print the results as json lines,"
+                             " the index of a result is its line counting from 0 and a blank line runs it without params")
+
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=None,
+                        help="Worker processes for --batch and --serve, all cores by default. With --nodes, 1 runs every node in this process")
+
+    parser.add_argument("--simd",
+                        action="store_true",
+                        default=False,
+                        help="Run --batch in lockstep over numpy arrays instead of a process per core, needs numpy")
+
+    parser.add_argument("--serve",
+                        metavar="socket",
+                        nargs="?",
+                        const=True,
+                        default=None,
+                        help="Run programs for risc_client.py on a unix socket instead of running a file, see --jobs")
+
+    parser.add_argument("--nodes",
+                        metavar="topology",
+                        default=None,
+                        help="Run a network of programs joined by ports as laid out in a json topology file, a process per node")
+
+    parser.add_argument("--cache-size",
+                        type=int,
+                        default=64,
+                        help="Programs every --serve worker keeps decoded, 64 by default")
+
+    parser.add_argument("--emit-python",
+                        metavar="module",
+                        default=None,
+                        help="Translate the program into a python module instead of running it")
+
     parser.add_argument("File", 
                         metavar="file", 
+                        nargs="?",
                         help="The filename of the program to interperet")
 
     parser.add_argument("Params",
@@ -494,14 +4317,165 @@ def main():
 
     if args.debug: print(args)
 
-    with open(args.File,'r') as program_file:
-        program = program_file.read()
-    interpereter = Interpereter(program, DEBUG=args.debug, STEP=args.step)
-    interpereter.params(args.Params)
+    if args.serve:
+        path = default_socket() if args.serve is True else args.serve
+        cache = None if args.no_cache else ProgramCache()
+        try:
+            serve(path, args.jobs, cache_size=args.cache_size, cache=cache,
+                  optimize=args.optimize, jit=args.jit, numbers=args.numbers, dialect=args.dialect)
+        except OSError as err:
+            parser.error(str(err))
+        return
+
+    if args.nodes:
+        run_nodes(parser, args)
+        return
+
+    if args.File is None and not args.resume:
+        parser.error("the following arguments are required: file")
+    if args.resume and args.batch:
+        parser.error("--resume can't be used with --batch")
+    if args.dialect == 'trimmed' and (args.Params or args.batch):
+        parser.error("trimmed programs don't take params, so they can't be given any or used with --batch")
+    # Everything else looks at every line through its own loop, and writes
+    # to the data segment aren't recorded
+    if args.record and (args.batch or args.data or args.debug or args.step or args.trace or args.breakpoints
+                        or args.watches or args.profile or args.profile_json):
+        parser.error("--record can't be used with --batch, --data, --debug, --step, --trace, --break, --watch or --profile")
+
+    # DAT and the cells after it are far outside what 32 bits or -999 to 999
+    # can point at
+    if args.data and args.numbers in ('wrap32', 'saturate'):
+        parser.error(f"--data can't be used with --numbers {args.numbers}")
+
+    output = BufferedOutput(flush_on=args.flush)
+    input = InputReader(open(args.input, newline='') if args.input else None)
+    data = map_data(args.data) if args.data else None
+    profile = args.profile or args.profile_json is not None
+    # A snapshot brings its own program, and its numeric model
+    if args.resume:
+        try:
+            snapshot = Snapshot.load(args.resume)
+        except (OSError, ValueError, struct.error, zlib.error) as err:
+            parser.error(f"can't resume from {args.resume}: {err}")
+        interpereter = snapshot.interpereter(DEBUG=args.debug, STEP=args.step, output=output, profile=profile, input=input, data=data)
+    else:
+        # Load the parsed program from the cache if we've seen it before,
+        # otherwise parse it straight out of the file
+        cache = None if args.no_cache else ProgramCache()
+        key = cache.file_key(args.File, args.dialect) if cache else None
+        table = cache.load(key) if cache else None
+        if table is None:
+            try:
+                with open(args.File,'r') as program_file:
+                    table = parse_program(program_file, args.strict_tags, args.dialect)
+            except TagError as err:
+                print("error: {}".format(repr(err)))
+                return
+            if cache:
+                cache.store(key, table)
+        for tag, earlier, line in table.duplicates:
+            print(f"warning: {tag} is a tag on line {earlier + 1} and again on line {line + 1}, using line {line + 1}", file=sys.stderr)
+        interpereter = Interpereter(table, DEBUG=args.debug, STEP=args.step, output=output, profile=profile, tags=table.tags, input=input, data=data, numbers=args.numbers, dialect=args.dialect)
+
+    # Report every mistake in the program at once, before running anything
+    if not args.no_validate:
+        errors = interpereter.validate()
+        if errors:
+            for err in errors:
+                print("error: {}".format(repr(err)))
+            return
+
+    if args.batch and args.simd:
+        # numpy is only needed here, so it's not needed to run risc.py at all
+        try:
+            import simd
+        except ImportError:
+            parser.error("--simd needs numpy")
+        if args.data:
+            parser.error("--simd can't be used with --data")
+        if args.numbers != 'unbounded':
+            parser.error("--simd can't be used with --numbers")
+        if args.budget or args.timeout:
+            parser.error("--simd can't be used with --budget or --timeout")
+        for result in simd.run_lockstep(interpereter.instruction_list, read_batch(args.batch), args.jobs):
+            print(json.dumps(result))
+        return
+
+    if args.batch:
+        for result in run_batch(interpereter.instruction_list, read_batch(args.batch), args.jobs, args.optimize, args.data, args.numbers, (args.budget, args.timeout)):
+            print(json.dumps(result))
+        return
+
+    if args.emit_python:
+        compiler = PythonCompiler(interpereter.instruction_list, args.numbers)
+        with open(args.emit_python, 'w') as module_file:
+            module_file.write(compiler.emit(args.File, args.emit_python))
+        return
+
+    # Recordings have every line, fused or traced ones would be missing
+    if args.optimize and not (args.debug or profile or args.trace or args.breakpoints or args.watches or args.record):
+        for first, last, name in interpereter.optimize():
+            print("fused {} at lines {}-{}".format(name, first + 1, last + 1), file=sys.stderr)
+
+    # Runs with limits or checkpoints go in pieces which traces can't stop
+    # part way through, so they would never run anyway
+    if args.jit and (args.checkpoint or args.budget or args.timeout):
+        print("warning: --jit is ignored with --checkpoint, --budget and --timeout", file=sys.stderr)
+    elif args.jit and not (args.debug or profile or args.trace or args.breakpoints or args.watches or args.record):
+        interpereter.jit()
+
+    # A resumed run already has its params
+    if not args.resume:
+        interpereter.params(args.Params)
+    interpereter.limit(args.budget, args.timeout)
+
+    # After params so the watches start from the values the program sees
+    if args.trace or args.breakpoints or args.watches:
+        try:
+            interpereter.debugger = Debugger(interpereter,
+                                             trace_size=args.trace or 100,
+                                             breakpoints=args.breakpoints,
+                                             watches=args.watches)
+        except (TagError, SourceError) as err:
+            parser.error(err.message)
+
+    recorder = None
+    if args.record:
+        try:
+            recorder = interpereter.record(args.record, args.record_every)
+        except OSError as err:
+            parser.error(f"can't record to {args.record}: {err}")
+
+    checkpointer = None
+    if args.checkpoint:
+        checkpointer = Checkpointer(args.checkpoint)
+        # kill -USR1 saves a snapshot without stopping the run
+        import signal
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, checkpointer.request)
+
+    status = None
     try:
-        interpereter.run()
-    except (TagError, InstructionError, SourceError, DestError, IdexError)  as err:
+        if checkpointer:
+            status = checkpointer.run(interpereter, args.checkpoint_every)
+        else:
+            status = interpereter.run()
+        limit_error = interpereter.limit_error(status)
+        if limit_error:
+            print("error: {}".format(repr(limit_error)))
+    except ERRORS as err:
         print("error: {}".format(repr(err)))
+    finally:
+        if checkpointer:
+            checkpointer.close()
+        if recorder:
+            recorder.close(status)
+        if interpereter.profiler:
+            sys.stdout.flush()
+            interpereter.profiler.report()
+            if args.profile_json:
+                interpereter.profiler.write_json(args.profile_json)
 
 
 if __name__ == '__main__':
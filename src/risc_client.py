@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+
+
+# Client for risc.py --serve. Runs a program the same way risc.py does, same
+# output and same errors, but on a server which already has python started
+# and the program parsed:
+#
+#   python risc.py --serve &
+#   python risc_client.py program.risc params...
+#
+# Only imports what it needs so it starts as fast as python can.
+
+
+# Same as risc.default_socket, without importing risc
+def default_socket():
+    if os.environ.get('RISC_SOCKET'):
+        return os.environ['RISC_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, f'risc_py-{os.getuid()}.sock')
+
+
+# Send one request to the server at path and yield the replies to it as they
+# come in, the last one is the status. request is a dict like the server
+# takes, see the server mode notes in risc.py.
+def request(path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('r', encoding='utf-8') as replies:
+            for line in replies:
+                reply = json.loads(line)
+                yield reply
+                if "status" in reply:
+                    return
+    raise ConnectionError('the server hung up before finishing')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a program on a risc.py --serve server")
+    parser.add_argument("-S",
+                        "--socket",
+                        default=None,
+                        help="Socket the server listens on, $RISC_SOCKET or the same default as the server")
+
+    parser.add_argument("--budget",
+                        type=int,
+                        default=None,
+                        help="Stop the program with an error after this many instructions")
+
+    parser.add_argument("--timeout",
+                        metavar="seconds",
+                        type=float,
+                        default=None,
+                        help="Stop the program with an error after this many seconds")
+
+    parser.add_argument("--input",
+                        metavar="file",
+                        default=None,
+                        help="Send file as the input for RDC and RDI, - for stdin. Nothing by default")
+
+    parser.add_argument("File",
+                        metavar="file",
+                        help="The filename of the program to run")
+
+    parser.add_argument("Params",
+                        metavar="params",
+                        nargs='*',
+                        help="Parameters for the program")
+
+    args = parser.parse_args()
+
+    message = {"program":os.path.abspath(args.File), "params":args.Params}
+    if args.budget:
+        message["budget"] = args.budget
+    if args.timeout:
+        message["seconds"] = args.timeout
+    if args.input == '-':
+        message["input"] = sys.stdin.read()
+    elif args.input:
+        with open(args.input, newline='') as input_file:
+            message["input"] = input_file.read()
+
+    try:
+        for reply in request(args.socket or default_socket(), message):
+            if "output" in reply:
+                sys.stdout.write(reply["output"])
+                sys.stdout.flush()
+            elif reply["status"] == 'crash':
+                # risc.py would have gone down with a traceback
+                sys.stderr.write('\n'.join(reply["errors"]) + '\n')
+                sys.exit(1)
+            else:
+                for error in reply["errors"]:
+                    print("error: {}".format(error))
+    except OSError as err:
+        sys.exit(f'risc_client.py: {err}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import sys
+import argparse
+from collections import Counter
+
+import risc
+
+
+# Looks at recordings made with risc.py --record:
+#
+#   python risc.py --record run.rrec program.risc params...
+#   python risc_replay.py run.rrec info
+#   python risc_replay.py run.rrec state 1500
+#   python risc_replay.py run.rrec summary
+#
+# Steps count instructions from where recording started, the state at step n
+# is the one before the instruction at step n ran. Going to a step only reads
+# the chunk it is in, however long the run was.
+
+
+def info(recording, args):
+    print("program   : {} lines".format(len(recording.instruction_list)))
+    print("numbers   : {}".format(recording.numbers))
+    print("steps     : {}".format(recording.steps))
+    print("chunks    : {} of {} steps".format(len(recording.chunks), recording.every))
+    print("size      : {} bytes".format(recording.size))
+    if recording.status is None:
+        print("stopped   : unknown, the recording was cut short")
+    else:
+        print("stopped   : {}".format(recording.status))
+    if recording.error:
+        print("error     : {}".format(recording.error))
+
+
+def state(recording, args):
+    snapshot = recording.state(args.step)
+    ip, acc, bak, stp, fp, bp, _ = snapshot.registers
+    stack = snapshot.stack
+    tokens = recording.instruction_list[ip] if 0 <= ip < len(recording.instruction_list) else None
+    print("step   : {} of {}".format(args.step, recording.steps))
+    if tokens is None:
+        print("line   : {} (past the end)".format(ip + 1))
+    else:
+        print("line   : {}  {}".format(ip + 1, ' '.join(tokens)))
+    print("acc  A : {}".format(acc))
+    print("bak  K : {}".format(bak))
+    print("stp  T : {}".format(stp))
+    print("sfp  F : {}".format(fp))
+    print("sbp  B : {}".format(bp))
+    if not snapshot.running:
+        print("halted")
+    shown = list(stack[-args.cells:]) if args.cells else list(stack)
+    print("stack  : {} cells".format(len(stack)))
+    for pos, cell in enumerate(shown, len(stack) - len(shown)):
+        print("  [{}] {}".format(pos, cell))
+    if args.snapshot:
+        snapshot.save(args.snapshot)
+
+
+def output(recording, args):
+    sys.stdout.write(recording.output(args.step))
+    sys.stdout.flush()
+
+
+# Name of the function starting at a line
+def function_name(names, line):
+    return names.get(line, f'line {line + 1}')
+
+
+# Hot lines, how deep the stack was for how many steps and who called who
+def summary(recording, args):
+    instruction_list = recording.instruction_list
+    names = {line:tag for tag, line in recording.tags.items()}
+    calls = {line for line, tokens in enumerate(instruction_list) if tokens[:1] == ['CLL']}
+    returns = {line for line, tokens in enumerate(instruction_list) if tokens[:1] == ['RET']}
+
+    counts = Counter()
+    # Stack size -> steps spent at it
+    depths = Counter()
+    # Every node of the call tree is [calls, instructions, children by name]
+    root = [1, 0, {}]
+    frames = [(root, 0)]
+    calling = False
+    for chunk in recording:
+        counts.update(chunk.lines)
+
+        for step, line in enumerate(chunk.lines, chunk.first):
+            if calling:
+                node = frames[-1][0][2].setdefault(function_name(names, line), [0, 0, {}])
+                node[0] += 1
+                frames.append((node, step))
+                calling = False
+            if line in calls:
+                calling = True
+            elif line in returns and len(frames) > 1:
+                node, start = frames.pop()
+                node[1] += step + 1 - start
+
+        # Stack sizes aren't in the recording, running the chunk again shows
+        # them. The size after every instruction counts for its step. The
+        # last chunk stops the way the run did, python errors included.
+        interpereter = recording.interpereter(chunk)
+        interpereter.add_hook('instruction', lambda event: depths.update((event.stp + 1,)))
+        try:
+            interpereter.run(len(chunk.lines))
+        except Exception:
+            pass
+    # Calls that never returned count up to the end
+    while frames:
+        node, start = frames.pop()
+        node[1] += recording.steps - start
+
+    print("{} steps".format(recording.steps))
+
+    print()
+    print("{:>6} {:>10} {:>7}  {}".format("line", "count", "share", "instruction"))
+    for line, count in counts.most_common(args.top):
+        print("{:>6} {:>10} {:>6.1%}  {}".format(line + 1, count, count / recording.steps,
+                                                  ' '.join(instruction_list[line])))
+
+    print()
+    print("{:>13} {:>10}".format("stack cells", "steps"))
+    buckets = Counter()
+    for depth, steps in depths.items():
+        low = 1 << (depth.bit_length() - 1) if depth else 0
+        buckets[low] += steps
+    for low in sorted(buckets):
+        high = low * 2 - 1 if low > 1 else low
+        span = str(low) if high == low else f'{low}-{high}'
+        print("{:>13} {:>10}".format(span, buckets[low]))
+
+    if root[2]:
+        print()
+        print("{:>10} {:>12}  {}".format("calls", "instructions", "function"))
+        def show(children, depth):
+            for name, (count, instructions, grandchildren) in sorted(children.items(), key=lambda item: -item[1][1]):
+                print("{:>10} {:>12}  {}{}".format(count, instructions, '  ' * depth, name))
+                if depth + 1 < args.depth:
+                    show(grandchildren, depth + 1)
+                elif grandchildren:
+                    print("{:>10} {:>12}  {}...".format('', '', '  ' * (depth + 1)))
+        show(root[2], 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look at a recording made with risc.py --record")
+    parser.add_argument("File",
+                        metavar="recording",
+                        help="The recording to read")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("info",
+                        help="How long the run was and how it stopped")
+
+    command = commands.add_parser("state",
+                                  help="The registers and stack before a step ran")
+    command.add_argument("step",
+                         type=int,
+                         help="Instructions run before it, from where recording started")
+    command.add_argument("--cells",
+                         type=int,
+                         default=16,
+                         help="Stack cells to show from the top, 0 for all of them, 16 by default")
+    command.add_argument("--snapshot",
+                         metavar="file",
+                         default=None,
+                         help="Also save the state as a snapshot, which risc.py --resume carries on from")
+
+    command = commands.add_parser("output",
+                                  help="What the program printed")
+    command.add_argument("step",
+                         type=int,
+                         nargs="?",
+                         default=None,
+                         help="Only what it printed before this step")
+
+    command = commands.add_parser("summary",
+                                  help="Hot lines, stack sizes and the call tree")
+    command.add_argument("--top",
+                         type=int,
+                         default=10,
+                         help="Hottest lines to show, 10 by default")
+    command.add_argument("--depth",
+                         type=int,
+                         default=8,
+                         help="Levels of the call tree to show, 8 by default")
+
+    args = parser.parse_args()
+
+    try:
+        recording = risc.Recording(args.File)
+    except (OSError, ValueError, risc.struct.error, risc.zlib.error) as err:
+        sys.exit(f"risc_replay.py: can't read {args.File}: {err}")
+    try:
+        {"info":info, "state":state, "output":output, "summary":summary}[args.command](recording, args)
+    except ValueError as err:
+        sys.exit(f"risc_replay.py: {err}")
+    finally:
+        recording.close()
+
+
+if __name__ == '__main__':
+    main()
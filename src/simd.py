@@ -0,0 +1,311 @@
+import numpy as np
+
+import risc
+
+
+# Lockstep engine, runs one program over many sets of params at once.
+#
+# Every set of params gets a lane. The registers are numpy arrays with one
+# element per lane and the stacks are the rows of one 2d array, laid out the
+# same way Interpereter.params lays them out. Each step runs one line of the
+# program for every lane whose instruction pointer is on that line, so the
+# cost of going through an instruction is shared by all of them. The line
+# picked is the lowest any lane is on, lanes which jumped ahead wait there for
+# the others to catch up.
+#
+# Anything out of the ordinary takes a lane out of the lockstep run: errors,
+# values getting close to what 64 bits can hold, jumps to negative lines.
+# Those lanes are run again from the start by risc.run_batch, so every lane
+# ends with exactly the output, status and error a normal run would give.
+
+
+# Values stay below this so adding two of them can never overflow an int64
+LIMIT = 1 << 62
+
+# Instruction pointer of lanes which are done, bigger than any program
+DONE = np.iinfo(np.int64).max
+
+
+class Lockstep:
+    def __init__(self, instruction_list, param_sets, jobs=None):
+        self.instruction_list = instruction_list
+        self.jobs = jobs
+        self.param_sets = [list(parameters) for parameters in param_sets]
+        lanes = len(self.param_sets)
+
+        # Same opcodes as Interpereter.instructions, every function takes the
+        # lanes on the line and its operands
+        self.instructions = {
+            "MOV":self._move,
+            "PSH":self._push,
+            "POP":self._pop,
+            "ADD":self._add,
+            "SUB":self._sub,
+            "CLL":self._call,
+            "RET":self._return,
+            "CHP":self._char_print,
+            "INP":self._int_print,
+            "JMP":self._jmp,
+            "JEZ":self._jez,
+            "JNZ":self._jnz,
+            "JGZ":self._jgz,
+            "JLZ":self._jlz,
+            "HLT":self._halt,
+            "RDC":self._read,
+            "RDI":self._read
+        }
+        self.program = [self._decode(tokens) for tokens in instruction_list]
+
+        self.ip = np.zeros(lanes, dtype=np.int64)
+        self.acc = np.zeros(lanes, dtype=np.int64)
+        self.bak = np.zeros(lanes, dtype=np.int64)
+        self.stp = np.full(lanes, -1, dtype=np.int64)
+        self.fp = np.zeros(lanes, dtype=np.int64)
+        self.bp = np.zeros(lanes, dtype=np.int64)
+        self.stack = np.zeros((lanes, 64), dtype=np.int64)
+        self.ejected = np.zeros(lanes, dtype=bool)
+        self.output = [[] for _ in range(lanes)]
+        self.params()
+
+    # Same argc/argv layout Interpereter.params builds, one row per lane
+    def params(self):
+        for lane, parameters in enumerate(self.param_sets):
+            cells = [len(parameters)] + [0] * len(parameters)
+            for i,parameter in enumerate(parameters):
+                cells[i+1] = len(cells)
+                cells.extend(ord(char) for char in parameter)
+                cells.append(0)
+            self._reserve(len(cells))
+            self.stack[lane, :len(cells)] = cells
+            self.stp[lane] = len(cells) - 1
+            self.fp[lane] = len(cells) - 1
+
+    # Make room for stacks of at least size cells
+    def _reserve(self, size):
+        if size <= self.stack.shape[1]:
+            return
+        capacity = self.stack.shape[1]
+        while capacity < size:
+            capacity *= 2
+        stack = np.zeros((self.stack.shape[0], capacity), dtype=np.int64)
+        stack[:, :self.stack.shape[1]] = self.stack
+        self.stack = stack
+
+    # Lanes which have to be run again by the normal interpereter
+    def _eject(self, lanes):
+        self.ejected[lanes] = True
+        self.ip[lanes] = DONE
+
+    # Eject the bad lanes, returns what is left of lanes and values
+    def _keep(self, lanes, values, bad):
+        if bad is None or not bad.any():
+            return lanes, values
+        self._eject(lanes[bad])
+        return lanes[~bad], values[~bad]
+
+    def run(self):
+        length = len(self.program)
+        while True:
+            line = self.ip.min()
+            if line >= length:
+                break
+            lanes = np.flatnonzero(self.ip == line)
+            function, args = self.program[line]
+            self.ip[lanes] = line + 1
+            function(line, lanes, *args)
+
+        # Lanes which fell off the end or halted are done, everything else
+        # gets a normal run
+        ejected = np.flatnonzero(self.ejected).tolist()
+        results = [{"index":index,
+                    "params":parameters,
+                    "output":''.join(self.output[index]),
+                    "status":'ok',
+                    "error":None} for index, parameters in enumerate(self.param_sets)]
+        rerun = risc.run_batch(self.instruction_list, [self.param_sets[index] for index in ejected], self.jobs)
+        for index, result in zip(ejected, rerun):
+            result["index"] = index
+            results[index] = result
+        return results
+
+    # Decode a line into (function, operands) like Interpereter._decode, with
+    # every operand turned into a function of the lanes
+    def _decode(self, tokens):
+        if not tokens:
+            return (self._skip, ())
+        opcode, operands = tokens[0], tokens[1:]
+        if opcode not in self.instructions or len(operands) != len(risc.OPERANDS[opcode]):
+            return (self._bad, ())
+        args = []
+        for kind, token in zip(risc.OPERANDS[opcode], operands):
+            if kind == risc.TAG:
+                if not token.isdigit():
+                    return (self._bad, ())
+                args.append(int(token))
+            elif kind == risc.SRC:
+                args.append(self._decode_src(token))
+            else:
+                args.append(self._decode_dest(token))
+        return (self.instructions[opcode], tuple(args))
+
+    # A function of the lanes returning (values, bad), bad marks lanes which
+    # would have stopped on an error or None when none would
+    def _decode_src(self, token):
+        kind, value = risc.decode_operand(token)
+        if kind == risc.IMM and abs(value) < LIMIT:
+            return lambda lanes: (np.full(len(lanes), value, dtype=np.int64), None)
+        elif kind == risc.REG:
+            if value == 'DAT':
+                return lambda lanes: (np.full(len(lanes), risc.DATA_BASE, dtype=np.int64), None)
+            if value == 'DLN':
+                return lambda lanes: (np.zeros(len(lanes), dtype=np.int64), None)
+            register = {'ACC':'acc', 'BAK':'bak', 'STP':'stp', 'SFP':'fp', 'BSP':'bp'}[value]
+            return lambda lanes: (getattr(self, register)[lanes], None)
+        elif kind == risc.MEM:
+            pointer = self._decode_src(token[1:-1])
+            def load(lanes):
+                pos, bad = self._address(lanes, pointer)
+                return self.stack[lanes, pos], bad
+            return load
+        else:
+            return lambda lanes: (np.zeros(len(lanes), dtype=np.int64), np.ones(len(lanes), dtype=bool))
+
+    # A function of the lanes and values storing them, ejects the lanes it
+    # can't store to
+    def _decode_dest(self, token):
+        kind, value = risc.decode_operand(token)
+        if kind == risc.REG and value in ('ACC', 'BAK'):
+            register = value.lower()
+            def store(lanes, values):
+                getattr(self, register)[lanes] = values
+            return store
+        elif kind == risc.MEM:
+            pointer = self._decode_src(token[1:-1])
+            def store(lanes, values):
+                pos, bad = self._address(lanes, pointer)
+                if bad is not None and bad.any():
+                    self._eject(lanes[bad])
+                    lanes, pos, values = lanes[~bad], pos[~bad], values[~bad]
+                self.stack[lanes, pos] = values
+            return store
+        else:
+            def bad_dest(lanes, values):
+                self._eject(lanes)
+            return bad_dest
+
+    # Stack positions a pointer points at. Negative positions count from the
+    # top of the stack like they do on the python array in Interpereter.
+    def _address(self, lanes, pointer):
+        pos, bad = pointer(lanes)
+        size = self.stp[lanes] + 1
+        pos = np.where(pos < 0, pos + size, pos)
+        out = (pos < 0) | (pos >= size)
+        bad = out if bad is None else bad | out
+        return np.where(bad, 0, pos), bad
+
+    def _move(self, line, lanes, src, dest):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        dest(lanes, values)
+
+    def _push(self, line, lanes, src):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        self._reserve(int(self.stp[lanes].max(initial=0)) + 2)
+        self.stp[lanes] += 1
+        self.stack[lanes, self.stp[lanes]] = values
+
+    def _pop(self, line, lanes):
+        empty = self.stp[lanes] < 0
+        lanes, _ = self._keep(lanes, lanes, empty)
+        self.stp[lanes] -= 1
+
+    def _add(self, line, lanes, src):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        self.acc[lanes] += values
+        self._keep(lanes, lanes, np.abs(self.acc[lanes]) >= LIMIT)
+
+    def _sub(self, line, lanes, src):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        self.acc[lanes] -= values
+        self._keep(lanes, lanes, np.abs(self.acc[lanes]) >= LIMIT)
+
+    # Same frame as Interpereter._call, the target is read after the frame
+    # is pushed
+    def _call(self, line, lanes, src):
+        self._reserve(int(self.stp[lanes].max(initial=0)) + 4)
+        stp = self.stp[lanes]
+        self.stack[lanes, stp + 1] = line
+        self.stack[lanes, stp + 2] = self.bp[lanes]
+        self.stack[lanes, stp + 3] = self.fp[lanes]
+        self.bp[lanes] = stp + 1
+        self.stp[lanes] = stp + 3
+        self.fp[lanes] = stp + 3
+        targets, bad = src(lanes)
+        lanes, targets = self._keep(lanes, targets, bad)
+        lanes, targets = self._keep(lanes, targets, targets < 0)
+        self.ip[lanes] = targets
+
+    def _return(self, line, lanes):
+        bp = self.bp[lanes]
+        lanes, bp = self._keep(lanes, bp, (bp < 0) | (bp + 2 > self.stp[lanes]))
+        targets = self.stack[lanes, bp] + 1
+        lanes, bp = self._keep(lanes, bp, targets < 0)
+        self.ip[lanes] = self.stack[lanes, bp] + 1
+        self.fp[lanes] = self.stack[lanes, bp + 2]
+        self.stp[lanes] = bp - 1
+        self.bp[lanes] = self.stack[lanes, bp + 1]
+
+    def _char_print(self, line, lanes, src):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        lanes, values = self._keep(lanes, values, (values < 0) | (values > 0x10FFFF))
+        for lane, value in zip(lanes.tolist(), values.tolist()):
+            self.output[lane].append(chr(value))
+
+    def _int_print(self, line, lanes, src):
+        values, bad = src(lanes)
+        lanes, values = self._keep(lanes, values, bad)
+        for lane, value in zip(lanes.tolist(), values.tolist()):
+            self.output[lane].append(str(value))
+
+    def _jmp(self, line, lanes, target):
+        self.ip[lanes] = target
+
+    def _branch(self, lanes, target, taken):
+        self.ip[lanes[taken]] = target
+
+    def _jez(self, line, lanes, target):
+        self._branch(lanes, target, self.acc[lanes] == 0)
+
+    def _jnz(self, line, lanes, target):
+        self._branch(lanes, target, self.acc[lanes] != 0)
+
+    def _jgz(self, line, lanes, target):
+        self._branch(lanes, target, self.acc[lanes] > 0)
+
+    def _jlz(self, line, lanes, target):
+        self._branch(lanes, target, self.acc[lanes] < 0)
+
+    def _halt(self, line, lanes):
+        self.ip[lanes] = DONE
+
+    # Batch runs have no input, so every read is at the end of it
+    def _read(self, line, lanes, dest):
+        self.acc[lanes] = -1
+
+    def _skip(self, line, lanes):
+        pass
+
+    # Lines which always stop with an error
+    def _bad(self, line, lanes):
+        self._eject(lanes)
+
+
+# Same as risc.run_batch, but running the param sets in lockstep. Returns a
+# list of result dicts in the same order as param_sets. jobs is only used for
+# the lanes which have to be run again.
+def run_lockstep(instruction_list, param_sets, jobs=None):
+    return Lockstep(instruction_list, param_sets, jobs).run()